@@ -0,0 +1,64 @@
+################################################################################
+# Command line of the benchmarks
+################################################################################
+"""Runs the benchmark suite and writes its results as JSON:
+
+     python -m src.benchmark [-s 100,1000,10000] [-d depth] [-f fanout]
+                             [-r repeat] [-o results.json]"""
+
+# packages
+import getopt
+import json
+import logging
+import sys
+
+from src.benchmark.runner import runBenchmarks
+
+def Usage():
+    logger = logging.getLogger('PyRules')
+    logger.info('python -m src.benchmark [options]')
+    logger.info(' List of options:')
+    logger.info('   ** -s or --sizes  : comma-separated model sizes (default 100,1000,10000)')
+    logger.info('   ** -d or --depth  : layers of internal parameters (default 4)')
+    logger.info('   ** -f or --fanout : parameters per formula (default 3)')
+    logger.info('   ** -r or --repeat : measurements per stage (default 5)')
+    logger.info('   ** -o or --output : JSON output file (default: standard output)')
+
+def main():
+    logging.basicConfig(format='%(message)s')
+    logger = logging.getLogger('PyRules')
+    logger.setLevel(logging.INFO)
+    try:
+        optlist, _ = getopt.getopt(sys.argv[1:], 's:d:f:r:o:h',
+            ['sizes=', 'depth=', 'fanout=', 'repeat=', 'output=', 'help'])
+        sizes, depth, fanout, repeat, output = [100, 1000, 10000], 4, 3, 5, None
+        for o, a in optlist:
+            if o in ['-s', '--sizes']:
+                sizes = [int(x) for x in a.split(',') if x]
+            elif o in ['-d', '--depth']:
+                depth = int(a)
+            elif o in ['-f', '--fanout']:
+                fanout = int(a)
+            elif o in ['-r', '--repeat']:
+                repeat = int(a)
+            elif o in ['-o', '--output']:
+                output = a
+            elif o in ['-h', '--help']:
+                Usage()
+                return
+    except (getopt.GetoptError, ValueError) as err:
+        logger.error(err)
+        Usage()
+        sys.exit(1)
+
+    results = runBenchmarks(sizes, depth, fanout, repeat)
+    if output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+        logger.info('Results written to ' + output)
+
+if __name__ == '__main__':
+    main()
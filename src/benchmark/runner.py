@@ -0,0 +1,215 @@
+################################################################################
+# Benchmarks of the model pipeline
+################################################################################
+"""Timings of the successive stages of the handling of a model (loading, block
+   construction, evaluation, incremental updates, card writing, command
+   dispatch) on synthetic models of increasing size."""
+
+# packages
+import io
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from src.benchmark.synthetic import generateModelSource
+from src.parameter import evaluator, loader
+from src.parameter.evaluator import ParameterEvaluator
+from src.parameter.loader import buildModel, loadModelSpecs, parseModelSource
+from src.parameter.parameter import ExternParam, Model
+from src.parameter.slha import cardFromBlocks, writeParamCard
+
+def timeCall (function, repeat = 5, number = 1, setup = None) :
+    """
+    Parameters
+    ----------
+    function: callable
+      The function to time, called without arguments
+    repeat: int
+      The number of measurements
+    number: int
+      The number of calls per measurement
+    setup: callable
+      If given, called (untimed) before each measurement
+
+    Returns
+    -------
+    An OrderedDict with the best and median time of a single call (in seconds)
+    """
+    times = []
+    for _ in range(repeat) :
+        if setup is not None :
+            setup()
+        start = time.perf_counter()
+        for _ in range(number) :
+            function()
+        times.append((time.perf_counter() - start) / number)
+    times.sort()
+    return OrderedDict([('best', times[0]), ('median', times[len(times) // 2]),
+        ('repeat', repeat), ('number', number)])
+
+def benchmarkModel (size, depth = 4, fanout = 3, repeat = 5, directory = None) :
+    """
+    Parameters
+    ----------
+    size: int
+      The number of parameters of the synthetic model
+    depth, fanout: int
+      The shape of the dependency graph (see generateModelSource)
+    repeat: int
+      The number of measurements of each stage
+    directory: str
+      The directory where the model file is written, by default a temporary one
+
+    Returns
+    -------
+    An OrderedDict describing the model and the timings of each stage
+    """
+    prefix = 'BENCH%d_' % size
+    source, externNames, internNames = generateModelSource(size, depth, fanout,
+        prefix = prefix)
+    ownDirectory = directory is None
+    if ownDirectory :
+        directory = tempfile.mkdtemp(prefix = 'pyrules-bench-')
+    path = os.path.join(directory, 'parameters_%d.py' % size)
+    with open(path, 'w') as stream :
+        stream.write(source)
+
+    timings = OrderedDict()
+    try :
+        # Loading: parsing, cold (cache miss), warm (disk cache hit) and in-memory
+        # file loading
+        timings['parse'] = timeCall(lambda : parseModelSource(source), repeat)
+        cacheDirectory = os.path.join(directory, '.pyrules_cache')
+        def clearCache (disk) :
+            loader.g_modelSpecs.clear()
+            if disk :
+                shutil.rmtree(cacheDirectory, ignore_errors = True)
+        timings['loadCold'] = timeCall(lambda : loadModelSpecs(path), repeat,
+            setup = lambda : clearCache(True))
+        specs = loadModelSpecs(path)
+        timings['loadWarm'] = timeCall(lambda : loadModelSpecs(path), repeat,
+            setup = lambda : clearCache(False))
+        timings['loadMemory'] = timeCall(lambda : loadModelSpecs(path), repeat)
+
+        # Parameter objects and Les Houches blocks
+        timings['build'] = timeCall(lambda : buildModel(specs, model = Model()),
+            repeat)
+        def insertAll (bulk) :
+            model = Model()
+            block = model.block(prefix + 'INSERT')
+            params = [ExternParam(1., block.name, insert = False, model = model)
+                for _ in externNames]
+            if bulk :
+                block.bulkInsert(params)
+            else :
+                for param in params :
+                    block.insertExternParam(param)
+        timings['blockInsert'] = timeCall(lambda : insertAll(False), repeat)
+        timings['blockBulkInsert'] = timeCall(lambda : insertAll(True), repeat)
+        model = Model()
+        parameters = buildModel(specs, model = model)
+
+        # Full evaluation: dependency analysis, compilation, calls
+        timings['analyse'] = timeCall(lambda : ParameterEvaluator(parameters),
+            repeat)
+        # The compilation starts from empty caches: the compiled models, and the
+        # interned formulas whose shapes keep their rewritten trees
+        fresh = [None]
+        def clearCompileCaches () :
+            evaluator.g_compiledModels.clear()
+            evaluator.g_internedFormulas.clear()
+            evaluator.g_formulaShapes.clear()
+            fresh[0] = ParameterEvaluator(parameters)
+        timings['compile'] = timeCall(lambda : fresh[0].function, repeat,
+            setup = clearCompileCaches)
+        compiled = fresh[0]
+        calls = max(1, 10000 // size)
+        timings['evaluate'] = timeCall(compiled.evaluate, repeat, calls)
+
+        # Incremental updates of a single external parameter
+        compiled.refresh()
+        symbol = externNames[0]
+        values = [compiled.values[symbol], 2. * compiled.values[symbol]]
+        counter = [0]
+        def update () :
+            counter[0] += 1
+            compiled.update(**{symbol: values[counter[0] % 2]})
+        update()
+        timings['update'] = timeCall(update, repeat, calls)
+
+        # Parameter card of the model
+        timings['cardWrite'] = timeCall(lambda : writeParamCard(io.StringIO(),
+            cardFromBlocks(model = model)), repeat)
+    finally :
+        if ownDirectory :
+            shutil.rmtree(directory, ignore_errors = True)
+
+    return OrderedDict([('size', len(externNames) + len(internNames)),
+        ('extern', len(externNames)), ('intern', len(internNames)),
+        ('depth', depth), ('fanout', fanout), ('timings', timings)])
+
+def benchmarkDispatch (repeat = 5, number = 1000) :
+    """
+    Parameters
+    ----------
+    repeat, number: int
+      The number of measurements, and of commands per measurement
+
+    Returns
+    -------
+    An OrderedDict with the timings of the dispatch of simple and compound
+    command lines by the interpreter (logging being muted)
+    """
+    from src.interpreter.interpreter import Interpreter
+    pyrulesDir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    interpreter = Interpreter(pyrulesDir, batch = True)
+    logger = logging.getLogger('PyRules')
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try :
+        timings = OrderedDict()
+        for name, line in [('simple', 'help quit'),
+          ('compound', 'help quit ; help exit # comment'),
+          ('unknown', 'foo(1, 2) = [3]')] :
+            timings[name] = timeCall(lambda : interpreter.exec_cmd(line),
+                repeat, number)
+            del interpreter.history[:]
+    finally :
+        logger.setLevel(level)
+    return timings
+
+def runBenchmarks (sizes, depth = 4, fanout = 3, repeat = 5, directory = None) :
+    """
+    Parameters
+    ----------
+    sizes: list of int
+      The numbers of parameters of the synthetic models
+    depth, fanout: int
+      The shape of their dependency graphs (see generateModelSource)
+    repeat: int
+      The number of measurements of each stage
+    directory: str
+      The directory where the model files are written
+
+    Returns
+    -------
+    An OrderedDict, ready to be dumped as JSON, with the description of the
+    environment and the results of all benchmarks
+    """
+    logger = logging.getLogger('PyRules')
+    results = []
+    for size in sizes :
+        logger.info('Benchmarking a synthetic model of %d parameters' % size)
+        results.append(benchmarkModel(size, depth, fanout, repeat, directory))
+    return OrderedDict([
+        ('python', sys.version.split()[0]),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.platform()),
+        ('models', results),
+        ('dispatch', benchmarkDispatch(repeat))])
@@ -0,0 +1,76 @@
+################################################################################
+# Synthetic models for the benchmarks
+################################################################################
+"""Generation of parameters.py model files of arbitrary size, written with the
+   same Parameter(...) declarations as the examples/sm model."""
+
+# packages
+import random
+
+# Formula patterns combining a list of (positive) parameters, chosen such that
+# all internal parameters stay real and positive
+g_patterns = [
+    lambda x : ' + '.join(x),
+    lambda x : '*'.join(x),
+    lambda x : 'cmath.sqrt(%s)' % ' + '.join(x),
+    lambda x : '(%s)/(1. + %s**2)' % (' + '.join(x[1:]) or '1.', x[0]),
+    lambda x : '(%s*cmath.sqrt(2))/%s' % (x[0], '*'.join(x[1:]) or '1.'),
+]
+
+def generateModelSource (size, depth = 4, fanout = 3, blockSize = 100,
+    prefix = 'B', seed = 0) :
+    """
+    Parameters
+    ----------
+    size: int
+      The total number of parameters
+    depth: int
+      The number of layers of internal parameters, each formula depending on
+      parameters of the previous layers
+    fanout: int
+      The number of parameters appearing in each formula
+    blockSize: int
+      The number of external parameters per Les Houches block
+    prefix: str
+      The prefix of the block names (to keep several models apart)
+    seed: int
+      The seed of the random generator
+
+    Returns
+    -------
+    A (source, externNames, internNames) triplet, source being the content of
+    the parameters.py file
+    """
+    generator = random.Random(seed)
+    nextern = max(1, size // 10)
+    ninternPerLayer = max(1, (size - nextern) // max(1, depth))
+
+    lines = ['import cmath', '']
+    externNames = []
+    for i in range(nextern) :
+        name = 'x%d' % i
+        externNames.append(name)
+        lines.append("%s = Parameter(name = '%s',\n"
+            "    nature = 'external',\n"
+            "    type = 'real',\n"
+            "    value = %r,\n"
+            "    lhablock = '%s%d',\n"
+            "    lhacode = [ %d ])\n" % (name, name, generator.uniform(0.1, 10.),
+            prefix, i // blockSize, i % blockSize + 1))
+
+    internNames = []
+    available = list(externNames)
+    for layer in range(depth) :
+        current = []
+        for i in range(ninternPerLayer) :
+            name = 'p%d_%d' % (layer, i)
+            inputs = generator.sample(available, min(fanout, len(available)))
+            formula = generator.choice(g_patterns)(inputs)
+            lines.append("%s = Parameter(name = '%s',\n"
+                "    nature = 'internal',\n"
+                "    type = 'real',\n"
+                "    value = '%s')\n" % (name, name, formula))
+            current.append(name)
+        internNames.extend(current)
+        available.extend(current)
+    return '\n'.join(lines), externNames, internNames
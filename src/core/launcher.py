@@ -18,6 +18,31 @@ def Usage():
     logger.info(' List of options:')
     logger.info('   ** -D or --debug  : debug mode')
     logger.info('   ** -V or --version: display the version number')
+    logger.info('   ** -f <file> or --file=<file>: batch mode, runs the ' + \
+        'commands of the file (\'-\' for the standard input)')
+    logger.info('   ** --serve: daemon mode, serves the commands sent ' + \
+        'on a Unix domain socket')
+    logger.info('   ** --client: sends the commands of the file given ' + \
+        'with -f (default: standard input) to the server')
+    logger.info('   ** --socket=<path>: socket of the server (default: ' + \
+        'pyrules.sock in $XDG_RUNTIME_DIR, or in a private ' + \
+        'pyrules-<uid> temporary directory)')
+    logger.info('   ** --session=<name>: named session of the server, ' + \
+        'kept between client calls')
+
+def RunBatch(interpreter, script):
+    """Run all the commands of a script, stopping at the first quit"""
+    if script == '-':
+        stream = sys.stdin
+    else:
+        stream = open(script, 'r')
+    try:
+        for line in stream:
+            if interpreter.exec_cmd(line.rstrip('\r\n')):
+                break
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
 def LaunchPyRules(version, date, pyrules_dir):
     ## Logger
@@ -25,11 +50,16 @@ def LaunchPyRules(version, date, pyrules_dir):
 
     ## Decoding options and arguments
     try:
-        optlist,arglist = getopt.getopt(sys.argv[1:], 'DV', ['debug','version'])
+        optlist,arglist = getopt.getopt(sys.argv[1:], 'DVf:',
+            ['debug','version','file=','serve','client','socket=','session='])
     except getopt.GetoptError as err:
          logger.error(err)
          Usage()
          sys.exit()
+    script = None
+    mode = None
+    socket_path = None
+    session = None
     for o,a in optlist:
         if o in ["-D", "--debug"]:
             logger.setLevel(logging.DEBUG)
@@ -38,6 +68,43 @@ def LaunchPyRules(version, date, pyrules_dir):
         elif o in ["-V", "--version"]:
             logger.info("PyRules version " + version + " [ " + date  + " ]")
             sys.exit()
+        elif o in ["-f", "--file"]:
+            script = a
+        elif o in ["--serve", "--client"]:
+            mode = o[2:]
+        elif o == "--socket":
+            socket_path = a
+        elif o == "--session":
+            session = a
+
+    ## Daemon and client modes
+    if mode == 'serve':
+        from src.core.server import RunServer
+        try:
+            RunServer(pyrules_dir, socket_path)
+        except (IOError, OSError) as err:
+            logger.error(err)
+            sys.exit(1)
+        return
+    elif mode == 'client':
+        from src.core.server import RunClient
+        try:
+            if not RunClient(script or '-', socket_path, session):
+                sys.exit(1)
+        except IOError as err:
+            logger.error(err)
+            sys.exit(1)
+        return
+
+    ## Batch mode: no readline, no banner, no history
+    if script is not None:
+        interpreter = Interpreter(pyrules_dir, batch=True)
+        try:
+            RunBatch(interpreter, script)
+        except IOError as err:
+            logger.error(err)
+            sys.exit(1)
+        return
 
     ## The readline module is necessary for tab completion
     try:
@@ -0,0 +1,316 @@
+################################################################################
+# Daemon mode
+################################################################################
+"""A long-lived PyRules process serving interpreter command lines over a Unix
+   domain socket, and the thin client talking to it. Each connection (or each
+   named session, shared by successive connections) has its own interpreter,
+   so that loaded models and compiled formulas are kept between commands.
+
+   The protocol is made of JSON lines. A request is {"command": <line>}, with
+   an optional "session" name. The reply is streamed as {"level": <level name>,
+   "message": <text>} records, terminated by {"done": true, "stop": <bool>}.
+   Named sessions are dropped on 'quit', after SESSION_TIMEOUT seconds without
+   commands, or (least recently used first) beyond MAX_SESSIONS sessions.
+
+   Commands include 'shell', so the socket is only reachable by its owner: it
+   is created in a private directory with a restrictive umask, and the client
+   checks that the server runs as the same user before sending anything."""
+
+# packages
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from src.interpreter.interpreter import Interpreter
+
+# Lifetime of the named sessions: idle time (in seconds) after which they are
+# dropped, and largest number of them kept by the server
+SESSION_TIMEOUT = 3600
+MAX_SESSIONS = 16
+
+def PrivateDirectory(path):
+    """Create a directory only accessible by the current user, or check that
+    an existing one is (not a symbolic link, owned by the user, mode 0700)"""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or \
+      status.st_mode & 0o077:
+        raise IOError('The directory %s is not private to the current user' %
+            path)
+    return path
+
+def DefaultSocketPath():
+    """Path of the socket used when none is given: in $XDG_RUNTIME_DIR, or in
+    a private pyrules-<uid> directory of the temporary directory"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        directory = PrivateDirectory(runtime_dir)
+    else:
+        directory = PrivateDirectory(os.path.join(tempfile.gettempdir(),
+            'pyrules-%d' % os.getuid()))
+    return os.path.join(directory, 'pyrules.sock')
+
+def PeerUid(connection, path):
+    """User id of the process serving a connected Unix domain socket (or of
+    the owner of the socket file where the peer credentials are unavailable)"""
+    if hasattr(socket, 'SO_PEERCRED'):
+        size = struct.calcsize('3i')
+        pid, uid, gid = struct.unpack('3i', connection.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, size))
+        return uid
+    return os.stat(path).st_uid
+
+class SessionLogHandler(logging.Handler):
+    """Routes the log records emitted by the thread running a command to the
+    client of the command, instead of the console of the server"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.local = threading.local()
+
+    def emit(self, record):
+        reply = getattr(self.local, 'reply', None)
+        if reply is not None:
+            reply(record.levelname, record.getMessage())
+
+    def console_filter(self, record):
+        """Filter for the console handlers: hide the records of the sessions"""
+        return getattr(self.local, 'reply', None) is None
+
+class SessionStream(object):
+    """File-like object receiving what the interpreter prints (e.g. the list
+    of commands of 'help'), sent to the client line by line"""
+
+    def __init__(self, log_handler):
+        self.log_handler = log_handler
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            self.send(line)
+
+    def flush(self):
+        if self.buffer:
+            self.send(self.buffer)
+            self.buffer = ''
+
+    def send(self, line):
+        reply = getattr(self.log_handler.local, 'reply', None)
+        if reply is not None:
+            reply('INFO', line)
+
+class Session(object):
+    """An interpreter, the lock serializing its commands and the time of its
+    last use"""
+
+    def __init__(self, pyrules_dir, log_handler):
+        self.lock = threading.Lock()
+        self.interpreter = Interpreter(pyrules_dir, batch=True,
+            stdout=SessionStream(log_handler))
+        self.last_used = time.monotonic()
+
+    def busy(self):
+        """Whether a command of the session is running"""
+        return self.lock.locked()
+
+class SessionRequestHandler(socketserver.StreamRequestHandler):
+    """Runs the command lines received on a connection"""
+
+    def reply(self, record):
+        self.wfile.write((json.dumps(record) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        logger = logging.getLogger('PyRules')
+        local = self.server.log_handler.local
+        connection_session = None
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw.decode('utf-8'))
+                line = request['command']
+                name = request.get('session')
+            except (ValueError, KeyError, TypeError):
+                self.reply({'level': 'ERROR', 'message': 'Invalid request'})
+                self.reply({'done': True, 'stop': True})
+                return
+            if name is None:
+                if connection_session is None:
+                    connection_session = self.server.new_session()
+                session = connection_session
+            else:
+                try:
+                    session = self.server.named_session(name)
+                except IOError as error:
+                    self.reply({'level': 'ERROR', 'message': str(error)})
+                    self.reply({'done': True, 'stop': True})
+                    return
+
+            stop = False
+            with session.lock:
+                local.reply = lambda level, message: \
+                    self.reply({'level': level, 'message': message})
+                try:
+                    stop = session.interpreter.exec_cmd(line)
+                    session.interpreter.stdout.flush()
+                except Exception as error:
+                    logger.error('%s: %s' % (type(error).__name__, error))
+                finally:
+                    local.reply = None
+                    session.last_used = time.monotonic()
+            if stop and name is not None:
+                self.server.drop_session(name)
+            self.reply({'done': True, 'stop': bool(stop)})
+            if stop:
+                return
+
+class PyRulesServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Server accepting concurrent connections on a Unix domain socket"""
+
+    daemon_threads = True
+
+    def __init__(self, path, pyrules_dir, session_timeout=SESSION_TIMEOUT,
+                 max_sessions=MAX_SESSIONS):
+        # A socket left by a dead server is removed, a living one is kept
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                alive = True
+            except socket.error:
+                alive = False
+            finally:
+                probe.close()
+            if alive:
+                raise IOError('A PyRules server is already running on ' + path)
+            os.unlink(path)
+        self.pyrules_dir = pyrules_dir
+        self.session_timeout = session_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.log_handler = SessionLogHandler()
+        # Only the owner can send commands (they include 'shell'): the socket
+        # is never reachable by others, not even between its creation and
+        # the chmod
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                SessionRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+
+    def new_session(self):
+        return Session(self.pyrules_dir, self.log_handler)
+
+    def named_session(self, name):
+        """The session of the given name, created if needed. The idle sessions
+        that timed out are dropped first, then the least recently used ones
+        while there are too many of them."""
+        with self.sessions_lock:
+            now = time.monotonic()
+            for other, session in list(self.sessions.items()):
+                if other != name and not session.busy() and \
+                  now - session.last_used > self.session_timeout:
+                    del self.sessions[other]
+            session = self.sessions.get(name)
+            if session is not None:
+                session.last_used = now
+                return session
+
+            idle = sorted((session.last_used, other) for other, session
+                in self.sessions.items() if not session.busy())
+            while len(self.sessions) >= self.max_sessions and idle:
+                del self.sessions[idle.pop(0)[1]]
+            if len(self.sessions) >= self.max_sessions:
+                raise IOError('Too many sessions running on the server')
+            session = self.new_session()
+            self.sessions[name] = session
+            return session
+
+    def drop_session(self, name):
+        with self.sessions_lock:
+            self.sessions.pop(name, None)
+
+def RunServer(pyrules_dir, path=None):
+    """Serve the interpreter on a Unix domain socket until interrupted"""
+    logger = logging.getLogger('PyRules')
+    if path is None:
+        path = DefaultSocketPath()
+    server = PyRulesServer(path, pyrules_dir)
+
+    # Records emitted by the sessions go to their clients only
+    for hdlr in logger.handlers:
+        hdlr.addFilter(server.log_handler.console_filter)
+    logger.addHandler(server.log_handler)
+
+    logger.info('PyRules server listening on ' + path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping the PyRules server')
+    finally:
+        logger.removeHandler(server.log_handler)
+        for hdlr in logger.handlers:
+            hdlr.removeFilter(server.log_handler.console_filter)
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+def RunClient(script, path=None, session=None):
+    """Send the commands of a script to a server, streaming its replies to
+    the logger. Returns False if the server cannot be reached."""
+    logger = logging.getLogger('PyRules')
+    if path is None:
+        path = DefaultSocketPath()
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except socket.error as err:
+        logger.error('Cannot reach the PyRules server on %s: %s' % (path, err))
+        return False
+    if PeerUid(connection, path) != os.getuid():
+        connection.close()
+        logger.error('The server on %s is not run by the current user' % path)
+        return False
+
+    if script == '-':
+        stream = sys.stdin
+    else:
+        stream = open(script, 'r')
+    replies = connection.makefile('rb')
+    try:
+        for line in stream:
+            request = {'command': line.rstrip('\r\n')}
+            if session is not None:
+                request['session'] = session
+            connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            stop = True
+            for raw in replies:
+                record = json.loads(raw.decode('utf-8'))
+                if record.get('done'):
+                    stop = record['stop']
+                    break
+                logger.log(logging.getLevelName(record['level']),
+                    record['message'])
+            if stop:
+                break
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        replies.close()
+        connection.close()
+    return True
@@ -5,9 +5,8 @@
    extension of the cmd package for command interpretation and tab completion.
    """
 
-# Packages
+# Packages (readline is imported on demand, the batch mode never needs it)
 import logging
-import readline
 import os
 
 from src.interpreter.interpreter_base import InterpreterBase
@@ -19,6 +18,9 @@ class Interpreter(InterpreterBase):
         self.pyrules_dir = pyrules_dir
         self.logger = logging.getLogger('PyRules')
 
+        # Batch mode: no history nor completion
+        self.batch = opt.pop('batch', False)
+
         # Calling the constructor from InterpreterBase
         self.logger.debug("Starting the interpreter")
         InterpreterBase.__init__(self, *arg, **opt)
@@ -26,10 +28,22 @@ class Interpreter(InterpreterBase):
         # All homemade commands should be declared here
         # no command for the moment (add Benjamin for more information)
 
+        # Current model, and its parameters indexed by their symbol
+        self.model = None
+        self.parameters = None
+
+        # Results of the last scan
+        self.scan_results = None
+        self.scan_columns = None
+        self.scan_rejected = None
+
         # Importing history
-        self.logger.debug("Loading the previous history")
         self.history_file=os.path.join(self.pyrules_dir,'.PyRulesHistory')
+        if self.batch:
+            return
+        self.logger.debug("Loading the previous history")
         try:
+            import readline
             readline.read_history_file(self.history_file)
             self.logger.debug('  --> Success')
         except:
@@ -38,8 +52,11 @@ class Interpreter(InterpreterBase):
 
     def __del__(self):
         self.logger.debug("Stopping the interpreter")
+        if self.batch:
+            return
         try:
             self.logger.debug('Saving the history in ' + self.history_file)
+            import readline
             readline.set_history_length(100)
             readline.write_history_file(self.history_file)
             self.logger.debug('  --> Success')
@@ -50,15 +67,185 @@ class Interpreter(InterpreterBase):
     ## Here should comme the definition of all commands to be implemented
     ## with links to the help messages and autocompltion information
 
+    def do_import(self, line):
+        """Load the parameters of a model, or merge several models"""
+        args = self.split_arg(line)
+        policy = 'error'
+        if len(args) >= 3 and args[-2] == '=':
+            if args[-3] != 'policy':
+                self.logger.error('Unknown option ' + args[-3])
+                return
+            policy = args[-1]
+            args = args[:-3]
+        if len(args) == 0:
+            self.help_import()
+            return
+        from src.parameter.loader import loadModels, ModelFileError
+        from src.parameter.merge import describeConflict
+        from src.parameter.parameter import Model
+        # Each import builds a new model, replacing the previous one
+        model = Model(' '.join(args))
+        try:
+            self.parameters, conflicts = loadModels(args, policy, model=model)
+        except (IOError, OSError, ModelFileError, ValueError) as error:
+            self.logger.error(error)
+            return
+        self.model = model
+        for conflict in conflicts:
+            if conflict.kind in ['name', 'slot']:
+                self.logger.warning('Conflict: ' + describeConflict(conflict) + \
+                    ', keeping %s from %s' % (conflict.kept[1], conflict.kept[0]))
+            else:
+                self.logger.debug(describeConflict(conflict))
+        self.logger.info('Model loaded: %d parameters' % len(self.parameters))
+
+    def help_import(self):
+        self.logger.info("   Syntax: import <model> [<model> ...] " + \
+            "[policy=error|first|last]")
+        self.logger.info("   Loads the parameters of a model, given by its " + \
+            "parameters.py file or by the directory containing it.")
+        self.logger.info("   The parsed model file is cached on disk and " + \
+            "reused as long as the file is unchanged.")
+        self.logger.info("   Several models (e.g. a model and its extensions) " + \
+            "are merged into a single one. Parameters")
+        self.logger.info("   defined differently, or sharing a block and a " + \
+            "code, are conflicts: by default they are")
+        self.logger.info("   errors; with policy=first the first definition " + \
+            "is kept, with policy=last the later models")
+        self.logger.info("   override the earlier ones. A parameter losing " + \
+            "its code receives a free one.")
+
+    def complete_import(self, text, line, begidx, endidx):
+        "complete the import command"
+        return self.path_completion(text)
+
+    # Scan options with their default values
+    scan_options = {'workers': None, 'chunk': 10000, 'tolerance': 1e-8,
+                    'output': None}
+
+    @staticmethod
+    def parse_assignments(args):
+        """Group the arguments of a command into (name, value) pairs, the
+        value being the concatenation of all tokens following '='"""
+        assignments = []
+        i = 0
+        while i < len(args):
+            if i+1 >= len(args) or args[i+1] != '=':
+                raise InterpreterBase.InvalidCmd('Expecting name=value, got ' + \
+                    args[i])
+            j = i+2
+            while j < len(args) and not (j+1 < len(args) and args[j+1] == '='):
+                j += 1
+            if j == i+2:
+                raise InterpreterBase.InvalidCmd('No value given for ' + args[i])
+            assignments.append((args[i], ''.join(args[i+2:j])))
+            i = j
+        return assignments
+
+    @staticmethod
+    def parse_scan_values(value):
+        """Convert 'start:stop:n' or a comma-separated list into values"""
+        import numpy
+        if ':' in value:
+            bounds = value.split(':')
+            if len(bounds) != 3:
+                raise InterpreterBase.InvalidCmd('Ranges are given as ' + \
+                    'start:stop:npoints, got ' + value)
+            return numpy.linspace(float(bounds[0]), float(bounds[1]),
+                int(bounds[2]))
+        return numpy.array([float(x) for x in value.split(',') if x])
+
+    def do_scan(self, line):
+        """Scan the model over a grid of external parameter values"""
+        if self.parameters is None:
+            self.logger.error('No model has been loaded')
+            return
+
+        options = dict(self.scan_options)
+        axes = []
+        try:
+            for name, value in self.parse_assignments(self.split_arg(line)):
+                if name == 'tolerance':
+                    options[name] = float(value)
+                elif name == 'output':
+                    options[name] = value
+                elif name in options:
+                    options[name] = int(value)
+                else:
+                    axes.append((name, self.parse_scan_values(value)))
+        except (self.InvalidCmd, ValueError) as error:
+            self.logger.error(error)
+            return
+        if not axes:
+            self.help_scan()
+            return
+
+        from src.parameter.scan import ParallelScan
+        try:
+            scan = ParallelScan(self.parameters, workers=options['workers'],
+                chunkSize=options['chunk'], tolerance=options['tolerance'])
+            store = None
+            if options['output'] is not None:
+                from src.parameter.store import ScanStore
+                store = ScanStore(options['output'], 'a', scan.storeLayout)
+            self.scan_results = scan.run(dict(axes), store)
+            self.scan_rejected = scan.validate(self.scan_results)
+        except (KeyError, ValueError, IOError) as error:
+            self.logger.error(error)
+            return
+        if store is None:
+            self.scan_columns = scan.columns
+            self.logger.info('Scan done: %d points, %d columns' % \
+                self.scan_results.shape)
+        else:
+            self.scan_columns = list(store.parameters)
+            self.logger.info('Scan done: %d points appended to %s (%d in ' % \
+                (len(self.scan_rejected), store.directory, len(store)) + \
+                'total)')
+        if self.scan_rejected.any():
+            self.logger.warning('%d points violate the declared tensor ' % \
+                self.scan_rejected.sum() + 'properties (see scan_rejected)')
+
+    def help_scan(self):
+        self.logger.info("   Syntax: scan <param>=<values> [<param>=<values> ...]" + \
+            " [workers=<n>] [chunk=<n>] [tolerance=<x>]")
+        self.logger.info("               [output=<directory>]")
+        self.logger.info("   Evaluates the model on the grid spanned by the " + \
+            "values of the external parameters.")
+        self.logger.info("   Values are given either as a range " + \
+            "start:stop:npoints or as a comma-separated list.")
+        self.logger.info("   The points are split into chunks of 'chunk' " + \
+            "points, evaluated by 'workers' processes")
+        self.logger.info("   (by default, one per CPU).")
+        self.logger.info("   Points where a tensor parameter violates its " + \
+            "declared properties (unitary,")
+        self.logger.info("   hermitian, orthogonal) beyond 'tolerance' " + \
+            "are reported.")
+        self.logger.info("   With 'output', the results are appended to an " + \
+            "on-disk store (one .npy file")
+        self.logger.info("   per parameter and a manifest.json) instead of " + \
+            "being kept in memory.")
+
+    def complete_scan(self, text, line, begidx, endidx):
+        "complete the scan command"
+        categories = {'scan options': self.list_completion(text,
+            sorted(x + '=' for x in self.scan_options))}
+        if self.model is not None:
+            categories['external parameters'] = [x + '=' for x in
+                self.model.completion.complete(text, 'external parameters')]
+        return self.deal_multiple_categories(categories, presorted=True)
+
 
     # PreLoop
     def preloop(self):
         """Initializing before starting the main loop"""
         self.prompt = 'pyrules>'
 
-    def deal_multiple_categories(self, dico):
+    def deal_multiple_categories(self, dico, presorted=False):
         """convert the multiple category in a formatted list understand by our
-        specific readline parser"""
+        specific readline parser (presorted: the options of each category are
+        already sorted and unique, e.g. from a completion index)"""
+        import readline
 
         if 'libedit' in readline.__doc__:
             # No parser in this case, just send all the valid options
@@ -78,11 +265,8 @@ class Interpreter(InterpreterBase):
             valid += 1
             out.append(opt[0].rstrip()+'@@'+name+'@@')
             # Remove duplicate
-            d = {}
-            for x in opt:
-                d[x] = 1    
-            opt = list(d.keys())
-            opt.sort()
+            if not presorted:
+                opt = sorted(set(opt))
             out += opt
 
         if valid == 1:
@@ -91,6 +275,7 @@ class Interpreter(InterpreterBase):
 
     def print_suggestions(self, substitution, matches, longest_match_length) :
         """print auto-completions by category"""
+        import readline
         longest_match_length += len(self.completion_prefix)
         try:
             if len(matches) == 1:
@@ -162,6 +347,7 @@ class Interpreter(InterpreterBase):
          Otherwise try to call complete_<command> to get list of completions.
         """
         if state == 0:
+            import readline
             origline = readline.get_line_buffer()
             line = origline.lstrip()
             stripped = len(origline) - len(line)
@@ -6,10 +6,89 @@
 
 # packages
 import cmd
+import json
 import logging
+import math
 import os
 import re
-import subprocess
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from src.parameter.cache import LRUCache
+
+#===============================================================================
+# Lexer of the command lines
+#===============================================================================
+# Tokens of a command line: words (possibly with quoted parts and escaped
+# blanks), and single characters for the operators, the command separator and
+# the beginning of a comment
+TOKEN_PATTERN = re.compile(r"""(?:'[^']*'?|"[^"]*"?|\\[ \t]|""" +
+    r"""[^\s;#'"()\[\]&|^!=<>,])+|[()\[\]&|^!=<>,;#]""")
+
+# Part of a shell command line preceding its comment
+SHELL_PATTERN = re.compile(r"""(?:'[^']*'?|"[^"]*"?|[^'"#])*""")
+
+# Lexed command lines (shared by the interpreters of a server)
+TOKEN_CACHE_SIZE = 4096
+g_lexed_lines = LRUCache(TOKEN_CACHE_SIZE)
+
+# Listings of the directories visited by the path completion, by directory and
+# modification time
+PATH_CACHE_SIZE = 64
+PATH_CACHE_DELAY = 2.
+g_directory_listings = LRUCache(PATH_CACHE_SIZE)
+
+class CommandLine(str):
+    """A lexed command line (or argument line), the blanks inside its tokens
+       being escaped, carrying its tokens"""
+
+    def __new__(cls, tokens, quoted=False):
+        words = tokens
+        if quoted:
+            # Blanks inside tokens come from quotes and escaped blanks only
+            words = [x.replace(' ', '\\ ').replace('\t', '\\\t')
+                for x in tokens]
+        line = str.__new__(cls, ' '.join(words))
+        line.tokens = tuple(tokens)
+        return line
+
+def tokenize(line):
+    """Split a complete command line, in a single pass, into its commands
+       (separated by ';'), each being a tuple of tokens. Comments are removed,
+       quotes are kept and operators are tokens by themselves."""
+    escaped = '\\' in line
+    commands = []
+    command = []
+    for token in TOKEN_PATTERN.findall(line):
+        if token == ';':
+            if command:
+                commands.append(tuple(command))
+                command = []
+        elif token == '#':
+            break
+        else:
+            if escaped:
+                token = token.replace('\\ ', ' ').replace('\\\t', '\t')
+            command.append(token)
+    if command:
+        commands.append(tuple(command))
+    return tuple(commands)
+
+def lex_line(line):
+    """Commands of a complete command line, as CommandLines whose arguments
+       attribute is the CommandLine of their arguments"""
+    commands = g_lexed_lines.get(line)
+    if commands is None:
+        quoted = "'" in line or '"' in line or '\\' in line
+        commands = []
+        for tokens in tokenize(line):
+            command = CommandLine(tokens, quoted)
+            command.arguments = CommandLine(tokens[1:], quoted)
+            commands.append(command)
+        commands = g_lexed_lines.setdefault(line, tuple(commands))
+    return commands
 
 #===============================================================================
 # InterpreterBase
@@ -32,6 +111,12 @@ class InterpreterBase(cmd.Cmd):
 
         # beginning of the incomplete line (line break with '\') 
         self.save_line = ''
+
+        # Per-command timings (command -> durations in seconds) and profiler
+        self.profiling = False
+        self.profiler = None
+        self.profile_depth = 0
+        self.command_times = {}
         cmd.Cmd.__init__(self, *arg, **opt)
         self.__initpos = os.path.abspath(os.getcwd())
 
@@ -49,7 +134,7 @@ class InterpreterBase(cmd.Cmd):
 
         # Add the line to the history
         # except for a few commands
-        if not any([line.startswith(x) for x in ['history', '#', 'help']]):
+        if not line.startswith(('history', '#', 'help')):
             self.history.append(line)
 
         # Multiple-line commands
@@ -62,36 +147,27 @@ class InterpreterBase(cmd.Cmd):
             self.save_line = line[:-1]
             return '' # do nothing
 
-        # Remove comment (ugly but I haven't found better so far)
-        open_singlequote = False
-        open_doublequote = False
-        for i in range(len(line)):
-            if line[i]=="'" and not open_doublequote:
-                open_singlequote = not open_singlequote
-            elif line[i]=='"' and not open_singlequote:
-                 open_doublequote = not open_doublequote
-            elif line[i]=='#' and not open_singlequote and not open_doublequote:
-               line = line[0:i]
-               break
-
-        # Isolating operator
-        operators = ['(',')','[',']','&','|','&','^','!','=','>','<',',']
-        if not line.startswith('shell'):
-            for item in operators:
-                line=line.replace(item,' '+item+' ')
-
-        # Deal with line splitting
-        if ';' in line and not any([line.startswith(x) for x in ['shell','!']]):
-            for subline in line.split(';'):
-                stop = self.onecmd(subline)
-                stop = self.postcmd(stop, subline)
+        # Shell commands are passed as they are, without their comment
+        if line.startswith(('shell', '!')):
+            return SHELL_PATTERN.match(line).group()
+
+        # Comments, quotes, operators and line splitting, the commands carrying
+        # their tokens to their handler (see dispatch)
+        commands = lex_line(line)
+        if len(commands) > 1:
+            for command in commands:
+                stop = self.onecmd(command)
+                stop = self.postcmd(stop, command)
+            return ''
+        if not commands:
             return ''
 
         # debug
-        self.logger.debug('Entered command: ' + str(self.split_arg(line)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Entered command: ' + str(list(commands[0].tokens)))
 
         # execute the line command
-        return line
+        return commands[0]
 
     def exec_cmd(self, line, errorhandling=False):
         """for third party call, call the line with pre and postfix treatment
@@ -102,10 +178,50 @@ class InterpreterBase(cmd.Cmd):
         if errorhandling:
             stop = self.onecmd(line)
         else:
-            stop = cmd.Cmd.onecmd(self, line)
+            stop = self.timed_call(InterpreterBase.dispatch, line)
         stop = self.postcmd(stop, line)
         return stop
 
+    def onecmd(self, line):
+        """Interpret a command, timing it when the profiling is on"""
+        return self.timed_call(InterpreterBase.dispatch, line)
+
+    def dispatch(self, line):
+        """Interpret a command. The handler of a lexed command (see lex_line)
+        receives the CommandLine of its arguments, whose tokens are then
+        returned by split_arg; other lines go through cmd.Cmd.onecmd."""
+        tokens = getattr(line, 'tokens', None)
+        if not tokens or not all(x in self.identchars for x in tokens[0]):
+            return cmd.Cmd.onecmd(self, line)
+        self.lastcmd = '' if tokens[0] == 'EOF' else line
+        handler = getattr(self, 'do_' + tokens[0], None)
+        if handler is None:
+            return self.default(line)
+        return handler(line.arguments)
+
+    def timed_call(self, onecmd, line):
+        """Call onecmd(self, line), recording its duration (and its cProfile
+        statistics if requested) under the name of the command"""
+        if not self.profiling:
+            return onecmd(self, line)
+        name = self.parseline(line)[0]
+        if not name:
+            return onecmd(self, line)
+        # Nested commands are timed, but the profiler is only enabled once
+        profiler = self.profiler if self.profile_depth == 0 else None
+        self.profile_depth += 1
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return onecmd(self, line)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.profile_depth -= 1
+            self.command_times.setdefault(name, array('d')).append(
+                time.perf_counter() - start)
+
     def run_cmd(self, line):
         return self.exec_cmd(line, errorhandling=True)
 
@@ -143,6 +259,44 @@ class InterpreterBase(cmd.Cmd):
                             ]
         return completions
 
+    @staticmethod
+    def sorted_completion(text, names):
+        """Names of a sorted list starting with text, found by bisection
+        (hidden names only if text starts with a dot)"""
+        start = bisect_left(names, text or '.')
+        stop = bisect_left(names, (text or '.') + chr(0x10ffff), start)
+        if text:
+            return names[start:stop]
+        return names[:start] + names[stop:]
+
+    @staticmethod
+    def list_directory(directory):
+        """Sorted names of the files and of the subdirectories of a directory,
+        from a single scandir pass (the type of the entries coming with them)
+        cached until the directory is modified"""
+        mtime = os.stat(directory).st_mtime_ns
+        listing = g_directory_listings.get((directory, mtime))
+        if listing is not None:
+            return listing
+        files = []
+        dirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+                except OSError:
+                    pass
+        files.sort()
+        dirs.sort()
+        # A directory modified in the last seconds may change again without a
+        # new mtime on filesystems with a coarse resolution
+        if time.time() - mtime * 1e-9 > PATH_CACHE_DELAY:
+            g_directory_listings.setdefault((directory, mtime), (files, dirs))
+        return files, dirs
+
     @staticmethod
     def path_completion(text, base_dir=None, only_dirs=False, relative=True):
         """Propose completions of text to compose a valid path"""
@@ -156,22 +310,14 @@ class InterpreterBase(cmd.Cmd):
         if prefix:
             prefix += os.path.sep
 
+        files, dirs = InterpreterBase.list_directory(base_dir)
+        dirs = InterpreterBase.sorted_completion(text, dirs)
         if only_dirs:
-            completion = [prefix + f for f in os.listdir(base_dir) if \
-                (f.startswith(text) and \
-                 os.path.isdir(os.path.join(base_dir, f)) and \
-                 (not f.startswith('.') or text.startswith('.'))) ]
+            completion = [prefix + f for f in dirs]
         else:
-            completion = [ prefix + f for f in os.listdir(base_dir) if \
-                (f.startswith(text) and \
-                 os.path.isfile(os.path.join(base_dir, f)) and \
-                 (not f.startswith('.') or text.startswith('.'))) ]
-
-            completion = completion + \
-              [prefix + f + os.path.sep for f in os.listdir(base_dir) if \
-                 (f.startswith(text) and \
-                  os.path.isdir(os.path.join(base_dir, f)) and \
-                  (not f.startswith('.') or text.startswith('.'))) ]
+            completion = [prefix + f for f in \
+                InterpreterBase.sorted_completion(text, files)] + \
+                [prefix + f + os.path.sep for f in dirs]
 
         if relative:
             completion += [prefix + \
@@ -225,17 +371,146 @@ class InterpreterBase(cmd.Cmd):
 
     def do_shell(self, line):
         "run a shell command"
-        if line.strip() is '':
+        if line.strip() == '':
             self.help_shell()
         else:
             self.logger.info("Running the shell command: " + line + ".")
-            subprocess.call(line, shell=True)
+            import subprocess
+            if self.stdout is sys.stdout:
+                subprocess.call(line, shell=True)
+                return
+            # Output redirected (e.g. to the client of a server session)
+            process = subprocess.Popen(line, shell=True,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True)
+            with process.stdout:
+                for output in process.stdout:
+                    self.stdout.write(output)
+            process.wait()
 
     def help_shell(self):
         self.logger.info("   Syntax: shell <command> (or !CMD)")
         self.logger.info("   Runs the command CMD on a shell and retrieves " + \
              "the output.")
 
+    # Timing and profiling of the commands
+    def do_profile(self, line):
+        """Switch on or off the timing (and profiling) of the commands"""
+        args = self.split_arg(line)
+        if len(args) == 0:
+            self.logger.info('Command timing is ' + \
+                ('on' if self.profiling else 'off') + \
+                (' (with cProfile)' if self.profiler is not None else ''))
+        elif args[0] == 'on' and len(args) <= 2:
+            if len(args) == 2 and args[1] != 'cprofile':
+                self.logger.error("The only option of 'profile on' is " + \
+                    "'cprofile'")
+                return
+            if len(args) == 2 and self.profiler is None:
+                import cProfile
+                self.profiler = cProfile.Profile()
+            self.profiling = True
+            self.logger.info('Command timing is on' + \
+                (' (with cProfile)' if self.profiler is not None else ''))
+        elif args[0] == 'off' and len(args) == 1:
+            self.profiling = False
+            self.logger.info('Command timing is off')
+        else:
+            self.logger.error("'profile' takes the argument 'on [cprofile]' " + \
+                "or 'off'")
+
+    def help_profile(self):
+        self.logger.info("   Syntax: profile [on [cprofile]|off]")
+        self.logger.info("   Switches on or off the timing of each command, " + \
+            "the results being shown by")
+        self.logger.info("   the 'stats' command. With the option " + \
+            "'cprofile', the commands are also run")
+        self.logger.info("   under the python profiler. Without argument, " + \
+            "displays the current status.")
+
+    @staticmethod
+    def percentile(durations, fraction):
+        """Nearest-rank percentile of a sorted list of durations"""
+        rank = int(math.ceil(fraction * len(durations)))
+        return durations[max(rank, 1) - 1]
+
+    def command_stats(self):
+        """Count, median, 99th percentile and total duration of each timed
+        command, by decreasing total duration"""
+        stats = []
+        for name, durations in self.command_times.items():
+            durations = sorted(durations)
+            stats.append({'command': name, 'count': len(durations),
+                'p50': self.percentile(durations, 0.5),
+                'p99': self.percentile(durations, 0.99),
+                'total': sum(durations)})
+        stats.sort(key=lambda x: x['total'], reverse=True)
+        return stats
+
+    def do_stats(self, line):
+        """Display, export or clean the timings of the commands"""
+        args = self.split_arg(line)
+        if len(args) == 0:
+            stats = self.command_stats()
+            if not stats:
+                self.logger.info('No command has been timed (see profile)')
+                return
+            self.logger.info('%-16s %8s %12s %12s %12s' % \
+                ('command', 'count', 'p50 [ms]', 'p99 [ms]', 'total [s]'))
+            for x in stats:
+                self.logger.info('%-16s %8d %12.3f %12.3f %12.3f' % \
+                    (x['command'], x['count'], 1e3 * x['p50'], 1e3 * x['p99'],
+                    x['total']))
+        elif args[0] == 'clean' and len(args) == 1:
+            self.command_times = {}
+            if self.profiler is not None:
+                import cProfile
+                self.profiler = cProfile.Profile()
+            self.logger.info('Command timings are cleaned')
+        elif len(args) == 1:
+            if os.path.exists(args[0]):
+                self.logger.error('The file ' + args[0] + ' already exists.' + \
+                    ' Please chose another filename.')
+            elif args[0].endswith('.json'):
+                with open(args[0], 'w') as stream:
+                    json.dump(self.command_stats(), stream, indent=2)
+                self.logger.info('Command timings written to the file ' + \
+                    args[0] + '.')
+            elif self.profiler is None:
+                self.logger.error('No cProfile statistics: use ' + \
+                    "'profile on cprofile', or a .json file for the timings")
+            else:
+                self.profiler.dump_stats(args[0])
+                self.logger.info('cProfile statistics written to the file ' + \
+                    args[0] + '.')
+        else:
+            self.logger.error("'stats' takes either zero or one argument")
+
+    def help_stats(self):
+        self.logger.info("   Syntax: stats [clean|<file>]")
+        self.logger.info("   Displays the number of calls, the median and " + \
+            "99th percentile durations and")
+        self.logger.info("   the total duration of each command timed since " + \
+            "'profile on'.")
+        self.logger.info("   The option \"clean\" resets the timings. With a " + \
+            "file name, the timings are")
+        self.logger.info("   exported as JSON (.json files) or the cProfile " + \
+            "statistics in the pstats format")
+        self.logger.info("   (any other extension).")
+
+    def complete_profile(self, text, line, begidx, endidx):
+        "complete the profile command"
+        if len(self.split_arg(line[0:begidx])) > 1:
+            output = ["cprofile"]
+        else:
+            output = ["on", "off"]
+        return self.list_completion(text, output)
+
+    def complete_stats(self, text, line, begidx, endidx):
+        "complete the stats command"
+        return self.list_completion(text, ["clean"]) + \
+            self.path_completion(text)
+
     def complete_history(self, text, line, begidx, endidx):
         "complete the history command"
         output = ["clean"]
@@ -256,7 +531,11 @@ class InterpreterBase(cmd.Cmd):
 
     @staticmethod
     def split_arg(line):
-        """Split a line of arguments"""
+        """Split a line of arguments (the CommandLines of the lexed commands
+        carrying their tokens)"""
+        tokens = getattr(line, 'tokens', None)
+        if tokens is not None:
+            return list(tokens)
         split = line.split()
         out=[]
         tmp=''
@@ -265,6 +544,7 @@ class InterpreterBase(cmd.Cmd):
                 tmp += data[:-1]+' '
             elif tmp:
                 out.append(tmp+data)
+                tmp=''
             else:
                 out.append(data)
         return out
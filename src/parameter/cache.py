@@ -0,0 +1,59 @@
+################################################################################
+# Bounded process-wide caches
+################################################################################
+"""Caches shared by all the models of a process (e.g. a server), which would
+   otherwise grow with every model imported. The least recently used entries
+   are dropped beyond a given number of entries."""
+
+# packages
+import threading
+from collections import OrderedDict
+
+class LRUCache :
+    """
+    Mapping of bounded size, dropping the least recently used entries. All
+    operations are serialized by a lock, the caches being shared by threads.
+    """
+    def __init__ (self, size) :
+        """
+        Parameters
+        ----------
+        size: int
+          The maximal number of entries
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__ (self) :
+        return len(self.entries)
+
+    def get (self, key, default = None) :
+        """
+        Returns
+        -------
+        The entry of the key (marked as the most recently used), or the default
+        """
+        with self.lock :
+            value = self.entries.get(key, default)
+            if value is not default :
+                self.entries.move_to_end(key)
+            return value
+
+    def setdefault (self, key, value) :
+        """
+        Returns
+        -------
+        The entry of the key, set to the given value if there was none (the
+        value computed first wins when several threads compete)
+        """
+        with self.lock :
+            value = self.entries.setdefault(key, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size :
+                self.entries.popitem(last = False)
+            return value
+
+    def clear (self) :
+        with self.lock :
+            self.entries.clear()
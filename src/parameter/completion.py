@@ -0,0 +1,98 @@
+################################################################################
+# Completion index of the model symbols
+################################################################################
+"""Names of a model (parameters, blocks) available to the tab completion. They
+   are kept by category in sorted arrays, so that the names starting with a
+   prefix are found by bisection instead of a scan of all candidates. Names are
+   registered as the model is built; the arrays are sorted again only when a
+   completion follows new registrations."""
+
+# packages
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Upper bound of the characters of the names, closing the ranges of prefixes
+g_lastCharacter = chr(0x10ffff)
+
+class CompletionIndex :
+    """
+    Sorted, duplicate-free names by category, completed by bisection.
+    """
+    def __init__ (self) :
+        self.names = OrderedDict()  # category -> sorted list of names
+        self.pending = {}           # category -> names added since the sort
+        self.lock = threading.Lock()
+
+    def add (self, category, name) :
+        """
+        Parameters
+        ----------
+        category: str
+          The category of the name (e.g. 'blocks')
+        name: str
+          The name to complete
+        """
+        with self.lock :
+            if category not in self.names :
+                self.names[category] = []
+            self.pending.setdefault(category, []).append(name)
+
+    def discard (self, category, names) :
+        """
+        Parameters
+        ----------
+        category: str
+          The category of the names
+        names: set of str
+          Names to remove from the category (e.g. of parameters whose creation
+          has been rolled back)
+        """
+        with self.lock :
+            if category in self.pending :
+                self.pending[category] = [x for x in self.pending[category]
+                    if x not in names]
+            if category in self.names :
+                self.names[category] = [x for x in self.names[category]
+                    if x not in names]
+
+    def sortedNames (self, category) :
+        """
+        Returns
+        -------
+        The sorted list of the names of a category (shared, not to be modified)
+        """
+        with self.lock :
+            pending = self.pending.pop(category, None)
+            if pending is not None :
+                names = self.names[category]
+                names.extend(pending)
+                self.names[category] = sorted(set(names))
+            return self.names.get(category, [])
+
+    def complete (self, prefix, category) :
+        """
+        Returns
+        -------
+        The sorted list of the names of a category starting with the prefix
+        """
+        names = self.sortedNames(category)
+        if not prefix :
+            return list(names)
+        start = bisect_left(names, prefix)
+        stop = bisect_left(names, prefix + g_lastCharacter, start)
+        return names[start:stop]
+
+    def categories (self, prefix) :
+        """
+        Returns
+        -------
+        An OrderedDict of the sorted completions of the prefix in each category,
+        categories without completion being omitted
+        """
+        completions = OrderedDict()
+        for category in list(self.names) :
+            names = self.complete(prefix, category)
+            if names :
+                completions[category] = names
+        return completions
@@ -0,0 +1,731 @@
+################################################################################
+# Compiled evaluation of the model parameters
+################################################################################
+"""The analytical formulas of the internal parameters are parsed once, sorted
+   according to their dependencies and compiled into a single function
+   evaluating the whole model at once. Formulas are interned process-wide up
+   to the renaming of their symbols, so that the formulas shared by several
+   parameters or models are parsed, rewritten and folded only once."""
+
+# packages
+import ast
+import builtins
+import cmath
+import copy
+import hashlib
+import math
+from collections import OrderedDict, namedtuple
+from numbers import Real
+
+from src.parameter.cache import LRUCache
+from src.parameter.optimizer import ConstantFolder, optimizeAssignments
+from src.parameter.parameter import ExternTensorParam, InternParam, \
+    InternTensorParam
+
+# Process-wide cache of the compiled model code objects, indexed by a digest of
+# the dump of the syntax tree of the generated function. Each update of a model
+# (see ParameterEvaluator.updateFunction) adds a function, hence the bound.
+COMPILED_MODELS_CACHE_SIZE = 32
+g_compiledModels = LRUCache(COMPILED_MODELS_CACHE_SIZE)
+
+# Process-wide caches of the interned formulas, indexed by their text, and of
+# their shapes, indexed by the dump of their syntax tree. Every imported model
+# adds to them, hence the bounds; a dropped entry is simply interned again on
+# its next request.
+INTERNED_FORMULAS_CACHE_SIZE = 1 << 17
+FORMULA_SHAPES_CACHE_SIZE = 1 << 14
+g_internedFormulas = LRUCache(INTERNED_FORMULAS_CACHE_SIZE)
+g_formulaShapes = LRUCache(FORMULA_SHAPES_CACHE_SIZE)
+
+# Number of update functions (one per set of modified external parameters)
+# kept by each evaluator
+UPDATE_FUNCTIONS_CACHE_SIZE = 64
+
+# Names kept as they are in the shapes (the modules of the formulas); all other
+# names are symbols, replaced by placeholders __0, __1, ... in order of
+# appearance
+g_shapeModules = frozenset(['cmath', 'math'])
+SHAPE_PLACEHOLDER = '__%d'
+
+# Symbols making a formula complex (see isRealFormula)
+g_complexNames = frozenset(['complex', 'complexconjugate'])
+
+# Detached copy of an external parameter, used when pickling an evaluator (the
+# parameter objects themselves are views on the registry of this process)
+FrozenParam = namedtuple('FrozenParam', ['value'])
+
+class DependencyError (ValueError) :
+    """
+    Exception raised when the formulas of a model cannot be ordered (unknown
+    symbols or circular dependencies).
+    """
+    pass
+
+def parseFormula (formula) :
+    """
+    Parameters
+    ----------
+    formula: str, number or dict
+      The analytical formula of an internal parameter, or the formulas of the
+      components of a tensor indexed by their indices
+
+    Returns
+    -------
+    The syntax tree (ast.expr) associated with the formula
+    """
+    if isinstance(formula, dict) :
+        return ast.Dict(keys = [ast.Constant(value = key) for key in formula],
+            values = [parseFormula(value) for value in formula.values()])
+    try :
+        return ast.parse(str(formula).strip(), mode = 'eval').body
+    except SyntaxError as error :
+        raise DependencyError('Invalid formula \'%s\': %s' % (formula, error))
+
+def formulaSymbols (tree) :
+    """
+    Parameters
+    ----------
+    tree: ast.expr
+      The syntax tree of a formula
+
+    Returns
+    -------
+    The set of all the (non-attribute) symbols appearing in the formula
+    """
+    return set(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+
+def isRealFormula (tree) :
+    """
+    Parameters
+    ----------
+    tree: ast.expr
+      The syntax tree of a formula
+
+    Returns
+    -------
+    False if the formula explicitly involves complex numbers (imaginary
+    constants, complex-only functions or attributes), True otherwise
+    """
+    for node in ast.walk(tree) :
+        if isinstance(node, ast.Constant) and isinstance(node.value, complex) :
+            return False
+        if isinstance(node, ast.Dict) :
+            return False
+        if isinstance(node, ast.Name) and node.id in g_complexNames :
+            return False
+        if isinstance(node, ast.Attribute) :
+            if node.attr in ('real', 'imag', 'conjugate') :
+                return False
+            if isinstance(node.value, ast.Name) and node.value.id == 'cmath' and \
+              not hasattr(math, node.attr) :
+                return False
+    return True
+
+class RealMathRewriter (ast.NodeTransformer) :
+    """
+    Replaces the cmath functions and constants by their math counterparts.
+    """
+    def visit_Attribute (self, node) :
+        if isinstance(node.value, ast.Name) and node.value.id == 'cmath' :
+            return ast.copy_location(ast.Attribute(
+                value = ast.Name(id = 'math', ctx = ast.Load()),
+                attr = node.attr, ctx = node.ctx), node)
+        return self.generic_visit(node)
+
+class SymbolRenamer (ast.NodeTransformer) :
+    """
+    Replaces the symbols of a formula by placeholders, in place, recording them.
+    """
+    def __init__ (self) :
+        self.symbols = []
+        self.placeholders = {}
+
+    def visit_Name (self, node) :
+        if node.id in g_shapeModules :
+            return node
+        placeholder = self.placeholders.get(node.id)
+        if placeholder is None :
+            placeholder = SHAPE_PLACEHOLDER % len(self.symbols)
+            self.placeholders[node.id] = placeholder
+            self.symbols.append(node.id)
+        node.id = placeholder
+        return node
+
+def _internShape (tree, arity) :
+    """
+    Returns
+    -------
+    The FormulaShape of a canonical syntax tree, created if needed
+    """
+    key = ast.dump(tree)
+    shape = g_formulaShapes.get(key)
+    if shape is None :
+        shape = g_formulaShapes.setdefault(key, FormulaShape(tree, arity))
+    return shape
+
+class FormulaShape :
+    """
+    Formula up to the renaming of its symbols. What depends only on the shape is
+    done once per process: the real arithmetic rewriting, the constant folding
+    and the compilation of the formula into a function.
+    """
+    def __init__ (self, tree, arity) :
+        """
+        Parameters
+        ----------
+        tree: ast.expr
+          The syntax tree of the formula, its symbols being placeholders
+        arity: int
+          The number of symbols
+        """
+        self.tree = tree
+        self.arity = arity
+        self.real = isRealFormula(tree)
+        self._trees = {}
+        self._functions = {}
+
+    def __reduce__ (self) :
+        # Re-interned when unpickled, the cached trees and functions (keyed by
+        # namespace) being rebuilt
+        return (_internShape, (self.tree, self.arity))
+
+    def rewrittenTree (self, namespace, real = False, fold = True) :
+        """
+        Parameters
+        ----------
+        namespace: dict
+          The modules accessible from the formula
+        real: bool
+          If True, the cmath functions and constants are replaced by their math
+          counterparts
+        fold: bool
+          Whether the constant subexpressions are folded (see ConstantFolder)
+
+        Returns
+        -------
+        The syntax tree of the formula, in terms of the placeholders (shared,
+        not to be modified)
+        """
+        key = (id(namespace), real, fold)
+        entry = self._trees.get(key)
+        if entry is None :
+            tree = copy.deepcopy(self.tree)
+            if real :
+                tree = RealMathRewriter().visit(tree)
+            if fold :
+                tree = ConstantFolder(namespace).visit(tree)
+            # The namespace is kept alive with its tree, its id being a key
+            entry = self._trees.setdefault(key, (namespace, tree))
+        return entry[1]
+
+    def function (self, namespace, real = False) :
+        """
+        Returns
+        -------
+        The function computing the formula from the values of its symbols,
+        compiled once per namespace
+        """
+        key = (id(namespace), real)
+        entry = self._functions.get(key)
+        if entry is None :
+            arguments = ', '.join(SHAPE_PLACEHOLDER % i for i in range(self.arity))
+            expression = ast.parse('lambda %s : 0' % arguments, mode = 'eval')
+            expression.body.body = _instantiate(self.rewrittenTree(namespace,
+                real), {})
+            code = compile(ast.fix_missing_locations(expression),
+                '<pyrules-formula>', 'eval')
+            entry = self._functions.setdefault(key,
+                (namespace, eval(code, dict(namespace))))
+        return entry[1]
+
+def _instantiate (node, symbols) :
+    """
+    Returns
+    -------
+    A copy of a syntax tree, its placeholders being replaced by the symbols they
+    stand for (a dictionary indexed by placeholder)
+    """
+    if isinstance(node, ast.Name) :
+        return ast.Name(id = symbols.get(node.id, node.id), ctx = node.ctx)
+    if not isinstance(node, ast.AST) or isinstance(node, ast.expr_context) :
+        return node
+    copied = node.__class__()
+    for field in node._fields :
+        value = getattr(node, field, None)
+        if isinstance(value, list) :
+            value = [_instantiate(x, symbols) for x in value]
+        else :
+            value = _instantiate(value, symbols)
+        setattr(copied, field, value)
+    return copied
+
+class InternedFormula :
+    """
+    Formula of a parameter: a shared FormulaShape, and the symbols standing for
+    its placeholders.
+    """
+    __slots__ = ('shape', 'symbols')
+
+    def __init__ (self, shape, symbols) :
+        self.shape = shape
+        self.symbols = symbols
+
+    @property
+    def real (self) :
+        """
+        False if the formula explicitly involves complex numbers
+        """
+        return self.shape.real and g_complexNames.isdisjoint(self.symbols)
+
+    def tree (self, namespace, real = False, fold = True) :
+        """
+        Returns
+        -------
+        A new syntax tree of the formula (see FormulaShape.rewrittenTree)
+        """
+        return _instantiate(self.shape.rewrittenTree(namespace, real, fold),
+            dict((SHAPE_PLACEHOLDER % i, symbol)
+                for i, symbol in enumerate(self.symbols)))
+
+    def evaluate (self, values, namespace = None, real = False) :
+        """
+        Parameters
+        ----------
+        values: dict
+          The values of the parameters of the formula, indexed by symbol (the
+          other symbols being builtins)
+        namespace: dict
+          The modules accessible from the formula, by default the ones of
+          ParameterEvaluator
+
+        Returns
+        -------
+        The value of the formula, computed by the shared function of its shape
+        """
+        if namespace is None :
+            namespace = ParameterEvaluator.namespace
+        arguments = [values[x] if x in values else getattr(builtins, x)
+            for x in self.symbols]
+        return self.shape.function(namespace, real)(*arguments)
+
+def internFormula (formula) :
+    """
+    Parameters
+    ----------
+    formula: str, number or dict
+      The analytical formula of an internal parameter (see parseFormula)
+
+    Returns
+    -------
+    The InternedFormula of the formula, parsed on the first request only. All
+    formulas identical up to the renaming of their symbols share their shape.
+    """
+    key = formula if isinstance(formula, str) else repr(formula)
+    interned = g_internedFormulas.get(key)
+    if interned is None :
+        renamer = SymbolRenamer()
+        tree = renamer.visit(parseFormula(formula))
+        interned = InternedFormula(_internShape(tree, len(renamer.symbols)),
+            tuple(renamer.symbols))
+        interned = g_internedFormulas.setdefault(key, interned)
+    return interned
+
+def compileFunction (name, argNames, assignments, returnNames, namespace) :
+    """
+    Builds a function assigning each formula to its symbol, in the given order.
+
+    Parameters
+    ----------
+    name: str
+      The name of the generated function
+    argNames: list of str
+      The (positional) arguments of the function
+    assignments: list of (str, ast.expr) pairs
+      The symbols to compute, and the syntax tree of their formula
+    returnNames: list of str
+      The symbols returned (as a tuple) by the function
+    namespace: dict
+      The global namespace in which the function is evaluated
+
+    Returns
+    -------
+    The generated function
+    """
+    tree = ast.parse('def {}({}):\n    pass'.format(name, ', '.join(argNames)))
+    function = tree.body[0]
+    function.body = [ast.Assign(targets = [ast.Name(id = target, ctx = ast.Store())],
+        value = value) for target, value in assignments]
+    function.body.append(ast.Return(value = ast.Tuple(
+        elts = [ast.Name(id = symbol, ctx = ast.Load()) for symbol in returnNames],
+        ctx = ast.Load())))
+    ast.fix_missing_locations(tree)
+
+    key = hashlib.sha1(ast.dump(tree).encode('utf-8')).digest()
+    code = g_compiledModels.get(key)
+    if code is None :
+        code = g_compiledModels.setdefault(key,
+            compile(tree, '<pyrules-model>', 'exec'))
+
+    scope = dict(namespace)
+    exec(code, scope)
+    return scope[name]
+
+class ParameterEvaluator :
+    """
+    Evaluator of all the internal parameters of a model in terms of the external
+    ones.
+    """
+
+    # Modules and functions accessible from the formulas
+    namespace = {'cmath': cmath, 'math': math}
+
+    # Whether the formulas are optimized before compilation, and whether the
+    # constant coefficients of quotients are then reassociated to be shared
+    # (results may differ in the last bits, see optimizeAssignments)
+    optimize = True
+    reassociate = False
+
+    def __init__ (self, parameters) :
+        """
+        Parameters
+        ----------
+        parameters: dict
+          The parameters of the model, indexed by their symbol. Internal
+          parameters are InternParam instances, all other entries are treated
+          as external parameters.
+        """
+        self.parameters = OrderedDict(parameters)
+        self.externNames = [symbol for symbol, param in self.parameters.items()
+            if not isinstance(param, InternParam)]
+        self.tensorNames = set(symbol for symbol, param in self.parameters.items()
+            if isinstance(param, (ExternTensorParam, InternTensorParam)))
+
+        # Interned formulas, parsed once per process
+        self.formulas = OrderedDict()
+        self.dependencies = OrderedDict()
+        for symbol, param in self.parameters.items() :
+            if not isinstance(param, InternParam) :
+                continue
+            formula = internFormula(param.value)
+            unknown = [x for x in formula.symbols if x not in self.parameters
+                and x not in self.namespace and not hasattr(builtins, x)]
+            if unknown :
+                raise DependencyError('Unknown symbol(s) %s in the formula of %s' %
+                    (', '.join(sorted(unknown)), symbol))
+            self.formulas[symbol] = formula
+            self.dependencies[symbol] = set(x for x in formula.symbols
+                if x in self.parameters)
+
+        self.internNames = self.sortDependencies()
+        self.dependents = self.reverseDependencies()
+        self.realNames = self.inferRealParameters()
+        self._function = None
+        self._complexFunction = None
+
+        # Cached results of the last evaluation, for incremental updates
+        self.values = None
+        self._updateFunctions = LRUCache(UPDATE_FUNCTIONS_CACHE_SIZE)
+
+    def __getstate__ (self) :
+        """
+        The compiled functions and cached results are not pickled; they are
+        rebuilt on demand (e.g. in worker processes). External parameters are
+        replaced by a copy of their current value.
+        """
+        state = dict(self.__dict__)
+        state['parameters'] = OrderedDict((symbol, param
+            if isinstance(param, InternParam) else FrozenParam(param.value))
+            for symbol, param in self.parameters.items())
+        state['_function'] = None
+        state['_complexFunction'] = None
+        state['_updateFunctions'] = None
+        state['values'] = None
+        return state
+
+    def __setstate__ (self, state) :
+        self.__dict__.update(state)
+        self._updateFunctions = LRUCache(UPDATE_FUNCTIONS_CACHE_SIZE)
+
+    def sortDependencies (self) :
+        """
+        Returns
+        -------
+        The symbols of the internal parameters, sorted such that each one comes
+        after all the parameters it depends on (declaration order is kept when
+        possible).
+        """
+        remaining = OrderedDict((symbol, set(x for x in deps if x in self.formulas))
+            for symbol, deps in self.dependencies.items())
+        users = dict((symbol, []) for symbol in remaining)
+        for symbol, deps in remaining.items() :
+            for dep in deps :
+                users[dep].append(symbol)
+
+        ready = [symbol for symbol, deps in remaining.items() if not deps]
+        ready.reverse()
+        order = []
+        while ready :
+            symbol = ready.pop()
+            order.append(symbol)
+            released = []
+            for user in users[symbol] :
+                remaining[user].discard(symbol)
+                if not remaining[user] :
+                    released.append(user)
+            ready.extend(reversed(released))
+
+        if len(order) != len(remaining) :
+            cycle = [symbol for symbol in remaining if symbol not in set(order)]
+            raise DependencyError('Circular dependency between the parameters %s' %
+                ', '.join(cycle))
+        return order
+
+    def reverseDependencies (self) :
+        """
+        Returns
+        -------
+        A dictionary mapping each symbol to the internal parameters depending
+        directly on it.
+        """
+        dependents = dict((symbol, []) for symbol in self.parameters)
+        for symbol in self.internNames :
+            for dep in self.dependencies[symbol] :
+                dependents[dep].append(symbol)
+        return dependents
+
+    def inferRealParameters (self) :
+        """
+        Returns
+        -------
+        The set of the parameters that can be computed with real arithmetic:
+        real external scalars, and internal parameters declared real whose
+        formula and dependencies are all real.
+        """
+        real = set(symbol for symbol in self.externNames
+            if symbol not in self.tensorNames and
+            isinstance(self.parameters[symbol].value, Real))
+        for symbol in self.internNames :
+            if not self.parameters[symbol].complexParameter and \
+              symbol not in self.tensorNames and \
+              self.dependencies[symbol].issubset(real) and \
+              self.formulas[symbol].real :
+                real.add(symbol)
+        return real
+
+    def assignments (self, symbols, typed = True) :
+        """
+        Parameters
+        ----------
+        symbols: list of str
+          Internal parameters to compute, in evaluation order
+        typed: bool
+          If True, the real parameters use the math module instead of cmath
+
+        Returns
+        -------
+        The list of (symbol, formula) pairs to compile, optimized (constant
+        folding and common subexpression elimination) if self.optimize is set
+        """
+        # New trees, rewritten and folded once per shape
+        assignments = [(symbol, self.formulas[symbol].tree(self.namespace,
+            typed and symbol in self.realNames, self.optimize))
+            for symbol in symbols]
+        if self.optimize :
+            assignments = optimizeAssignments(assignments, self.namespace,
+                copy = False, reassociate = self.reassociate)
+        return assignments
+
+    @property
+    def function (self) :
+        """
+        The compiled function taking the external parameters as positional
+        arguments and returning the tuple of all internal parameters. The real
+        parameters are computed with real arithmetic.
+        """
+        if self._function is None :
+            self._function = compileFunction('_evaluate', self.externNames,
+                self.assignments(self.internNames), self.internNames,
+                self.namespace)
+        return self._function
+
+    @property
+    def complexFunction (self) :
+        """
+        Same as function, but with complex arithmetic for all parameters. It is
+        used for the points where a real parameter leaves its real domain.
+        """
+        if self._complexFunction is None :
+            self._complexFunction = compileFunction('_evaluate', self.externNames,
+                self.assignments(self.internNames, typed = False),
+                self.internNames, self.namespace)
+        return self._complexFunction
+
+    def callModel (self, inputs) :
+        """
+        Parameters
+        ----------
+        inputs: list
+          The values of all external parameters
+
+        Returns
+        -------
+        The tuple of the values of all internal parameters, computed with real
+        arithmetic where possible
+        """
+        try :
+            return self.function(*inputs)
+        except (ValueError, TypeError) :
+            # math domain error: a 'real' parameter is complex at this point
+            return self.complexFunction(*inputs)
+
+    def externValues (self, values) :
+        """
+        Parameters
+        ----------
+        values: dict
+          New values for some of the external parameters, indexed by symbol
+
+        Returns
+        -------
+        The list of the values of all external parameters, in the order
+        expected by the compiled function.
+        """
+        unknown = [x for x in values if x not in self.externNames]
+        if unknown :
+            raise KeyError('Unknown external parameter(s) %s' % ', '.join(unknown))
+        return [values[symbol] if symbol in values else self.parameters[symbol].value
+            for symbol in self.externNames]
+
+    def evaluate (self, **values) :
+        """
+        Evaluates the whole model in a single call.
+
+        Parameters
+        ----------
+        values:
+          Values overriding the ones of the external parameters, indexed by
+          symbol
+
+        Returns
+        -------
+        An OrderedDict with the values of all external and internal parameters
+        """
+        inputs = self.externValues(values)
+        results = OrderedDict(zip(self.externNames, inputs))
+        results.update(zip(self.internNames, self.callModel(inputs)))
+        return results
+
+    def refresh (self, **values) :
+        """
+        Evaluates the whole model and caches the results for later incremental
+        updates.
+
+        Parameters
+        ----------
+        values:
+          Values overriding the ones of the external parameters, indexed by
+          symbol
+
+        Returns
+        -------
+        The cached OrderedDict of all parameter values
+        """
+        self.values = self.evaluate(**values)
+        return self.values
+
+    def downstream (self, symbols) :
+        """
+        Parameters
+        ----------
+        symbols: iterable of str
+          Parameters that have been modified
+
+        Returns
+        -------
+        The internal parameters depending (directly or not) on the modified
+        ones, in evaluation order.
+        """
+        dirty = set()
+        stack = list(symbols)
+        while stack :
+            for user in self.dependents[stack.pop()] :
+                if user not in dirty :
+                    dirty.add(user)
+                    stack.append(user)
+        return [symbol for symbol in self.internNames if symbol in dirty]
+
+    def updateFunction (self, symbols, typed = True) :
+        """
+        Parameters
+        ----------
+        symbols: frozenset of str
+          External parameters that have been modified
+        typed: bool
+          If True, the real parameters are computed with real arithmetic
+
+        Returns
+        -------
+        A (function, arguments, results) triplet. The compiled function takes
+        the values of the argument symbols and returns the new values of the
+        result symbols, i.e. of all the parameters downstream of the modified
+        ones.
+        """
+        entry = self._updateFunctions.get((symbols, typed))
+        if entry is None :
+            dirty = self.downstream(symbols)
+            computed = set(dirty)
+            arguments = sorted(set(dep for symbol in dirty
+                for dep in self.dependencies[symbol] if dep not in computed))
+            function = compileFunction('_update', arguments,
+                self.assignments(dirty, typed), dirty, self.namespace)
+            entry = self._updateFunctions.setdefault((symbols, typed),
+                (function, arguments, dirty))
+        return entry
+
+    def hasChanged (self, old, new) :
+        """
+        Returns
+        -------
+        True if the value of a parameter has been modified
+        """
+        return old != new
+
+    def update (self, **values) :
+        """
+        Modifies some external parameters and re-evaluates only the internal
+        parameters depending on them, the other ones being taken from the
+        cached results.
+
+        Parameters
+        ----------
+        values:
+          The new values of the external parameters, indexed by symbol
+
+        Returns
+        -------
+        The list of the symbols of all parameters whose value changed
+        """
+        if self.values is None :
+            self.refresh()
+        self.externValues(values)
+
+        changed = [symbol for symbol, value in values.items()
+            if self.hasChanged(self.values[symbol], value)]
+        if not changed :
+            return []
+        for symbol in changed :
+            self.values[symbol] = values[symbol]
+
+        function, arguments, dirty = self.updateFunction(frozenset(changed))
+        inputs = [self.values[symbol] for symbol in arguments]
+        try :
+            outputs = function(*inputs)
+        except (ValueError, TypeError) :
+            function, arguments, dirty = self.updateFunction(frozenset(changed),
+                typed = False)
+            outputs = function(*inputs)
+        for symbol, value in zip(dirty, outputs) :
+            if self.hasChanged(self.values[symbol], value) :
+                changed.append(symbol)
+            self.values[symbol] = value
+        return changed
@@ -0,0 +1,347 @@
+################################################################################
+# Forward-mode derivatives of the model parameters
+################################################################################
+"""Jacobian of the internal parameters with respect to the external ones. The
+   compiled model is run on dual numbers, made of the values at all points and
+   of their gradients, so that the values and all derivatives are obtained in
+   a single vectorized pass."""
+
+# packages
+import cmath
+import math
+from collections import OrderedDict
+
+import numpy
+
+from src.parameter.tensor import stackTensor, tensorShape
+from src.parameter.vectorized import VectorizedEvaluator, broadcastShape, \
+    g_numpyCmath, g_numpyMath
+
+def _scale (gradient, factor) :
+    """
+    Returns
+    -------
+    The product of a gradient (points..., inputs) by a factor (points...)
+    """
+    return gradient * numpy.expand_dims(numpy.asarray(factor), -1)
+
+class Dual :
+    """
+    Dual number: values over a set of points, and their derivatives with
+    respect to the inputs (along the last axis of the gradient).
+    """
+    __slots__ = ('value', 'gradient')
+
+    # Arithmetic with numpy arrays is left to the methods of this class
+    __array_ufunc__ = None
+
+    def __init__ (self, value, gradient) :
+        """
+        Parameters
+        ----------
+        value: ndarray
+          The values, of shape (points...)
+        gradient: ndarray
+          The derivatives, of shape (points..., inputs)
+        """
+        self.value = value
+        self.gradient = gradient
+
+    def __repr__ (self) :
+        return 'Dual(%r, %r)' % (self.value, self.gradient)
+
+    def __pos__ (self) :
+        return self
+
+    def __neg__ (self) :
+        return Dual(-self.value, -self.gradient)
+
+    def __abs__ (self) :
+        value = numpy.abs(self.value)
+        gradient = _scale(self.gradient.real, numpy.real(self.value)) + \
+            _scale(self.gradient.imag, numpy.imag(self.value))
+        return Dual(value, _scale(gradient, 1. / value))
+
+    def __add__ (self, other) :
+        if isinstance(other, Dual) :
+            return Dual(self.value + other.value, self.gradient + other.gradient)
+        return Dual(self.value + other, self.gradient)
+
+    __radd__ = __add__
+
+    def __sub__ (self, other) :
+        if isinstance(other, Dual) :
+            return Dual(self.value - other.value, self.gradient - other.gradient)
+        return Dual(self.value - other, self.gradient)
+
+    def __rsub__ (self, other) :
+        return Dual(other - self.value, -self.gradient)
+
+    def __mul__ (self, other) :
+        if isinstance(other, Dual) :
+            return Dual(self.value * other.value,
+                _scale(self.gradient, other.value) + _scale(other.gradient, self.value))
+        return Dual(self.value * other, _scale(self.gradient, other))
+
+    __rmul__ = __mul__
+
+    def __truediv__ (self, other) :
+        if isinstance(other, Dual) :
+            value = self.value / other.value
+            return Dual(value, _scale(self.gradient - _scale(other.gradient, value),
+                1. / other.value))
+        return Dual(self.value / other, _scale(self.gradient, 1. / numpy.asarray(other)))
+
+    def __rtruediv__ (self, other) :
+        value = other / self.value
+        return Dual(value, _scale(self.gradient, -value / self.value))
+
+    def __pow__ (self, other) :
+        if isinstance(other, Dual) :
+            value = self.value ** other.value
+            return Dual(value, _scale(other.gradient, value * numpy.log(self.value)) +
+                _scale(self.gradient, other.value * self.value ** (other.value - 1)))
+        return Dual(self.value ** other,
+            _scale(self.gradient, other * self.value ** (other - 1)))
+
+    def __rpow__ (self, other) :
+        value = other ** self.value
+        return Dual(value, _scale(self.gradient, value * numpy.log(other)))
+
+    @property
+    def real (self) :
+        return Dual(numpy.real(self.value), self.gradient.real)
+
+    @property
+    def imag (self) :
+        return Dual(numpy.imag(self.value), self.gradient.imag)
+
+    def conjugate (self) :
+        return Dual(numpy.conj(self.value), numpy.conj(self.gradient))
+
+# Derivatives of the functions of one variable, in terms of the namespace of
+# numpy functions f, of the argument x and of the value y of the function
+g_derivatives = {
+    'exp': lambda f, x, y : y,
+    'sin': lambda f, x, y : f['cos'](x),
+    'cos': lambda f, x, y : -f['sin'](x),
+    'tan': lambda f, x, y : 1. + y**2,
+    'atan': lambda f, x, y : 1. / (1. + x**2),
+    'sinh': lambda f, x, y : f['cosh'](x),
+    'cosh': lambda f, x, y : f['sinh'](x),
+    'tanh': lambda f, x, y : 1. - y**2,
+    'asinh': lambda f, x, y : 1. / f['sqrt'](x**2 + 1.),
+    'sqrt': lambda f, x, y : 0.5 / y,
+    'log': lambda f, x, y : 1. / x,
+    'log10': lambda f, x, y : 1. / (x * math.log(10.)),
+    'asin': lambda f, x, y : 1. / f['sqrt'](1. - x**2),
+    'acos': lambda f, x, y : -1. / f['sqrt'](1. - x**2),
+    'acosh': lambda f, x, y : 1. / f['sqrt'](x**2 - 1.),
+    'atanh': lambda f, x, y : 1. / (1. - x**2),
+    'fabs': lambda f, x, y : numpy.sign(x),
+    'degrees': lambda f, x, y : 180. / math.pi,
+    'radians': lambda f, x, y : math.pi / 180.,
+}
+
+class DualMath :
+    """
+    Namespace standing for the math or cmath module in formulas evaluated on
+    dual numbers. Functions called on plain numbers or arrays are the numpy
+    ones of the vectorized evaluation.
+    """
+    def __init__ (self, module, functions) :
+        """
+        Parameters
+        ----------
+        module: module
+          The module (math or cmath) being replaced; its constants are kept
+        functions: dict
+          The numpy functions replacing the ones of the module, by name
+        """
+        self.__name__ = module.__name__
+        self.functions = functions
+        for name in ['pi', 'e', 'tau', 'inf', 'nan'] :
+            if hasattr(module, name) :
+                setattr(self, name, getattr(module, name))
+        for name, function in functions.items() :
+            setattr(self, name, self.wrap(name, function))
+
+    def __getattr__ (self, name) :
+        raise AttributeError('The function %s.%s has no dual counterpart' %
+            (self.__name__, name))
+
+    def wrap (self, name, function) :
+        """
+        Returns
+        -------
+        The counterpart of a numpy function acting on dual numbers. Functions
+        without derivative (e.g. floor, isnan) act on the values only.
+        """
+        derivative = g_derivatives.get(name)
+        special = getattr(self, '_' + name, None)
+
+        def dualFunction (*args) :
+            if not any(isinstance(x, Dual) for x in args) :
+                return function(*args)
+            if special is not None :
+                return special(*args)
+            if derivative is None :
+                return function(*[x.value if isinstance(x, Dual) else x
+                    for x in args])
+            x = args[0]
+            value = function(x.value)
+            return Dual(value, _scale(x.gradient,
+                derivative(self.functions, x.value, value)))
+        dualFunction.__name__ = name
+        return dualFunction
+
+    @staticmethod
+    def _pow (x, y) :
+        return x ** y
+
+    @staticmethod
+    def _copysign (x, y) :
+        y = y.value if isinstance(y, Dual) else y
+        if not isinstance(x, Dual) :
+            return numpy.copysign(x, y)
+        sign = numpy.sign(x.value) * numpy.copysign(1., y)
+        return x * sign
+
+    @staticmethod
+    def _hypot (x, y) :
+        return (x * x + y * y) ** 0.5
+
+    @staticmethod
+    def _atan2 (y, x) :
+        yValue = y.value if isinstance(y, Dual) else y
+        xValue = x.value if isinstance(x, Dual) else x
+        value = numpy.arctan2(yValue, xValue)
+        norm = xValue**2 + yValue**2
+        gradient = 0.
+        if isinstance(y, Dual) :
+            gradient = gradient + _scale(y.gradient, xValue / norm)
+        if isinstance(x, Dual) :
+            gradient = gradient - _scale(x.gradient, yValue / norm)
+        return Dual(value, gradient)
+
+    @staticmethod
+    def _phase (z) :
+        return Dual(numpy.angle(z.value),
+            (z.gradient / numpy.expand_dims(z.value, -1)).imag)
+
+class JacobianEvaluator (VectorizedEvaluator) :
+    """
+    Evaluator of the internal parameters of a model and of their derivatives
+    with respect to the external parameters, over arrays of values of the
+    external parameters.
+    """
+
+    namespace = {'cmath': DualMath(cmath, g_numpyCmath),
+                 'math': DualMath(math, g_numpyMath)}
+
+    def jacobian (self, inputs = None, **values) :
+        """
+        Evaluates the whole model and its Jacobian in one vectorized pass.
+
+        Parameters
+        ----------
+        inputs: list of str
+          The (scalar) external parameters to differentiate with respect to,
+          by default all of them
+        values:
+          Arrays (or scalars) overriding the values of the external parameters,
+          indexed by symbol. They must have broadcastable shapes.
+
+        Returns
+        -------
+        A (values, jacobian) pair of OrderedDicts. The values are those of all
+        external and internal parameters (see VectorizedEvaluator.evaluate).
+        The Jacobian of each internal parameter is an array of shape (points...)
+        + (tensor indices...) + (len(inputs),).
+        """
+        if inputs is None :
+            inputs = [symbol for symbol in self.externNames
+                if symbol not in self.tensorNames]
+        invalid = [symbol for symbol in inputs if symbol not in self.externNames
+            or symbol in self.tensorNames]
+        if invalid :
+            raise KeyError('Cannot differentiate with respect to %s' %
+                ', '.join(invalid))
+
+        arrays = [numpy.asarray(x) for x in self.externValues(values)]
+        shape = broadcastShape([x.shape for symbol, x in zip(self.externNames, arrays)
+            if symbol not in self.tensorNames])
+        arguments = list(arrays)
+        for column, symbol in enumerate(inputs) :
+            index = self.externNames.index(symbol)
+            gradient = numpy.zeros(shape + (len(inputs),))
+            gradient[..., column] = 1.
+            arguments[index] = Dual(numpy.broadcast_to(arrays[index], shape),
+                gradient)
+        outputs = self.callModel(arguments)
+
+        results = OrderedDict()
+        for symbol, value in zip(self.externNames, arrays) :
+            if symbol in self.tensorNames :
+                results[symbol] = numpy.broadcast_to(value, shape + value.shape)
+            else :
+                results[symbol] = numpy.broadcast_to(value, shape)
+        jacobian = OrderedDict()
+        for symbol, output in zip(self.internNames, outputs) :
+            if isinstance(output, dict) :
+                tensor = tensorShape(self.parameters[symbol])
+                parts = OrderedDict((key, self.split(x, shape, len(inputs)))
+                    for key, x in output.items())
+                results[symbol] = stackTensor(OrderedDict((key, x[0])
+                    for key, x in parts.items()), tensor, shape)
+                jacobian[symbol] = numpy.moveaxis(stackTensor(OrderedDict(
+                    (key, x[1]) for key, x in parts.items()), tensor,
+                    shape + (len(inputs),)), len(shape), -1)
+            else :
+                results[symbol], jacobian[symbol] = self.split(output, shape,
+                    len(inputs))
+        return results, jacobian
+
+    def takePoints (self, value, shape, mask) :
+        """
+        Returns
+        -------
+        The values (dual numbers included) at the points selected by a mask
+        """
+        if isinstance(value, Dual) :
+            return Dual(numpy.broadcast_to(value.value, shape)[mask],
+                numpy.broadcast_to(value.gradient,
+                    shape + value.gradient.shape[-1:])[mask])
+        return VectorizedEvaluator.takePoints(self, value, shape, mask)
+
+    def putPoints (self, value, points, shape, mask) :
+        """
+        Returns
+        -------
+        The values (dual numbers included) at all points, the ones at the points
+        selected by a mask being replaced by the given ones
+        """
+        duals = [x for x in (value, points) if isinstance(x, Dual)]
+        if not duals :
+            return VectorizedEvaluator.putPoints(self, value, points, shape, mask)
+        ninputs = duals[0].gradient.shape[-1]
+        value, gradient = self.split(value, shape, ninputs)
+        pointValue, pointGradient = self.split(points,
+            (int(mask.sum()),), ninputs)
+        return Dual(VectorizedEvaluator.putPoints(self, value, pointValue,
+            shape, mask), VectorizedEvaluator.putPoints(self, gradient,
+            pointGradient, shape + (ninputs,), mask))
+
+    @staticmethod
+    def split (output, shape, ninputs) :
+        """
+        Returns
+        -------
+        The (values, derivatives) pair of an output of the model, broadcast to
+        the shape of the points (constants having vanishing derivatives)
+        """
+        if isinstance(output, Dual) :
+            return numpy.broadcast_to(output.value, shape), \
+                numpy.broadcast_to(output.gradient, shape + (ninputs,))
+        return numpy.broadcast_to(output, shape), \
+            numpy.zeros(shape + (ninputs,), dtype = numpy.result_type(output))
@@ -0,0 +1,398 @@
+################################################################################
+# Loader of UFO-like parameters.py model files
+################################################################################
+"""Model files are made of Parameter(...) declarations. They are parsed with the
+   ast module (never executed) into plain specifications, which are cached on
+   disk next to the model file and turned into parameter objects. The cache is
+   a python literal, read back with ast.literal_eval, so that it cannot run
+   any code either."""
+
+# packages
+import ast
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from src.parameter.merge import mergeModelSpecs
+from src.parameter.parameter import ExternParam, ExternTensorParam, \
+    InternParam, InternTensorParam, g_defaultModel
+
+# Bumped whenever the format of the parsed specifications changes
+CACHE_VERSION = 2
+
+# Directory (relative to the model file) holding the cache
+CACHE_DIRECTORY = '.pyrules_cache'
+
+# Specifications already loaded by this process (e.g. a server), by model file
+# path: (modification time, size, specifications)
+g_modelSpecs = {}
+
+class ModelFileError (ValueError) :
+    """
+    Exception raised for a model file that cannot be understood.
+    """
+    pass
+
+def _literal (node) :
+    """
+    Converts the syntax tree of a Parameter(...) argument into a python value.
+    Index('x') declarations are replaced by their name, and the keys of the
+    tensor component dictionaries are turned into tuples of indices.
+    """
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+      node.func.id == 'Index' and len(node.args) == 1 :
+        return _literal(node.args[0])
+    if isinstance(node, ast.Dict) :
+        return OrderedDict((_componentKey(key), _literal(value))
+            for key, value in zip(node.keys, node.values))
+    if isinstance(node, ast.List) :
+        return [_literal(x) for x in node.elts]
+    if isinstance(node, ast.Tuple) :
+        return tuple(_literal(x) for x in node.elts)
+    return ast.literal_eval(node)
+
+def _componentKey (node) :
+    """
+    Returns
+    -------
+    The tuple of indices of a tensor component. Keys mistakenly written as
+    sets ({0,1}) or one-entry dictionaries ({1:0}) are accepted.
+    """
+    if isinstance(node, ast.Set) :
+        return tuple(_literal(x) for x in node.elts)
+    if isinstance(node, ast.Dict) and len(node.keys) == 1 :
+        return (_literal(node.keys[0]), _literal(node.values[0]))
+    return _literal(node)
+
+def parseModelSource (source, filename = '<model>') :
+    """
+    Parameters
+    ----------
+    source: str
+      The content of a parameters.py model file
+    filename: str
+      The name of the file, for error messages
+
+    Returns
+    -------
+    The list of the Parameter(...) declarations, as dictionaries of their
+    keyword arguments
+    """
+    try :
+        tree = ast.parse(source, filename)
+    except SyntaxError as error :
+        raise ModelFileError('Cannot parse %s: %s' % (filename, error))
+
+    specs = []
+    for statement in tree.body :
+        if not isinstance(statement, (ast.Assign, ast.Expr)) :
+            continue
+        call = statement.value
+        if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name)
+          and call.func.id == 'Parameter') :
+            continue
+        try :
+            spec = OrderedDict((keyword.arg, _literal(keyword.value))
+                for keyword in call.keywords)
+        except ValueError as error :
+            raise ModelFileError('%s, line %d: %s' % (filename, call.lineno, error))
+        if 'name' not in spec or 'nature' not in spec or 'value' not in spec :
+            raise ModelFileError('%s, line %d: a parameter needs a name, a nature and a value' %
+                (filename, call.lineno))
+        specs.append(spec)
+    return specs
+
+def modelFilePath (path) :
+    """
+    Returns
+    -------
+    The path to the parameters.py file of a model given by its directory or file
+    """
+    if os.path.isdir(path) :
+        path = os.path.join(path, 'parameters.py')
+    return os.path.abspath(path)
+
+def _cachePath (path) :
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIRECTORY, name + '.specs')
+
+def _plain (value) :
+    """
+    Returns
+    -------
+    A copy of a specification made of builtin containers only, whose repr is a
+    python literal
+    """
+    if isinstance(value, dict) :
+        return dict((key, _plain(x)) for key, x in value.items())
+    if isinstance(value, list) :
+        return [_plain(x) for x in value]
+    return value
+
+def _ordered (value) :
+    """
+    Returns
+    -------
+    A specification read from the cache, its dictionaries being OrderedDicts
+    again (as produced by parseModelSource)
+    """
+    if isinstance(value, dict) :
+        return OrderedDict((key, _ordered(x)) for key, x in value.items())
+    if isinstance(value, list) :
+        return [_ordered(x) for x in value]
+    return value
+
+def loadModelSpecs (path, useCache = True) :
+    """
+    Parses a model file, unless its cached specifications are still valid. The
+    cache is keyed by the modification time and size of the file, and by its
+    hash when they changed. Specifications loaded once are also kept in memory
+    for the lifetime of the process.
+
+    Parameters
+    ----------
+    path: str
+      The model file, or the directory containing its parameters.py
+    useCache: bool
+      Whether the cache is read and updated
+
+    Returns
+    -------
+    The list of the parameter specifications (see parseModelSource)
+    """
+    logger = logging.getLogger('PyRules')
+    path = modelFilePath(path)
+    status = os.stat(path)
+    cachePath = _cachePath(path)
+
+    if useCache :
+        loaded = g_modelSpecs.get(path)
+        if loaded is not None and loaded[0] == status.st_mtime_ns and \
+          loaded[1] == status.st_size :
+            return loaded[2]
+
+    cache = None
+    if useCache :
+        try :
+            with open(cachePath, 'r') as stream :
+                cache = ast.literal_eval(stream.read())
+            if cache.get('version') != CACHE_VERSION :
+                cache = None
+            else :
+                cache['specs'] = _ordered(cache['specs'])
+        except Exception :
+            cache = None
+    if cache is not None and cache['mtime'] == status.st_mtime_ns and \
+      cache['size'] == status.st_size :
+        logger.debug('Model specifications read from ' + cachePath)
+        g_modelSpecs[path] = (status.st_mtime_ns, status.st_size, cache['specs'])
+        return cache['specs']
+
+    with open(path, 'rb') as stream :
+        source = stream.read()
+    digest = hashlib.sha1(source).hexdigest()
+    if cache is not None and cache['hash'] == digest :
+        specs = cache['specs']
+    else :
+        logger.debug('Parsing the model file ' + path)
+        specs = parseModelSource(source.decode('utf-8'), path)
+
+    if useCache :
+        cache = {'version': CACHE_VERSION, 'mtime': status.st_mtime_ns,
+            'size': status.st_size, 'hash': digest, 'specs': _plain(specs)}
+        try :
+            if not os.path.isdir(os.path.dirname(cachePath)) :
+                os.makedirs(os.path.dirname(cachePath))
+            temporary = cachePath + '.%d' % os.getpid()
+            with open(temporary, 'w') as stream :
+                stream.write(repr(cache))
+            os.replace(temporary, cachePath)
+        except (IOError, OSError) as error :
+            logger.debug('Cannot write the model cache: %s' % error)
+        g_modelSpecs[path] = (status.st_mtime_ns, status.st_size, specs)
+    return specs
+
+def _orderBlockCode (spec) :
+    code = spec.get('lhacode')
+    if code is not None :
+        code = code[0] if len(code) == 1 else tuple(code)
+    return code
+
+def checkSpecs (specs, model) :
+    """
+    Validates parameter specifications against a model before any object is
+    created, so that an invalid model leaves the target model untouched.
+
+    Parameters
+    ----------
+    specs: list of dict
+      The parameter specifications (see parseModelSource)
+    model: Model
+      The model that is to receive the parameters
+    """
+    names = set()
+    codes = {}
+    for spec in specs :
+        name = spec['name']
+        if name in names or name in model.parameters :
+            raise ModelFileError('The parameter %s is declared twice' % name)
+        names.add(name)
+        if spec['nature'] not in ('external', 'internal') :
+            raise ModelFileError('Unknown nature \'%s\' for the parameter %s' %
+                (spec['nature'], name))
+        if spec['nature'] != 'external' :
+            continue
+        if 'indices' in spec :
+            value = spec['value']
+            if isinstance(value, dict) and not all(isinstance(key, tuple) and
+              len(key) == len(spec['indices']) and
+              all(isinstance(x, int) and x >= 0 for x in key) for key in value) :
+                raise ModelFileError('The components of %s must be indexed by %d (0-based) indices' %
+                    (name, len(spec['indices'])))
+            continue
+        code = _orderBlockCode(spec)
+        if code is None :
+            continue
+        blockName = spec.get('lhablock', 'PyRulesBlock')
+        block = model.blocks.get(blockName)
+        used = codes.setdefault(blockName, set())
+        if code in used or (block is not None and
+          code in block.externParamsByOrderBlock) :
+            raise ModelFileError('Cannot insert duplicate external params in block %s at %s' %
+                (blockName, code))
+        used.add(code)
+
+def buildModel (specs, model = None) :
+    """
+    Creates the parameter objects of a model. The specifications are validated
+    first (see checkSpecs); all objects are then created, and external
+    parameters are inserted into their Les Houches blocks one block at a time.
+    The model is rolled back to its previous content if any step fails.
+
+    Parameters
+    ----------
+    specs: list of dict
+      The parameter specifications (see parseModelSource)
+    model: Model
+      The model receiving the blocks and parameters, by default g_defaultModel
+
+    Returns
+    -------
+    An OrderedDict of the parameters, indexed by their symbol
+    """
+    if model is None :
+        model = g_defaultModel
+    with model.lock :
+        checkSpecs(specs, model)
+        mark = model.checkpoint()
+        try :
+            parameters, blocks = _createParameters(specs, model)
+            for blockName, params in blocks.items() :
+                model.block(blockName).bulkInsert(params)
+            for name, param in parameters.items() :
+                model.addParameter(name, param)
+        except Exception :
+            model.rollback(mark)
+            raise
+    return parameters
+
+def _tensorValue (value) :
+    """
+    Returns
+    -------
+    The value of an external tensor, its components being possibly given as a
+    dictionary indexed by tuples of (0-based) indices, the missing components
+    then being zero
+    """
+    if not isinstance(value, dict) :
+        return value
+    import numpy
+    shape = [max(x) + 1 for x in zip(*value)]
+    tensor = numpy.zeros(shape, complex if any(isinstance(x, complex)
+        for x in value.values()) else float)
+    for key, x in value.items() :
+        tensor[key] = x
+    return tensor
+
+def _createParameters (specs, model) :
+    """
+    Returns
+    -------
+    The OrderedDict of the parameter objects of validated specifications, by
+    symbol, and the OrderedDict of the lists of the external parameters to
+    insert into each block, by block name
+    """
+    parameters = OrderedDict()
+    blocks = OrderedDict()
+    for spec in specs :
+        complexParameter = spec.get('type', 'real') == 'complex'
+        interactionOrder = spec.get('interactionOrder')
+        if spec['nature'] == 'external' :
+            blockName = spec.get('lhablock', 'PyRulesBlock')
+            if 'indices' in spec :
+                param = ExternTensorParam(spec['indices'],
+                    _tensorValue(spec['value']), blockName, complexParameter,
+                    interactionOrder,
+                    unitary = spec.get('unitary', False),
+                    hermitian = spec.get('hermitian', False),
+                    orthogonal = spec.get('orthogonal', False),
+                    model = model, insert = False)
+            else :
+                param = ExternParam(spec['value'], blockName, interactionOrder,
+                    orderBlock = _orderBlockCode(spec), insert = False,
+                    model = model)
+            blocks.setdefault(blockName, []).append(param)
+        elif 'indices' in spec :
+            param = InternTensorParam(spec['indices'], spec['value'],
+                complexParameter, interactionOrder,
+                unitary = spec.get('unitary', False),
+                hermitian = spec.get('hermitian', False),
+                orthogonal = spec.get('orthogonal', False))
+        else :
+            param = InternParam(spec['value'], complexParameter,
+                interactionOrder)
+        parameters[spec['name']] = param
+    return parameters, blocks
+
+def loadModel (path, useCache = True, model = None) :
+    """
+    Parameters
+    ----------
+    path: str
+      The model file, or the directory containing its parameters.py
+    useCache: bool
+      Whether the cache of the parsed model file is used
+    model: Model
+      The model receiving the parameters, by default g_defaultModel
+
+    Returns
+    -------
+    An OrderedDict of the parameters of the model, indexed by their symbol
+    """
+    return buildModel(loadModelSpecs(path, useCache), model)
+
+def loadModels (paths, policy = 'error', useCache = True, model = None) :
+    """
+    Loads several models (e.g. a base model and its extensions) as a single one.
+
+    Parameters
+    ----------
+    paths: list of str
+      The model files (or directories), by increasing priority
+    policy: str
+      How the conflicts between the models are resolved (see mergeModelSpecs)
+    useCache: bool
+      Whether the cache of the parsed model files is used
+    model: Model
+      The model receiving the parameters, by default g_defaultModel
+
+    Returns
+    -------
+    A (parameters, conflicts) pair: the OrderedDict of the parameters of the
+    combined model, indexed by their symbol, and the list of the MergeConflicts
+    found between the models
+    """
+    specs, conflicts = mergeModelSpecs([(path, loadModelSpecs(path, useCache))
+        for path in paths], policy)
+    return buildModel(specs, model), conflicts
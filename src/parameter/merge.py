@@ -0,0 +1,223 @@
+################################################################################
+# Merging of model specifications
+################################################################################
+"""Several models (e.g. a base model and its extensions) are combined at the
+   level of their parameter specifications, before any parameter object is
+   created. Duplicates and conflicts are found through hash indexes on the
+   parameter names, on the Les Houches (block, code) slots and on formula
+   fingerprints, in a single pass over all specifications."""
+
+# packages
+import ast
+import hashlib
+from collections import OrderedDict, namedtuple
+
+from src.parameter.evaluator import DependencyError, internFormula
+
+# Policies for the resolution of the conflicts: raise an error, keep the first
+# definition, or let the last model override the previous ones
+MERGE_POLICIES = ('error', 'first', 'last')
+
+# Conflict found while merging:
+#  - kind: 'name' (same name, different definitions), 'slot' (different
+#    parameters at the same block and code), 'duplicate' (identical
+#    definitions, merged) or 'equivalent' (internal parameters with identical
+#    formulas under different names, both kept)
+#  - key: the name, the (block, code) pair or the formula fingerprint
+#  - kept, dropped: the (model label, parameter name) pairs of the retained and
+#    discarded (or relocated, for slots) definitions
+MergeConflict = namedtuple('MergeConflict', ['kind', 'key', 'kept', 'dropped'])
+
+class ModelMergeError (ValueError) :
+    """
+    Exception raised for conflicting models merged with the 'error' policy.
+    """
+    def __init__ (self, conflicts) :
+        self.conflicts = conflicts
+        super(ModelMergeError, self).__init__('Conflicting models:\n' +
+            '\n'.join('  ' + describeConflict(x) for x in conflicts))
+
+def describeConflict (conflict) :
+    """
+    Returns
+    -------
+    A human-readable description of a MergeConflict
+    """
+    kept = '%s in %s' % (conflict.kept[1], conflict.kept[0])
+    dropped = '%s in %s' % (conflict.dropped[1], conflict.dropped[0])
+    if conflict.kind == 'name' :
+        return 'parameter %s defined differently (%s / %s)' % (conflict.key,
+            conflict.kept[0], conflict.dropped[0])
+    if conflict.kind == 'slot' :
+        return 'block %s, code %s used by %s and %s' % (conflict.key[0],
+            conflict.key[1], kept, dropped)
+    if conflict.kind == 'duplicate' :
+        return 'parameter %s defined identically (%s / %s)' % (conflict.key,
+            conflict.kept[0], conflict.dropped[0])
+    return 'same formula for %s and %s' % (kept, dropped)
+
+def formulaFingerprint (value) :
+    """
+    Parameters
+    ----------
+    value: number, str or dict
+      The value or formula(s) of a parameter
+
+    Returns
+    -------
+    A hash of the value, insensitive to the formatting of formulas
+    """
+    if isinstance(value, (str, dict)) :
+        try :
+            formula = internFormula(value)
+            text = ast.dump(formula.shape.tree) + repr(formula.symbols)
+        except DependencyError :
+            text = repr(value)
+    else :
+        text = repr(value)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def specFingerprint (spec) :
+    """
+    Returns
+    -------
+    A hash of a parameter specification, its value being compared through its
+    formula fingerprint
+    """
+    items = sorted((key, formulaFingerprint(value) if key == 'value' else repr(value))
+        for key, value in spec.items())
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+def specSlot (spec) :
+    """
+    Returns
+    -------
+    The (upper-case block name, code) pair of an external scalar parameter with
+    an explicit code, None otherwise
+    """
+    if spec['nature'] != 'external' or 'indices' in spec or \
+      spec.get('lhacode') is None :
+        return None
+    code = spec['lhacode']
+    code = code[0] if len(code) == 1 else tuple(code)
+    return (spec.get('lhablock', 'PyRulesBlock').upper(), code)
+
+def _relocated (spec) :
+    """
+    Returns
+    -------
+    A copy of an external parameter specification without its code, so that it
+    receives a free code of its block
+    """
+    spec = OrderedDict(spec)
+    del spec['lhacode']
+    return spec
+
+def mergeModelSpecs (models, policy = 'error') :
+    """
+    Parameters
+    ----------
+    models: list of (str, list of dict) pairs
+      The label and the parameter specifications of each model (see
+      parseModelSource), by increasing priority
+    policy: str
+      How the conflicts are resolved (one of MERGE_POLICIES). With 'first', the
+      first definition of a parameter is kept and a parameter taking an already
+      used (block, code) slot receives a free code; with 'last', later models
+      override the earlier ones and take their slots. With 'error', a
+      ModelMergeError listing all the conflicts is raised.
+
+    Returns
+    -------
+    A (specs, conflicts) pair: the merged list of specifications and the list
+    of the MergeConflicts found (resolved ones, duplicates and equivalences)
+    """
+    if policy not in MERGE_POLICIES :
+        raise ValueError('Unknown merge policy \'%s\' (expected %s)' %
+            (policy, ', '.join(MERGE_POLICIES)))
+
+    merged = []        # specifications, in order of first declaration
+    origins = []       # label of the model of each specification
+    byName = {}        # name -> position in merged
+    bySlot = {}        # (block, code) -> name
+    byFormula = {}     # formula fingerprint -> position of an internal param
+    fingerprints = {}  # position -> specification fingerprint
+    conflicts = []
+    errors = []
+
+    def claimSlot (position) :
+        """Records the slot of a specification, solving the collisions"""
+        spec = merged[position]
+        slot = specSlot(spec)
+        if slot is None :
+            return
+        owner = bySlot.get(slot)
+        if owner is None or owner == spec['name'] :
+            bySlot[slot] = spec['name']
+            return
+        other = byName[owner]
+        if policy == 'last' :
+            kept, dropped = position, other
+        else :
+            kept, dropped = other, position
+        conflict = MergeConflict('slot', slot,
+            (origins[kept], merged[kept]['name']),
+            (origins[dropped], merged[dropped]['name']))
+        conflicts.append(conflict)
+        if policy == 'error' :
+            errors.append(conflict)
+            return
+        merged[dropped] = _relocated(merged[dropped])
+        bySlot[slot] = merged[kept]['name']
+
+    for label, specs in models :
+        for spec in specs :
+            name = spec['name']
+            fingerprint = specFingerprint(spec)
+            position = byName.get(name)
+            if position is not None :
+                if fingerprints[position] == fingerprint :
+                    conflicts.append(MergeConflict('duplicate', name,
+                        (origins[position], name), (label, name)))
+                    continue
+                if policy == 'last' :
+                    conflict = MergeConflict('name', name, (label, name),
+                        (origins[position], name))
+                else :
+                    conflict = MergeConflict('name', name,
+                        (origins[position], name), (label, name))
+                conflicts.append(conflict)
+                if policy == 'error' :
+                    errors.append(conflict)
+                    slot = specSlot(spec)
+                    owner = bySlot.get(slot)
+                    if owner is not None and owner != name :
+                        conflict = MergeConflict('slot', slot,
+                            (origins[byName[owner]], owner), (label, name))
+                        conflicts.append(conflict)
+                        errors.append(conflict)
+                if policy != 'last' :
+                    continue
+                slot = specSlot(merged[position])
+                if slot is not None and bySlot.get(slot) == name :
+                    del bySlot[slot]
+                merged[position] = spec
+                origins[position] = label
+            else :
+                position = len(merged)
+                merged.append(spec)
+                origins.append(label)
+                byName[name] = position
+            fingerprints[position] = fingerprint
+            claimSlot(position)
+
+            if spec['nature'] == 'internal' :
+                formula = formulaFingerprint(spec['value'])
+                other = byFormula.setdefault(formula, position)
+                if other != position and merged[other]['name'] != name :
+                    conflicts.append(MergeConflict('equivalent', formula,
+                        (origins[other], merged[other]['name']), (label, name)))
+
+    if errors :
+        raise ModelMergeError(errors)
+    return merged, conflicts
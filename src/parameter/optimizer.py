@@ -0,0 +1,314 @@
+################################################################################
+# Optimization of the compiled model formulas
+################################################################################
+"""Rewriting of the formulas of a model before compilation: constant
+   subexpressions are folded, and the subexpressions shared by several formulas
+   are hoisted into temporaries computed once per evaluation. Both rewritings
+   keep the results bit for bit; the reassociation of constant coefficients,
+   which does not, is only applied on request."""
+
+# packages
+import ast
+from collections import Counter
+from copy import deepcopy
+from numbers import Number
+
+# Prefix of the temporaries holding the common subexpressions
+TEMPORARY_PREFIX = '_cse'
+
+# Nodes worth hoisting into a temporary when they appear more than once
+g_hoistableNodes = (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare, ast.BoolOp,
+    ast.IfExp, ast.Subscript)
+
+class ConstantFolder (ast.NodeTransformer) :
+    """
+    Replaces the subexpressions made only of numbers, of module constants (e.g.
+    cmath.pi) and of module functions (e.g. cmath.sqrt) by their value.
+    """
+    def __init__ (self, namespace) :
+        """
+        Parameters
+        ----------
+        namespace: dict
+          The modules accessible from the formulas, by name
+        """
+        self.namespace = namespace
+
+    def isModuleAttribute (self, node) :
+        return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id in self.namespace
+
+    def fold (self, node) :
+        """
+        Returns
+        -------
+        The constant node holding the value of the expression, or the
+        expression itself if it cannot be evaluated at compile time
+        """
+        expression = ast.fix_missing_locations(ast.Expression(body = node))
+        try :
+            value = eval(compile(expression, '<pyrules-constant>', 'eval'),
+                dict(self.namespace))
+        except Exception :
+            return node
+        if hasattr(value, 'item') :
+            value = value.item() # numpy scalars
+        if not isinstance(value, Number) or isinstance(value, bool) :
+            return node
+        return ast.copy_location(ast.Constant(value = value), node)
+
+    def visit_Attribute (self, node) :
+        if self.isModuleAttribute(node) and \
+          not callable(getattr(self.namespace[node.value.id], node.attr, None)) :
+            return self.fold(node)
+        return node
+
+    def visit_UnaryOp (self, node) :
+        self.generic_visit(node)
+        if isinstance(node.operand, ast.Constant) :
+            # Signed numbers (e.g. of formulas parsed back from their source)
+            value = node.operand.value
+            if isinstance(node.op, ast.USub) and isinstance(value, Number) and \
+              not isinstance(value, bool) :
+                return ast.copy_location(ast.Constant(value = -value), node)
+            return self.fold(node)
+        return node
+
+    def visit_BinOp (self, node) :
+        self.generic_visit(node)
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant) :
+            return self.fold(node)
+        return node
+
+    def visit_Call (self, node) :
+        node.args = [self.visit(x) for x in node.args]
+        if self.isModuleAttribute(node.func) and not node.keywords and \
+          all(isinstance(x, ast.Constant) for x in node.args) :
+            return self.fold(node)
+        return node
+
+# Nodes whose children (other than the ones listed by _unconditionalChildren)
+# may not be evaluated at all
+g_scopeNodes = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp,
+    ast.GeneratorExp)
+
+def _unconditionalChildren (node) :
+    """
+    Returns
+    -------
+    The children of a node that are evaluated whenever the node is: the test
+    of a conditional expression, the first operand of a boolean operation, the
+    first two operands of a (possibly chained) comparison, and all children of
+    the other nodes
+    """
+    if isinstance(node, ast.IfExp) :
+        return [node.test]
+    if isinstance(node, ast.BoolOp) :
+        return node.values[:1]
+    if isinstance(node, ast.Compare) :
+        return [node.left, node.comparators[0]]
+    if isinstance(node, g_scopeNodes) :
+        return []
+    return list(ast.iter_child_nodes(node))
+
+def _unconditionalWalk (tree) :
+    """
+    Yields the nodes of a formula that are evaluated whenever the formula is,
+    i.e. without descending into the branches guarded by a condition
+    """
+    stack = [tree]
+    while stack :
+        node = stack.pop()
+        yield node
+        stack.extend(_unconditionalChildren(node))
+
+def _factors (node, numerator, denominator) :
+    """
+    Splits a product/quotient chain into its numerator and denominator factors
+    """
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult) :
+        _factors(node.left, numerator, denominator)
+        _factors(node.right, numerator, denominator)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div) :
+        _factors(node.left, numerator, denominator)
+        _factors(node.right, denominator, numerator)
+    else :
+        numerator.append(node)
+
+def _product (factors) :
+    result = factors[0]
+    for factor in factors[1:] :
+        result = ast.BinOp(left = result, op = ast.Mult(), right = factor)
+    return result
+
+def _coefficientSplit (node) :
+    """
+    Writes a quotient (x*C)/d as x*(C/d), C being a constant, so that the
+    coefficient C/d can be shared between formulas differing only by x. The
+    floating point rounding differs, so results can change in the last bits.
+
+    Returns
+    -------
+    A (rewritten node, coefficient node) pair, or None if the node is not such
+    a quotient
+    """
+    if not (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div)) :
+        return None
+    numerator, denominator = [], []
+    _factors(node.left, numerator, denominator)
+    if denominator :
+        return None
+    constants = [x for x in numerator if isinstance(x, ast.Constant)]
+    variables = [x for x in numerator if not isinstance(x, ast.Constant)]
+    if not constants or not variables :
+        return None
+    coefficient = ast.BinOp(left = _product(constants), op = ast.Div(),
+        right = node.right)
+    return ast.BinOp(left = _product(variables), op = ast.Mult(),
+        right = coefficient), coefficient
+
+def _reassociate (trees) :
+    """
+    Applies _coefficientSplit to the quotients of all formulas whose coefficient
+    is shared by at least two of them.
+    """
+    splits = []
+    counts = Counter()
+    for tree in trees :
+        for node in ast.walk(tree) :
+            split = _coefficientSplit(node)
+            if split is not None :
+                splits.append((node, split))
+                counts[ast.dump(split[1])] += 1
+
+    replacements = dict((id(node), split[0]) for node, split in splits
+        if counts[ast.dump(split[1])] > 1)
+    if not replacements :
+        return trees
+
+    class Rewriter (ast.NodeTransformer) :
+        def visit (self, node) :
+            node = replacements.get(id(node), node)
+            return self.generic_visit(node)
+    return [Rewriter().visit(tree) for tree in trees]
+
+class SubexpressionHoister (ast.NodeTransformer) :
+    """
+    Replaces the subexpressions appearing several times by temporaries. The
+    temporaries being always computed, the branches guarded by a condition are
+    left untouched.
+    """
+    def __init__ (self, counts, reserved) :
+        """
+        Parameters
+        ----------
+        counts: Counter
+          The number of occurrences of each subexpression (by ast.dump)
+        reserved: set of str
+          Symbols that cannot be used as temporaries
+        """
+        self.counts = counts
+        self.reserved = reserved
+        self.temporaries = {} # ast.dump -> name
+        self.pending = []     # (name, node) to define before the statement
+
+    def visitChildren (self, node) :
+        """
+        Visits the children of a node that are evaluated unconditionally
+        """
+        if isinstance(node, ast.IfExp) :
+            node.test = self.visit(node.test)
+            return node
+        if isinstance(node, ast.BoolOp) :
+            node.values[0] = self.visit(node.values[0])
+            return node
+        if isinstance(node, ast.Compare) :
+            node.left = self.visit(node.left)
+            node.comparators[0] = self.visit(node.comparators[0])
+            return node
+        if isinstance(node, g_scopeNodes) :
+            return node
+        return self.generic_visit(node)
+
+    def visit (self, node) :
+        if not isinstance(node, g_hoistableNodes) :
+            return self.visitChildren(node)
+        key = ast.dump(node)
+        if self.counts[key] < 2 :
+            return self.visitChildren(node)
+        name = self.temporaries.get(key)
+        if name is None :
+            value = self.visitChildren(node)
+            name = '%s%d' % (TEMPORARY_PREFIX, len(self.temporaries))
+            while name in self.reserved :
+                name = '_' + name
+            self.temporaries[key] = name
+            self.pending.append((name, value))
+        return ast.copy_location(ast.Name(id = name, ctx = ast.Load()), node)
+
+def _inlineSingleUses (assignments, temporaries) :
+    """
+    Puts back the temporaries that end up being used only once.
+    """
+    uses = Counter(node.id for _, tree in assignments for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id in temporaries)
+    values = {}
+
+    class Inliner (ast.NodeTransformer) :
+        def visit_Name (self, node) :
+            if node.id in values :
+                return values[node.id]
+            return node
+
+    result = []
+    for target, tree in assignments :
+        tree = Inliner().visit(tree)
+        if target in temporaries and uses[target] < 2 :
+            values[target] = tree
+        else :
+            result.append((target, tree))
+    return result
+
+def optimizeAssignments (assignments, namespace, copy = True,
+    reassociate = False) :
+    """
+    Parameters
+    ----------
+    assignments: list of (str, ast.expr) pairs
+      The symbols to compute and their formula, in evaluation order
+    namespace: dict
+      The modules accessible from the formulas, used for constant folding
+    copy: bool
+      If True, the trees are copied before being rewritten; otherwise they
+      are modified in place (e.g. trees built for this optimization only)
+    reassociate: bool
+      If True, the constant coefficients of quotients are factored out to be
+      shared between formulas (see _coefficientSplit), at the price of results
+      differing in the last bits
+
+    Returns
+    -------
+    The optimized list of (str, ast.expr) pairs, the hoisted subexpressions
+    being assigned to temporaries (prefixed by TEMPORARY_PREFIX) just before
+    their first use.
+    """
+    folder = ConstantFolder(namespace)
+    targets = [target for target, _ in assignments]
+    trees = [folder.visit(deepcopy(tree) if copy else tree)
+        for _, tree in assignments]
+    if reassociate :
+        trees = _reassociate(trees)
+
+    counts = Counter(ast.dump(node) for tree in trees
+        for node in _unconditionalWalk(tree) if isinstance(node, g_hoistableNodes))
+    reserved = set(targets) | set(node.id for tree in trees
+        for node in ast.walk(tree) if isinstance(node, ast.Name))
+    hoister = SubexpressionHoister(counts, reserved)
+
+    result = []
+    for target, tree in zip(targets, trees) :
+        tree = hoister.visit(tree)
+        result.extend(hoister.pending)
+        hoister.pending = []
+        result.append((target, tree))
+    return _inlineSingleUses(result, set(hoister.temporaries.values()))
@@ -0,0 +1,273 @@
+################################################################################
+# Index of the parameters by interaction order
+################################################################################
+"""The interaction orders of the parameters are indexed as they are registered,
+   so that coupling-order queries (e.g. all parameters of QED order <= 2) and
+   model truncations are range lookups instead of scans of the model.
+
+   The internal parameters without declared orders get the leading orders of
+   their formulas: the orders of the factors of a product add up, a power
+   multiplies them by its (constant) exponent, and a sum keeps the smallest
+   order of its terms, so that a truncation never drops a parameter having a
+   term below the requested order."""
+
+# packages
+import ast
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from numbers import Real
+
+def normalizeOrders (interactionOrder) :
+    """
+    Parameters
+    ----------
+    interactionOrder: None, 2-tuple (str, number) or list of 2-tuples
+      The interaction order(s) of a parameter
+
+    Returns
+    -------
+    A dictionary mapping each interaction to its order
+    """
+    if not interactionOrder :
+        return {}
+    if isinstance(interactionOrder, tuple) and len(interactionOrder) == 2 and \
+      not isinstance(interactionOrder[0], (tuple, list)) :
+        interactionOrder = [interactionOrder]
+    orders = {}
+    for interaction, order in interactionOrder :
+        orders[interaction] = max(order, orders.get(interaction, order))
+    return orders
+
+def _addOrders (first, second, sign = 1) :
+    """
+    Returns
+    -------
+    The orders of a product (or of a quotient for sign = -1), the interactions
+    of non-positive order being dropped
+    """
+    orders = dict(first)
+    for interaction, order in second.items() :
+        orders[interaction] = orders.get(interaction, 0) + sign * order
+    return dict((interaction, order) for interaction, order in orders.items()
+        if order > 0)
+
+def _scaleOrders (orders, factor) :
+    """
+    Returns
+    -------
+    The orders of a power of a formula, by a constant exponent
+    """
+    if not isinstance(factor, Real) or isinstance(factor, bool) or factor <= 0 :
+        return {}
+    return dict((interaction, order * factor)
+        for interaction, order in orders.items())
+
+def _minOrders (terms) :
+    """
+    Returns
+    -------
+    The orders of a sum: the smallest order of the terms in each interaction
+    """
+    terms = list(terms)
+    if not terms :
+        return {}
+    orders = dict(terms[0])
+    for term in terms[1:] :
+        orders = dict((interaction, min(order, term[interaction]))
+            for interaction, order in orders.items() if interaction in term)
+    return orders
+
+def _constantValue (tree) :
+    """
+    Returns
+    -------
+    The value of a (possibly signed) number, None for other formulas
+    """
+    if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.USub) :
+        value = _constantValue(tree.operand)
+        return None if value is None else -value
+    if isinstance(tree, ast.Constant) and isinstance(tree.value, Real) :
+        return tree.value
+    return None
+
+# Functions of one argument that keep (or halve) the order of their argument
+g_orderFunctions = {'sqrt': 0.5, 'complexconjugate': 1, 'conjugate': 1,
+    'abs': 1, 'fabs': 1, 'real': 1, 'imag': 1}
+
+def formulaOrders (tree, orders) :
+    """
+    Parameters
+    ----------
+    tree: ast.expr
+      The syntax tree of a formula (a dict for the components of a tensor)
+    orders: dict
+      The orders of the symbols of the formula, indexed by symbol
+
+    Returns
+    -------
+    The leading orders of the formula, as a dictionary mapping each interaction
+    to its order. Functions other than the ones of g_orderFunctions (e.g. exp,
+    log) are given no order.
+    """
+    if isinstance(tree, ast.Name) :
+        return dict(orders.get(tree.id, {}))
+    if isinstance(tree, ast.UnaryOp) :
+        return formulaOrders(tree.operand, orders)
+    if isinstance(tree, ast.BinOp) :
+        left = formulaOrders(tree.left, orders)
+        if isinstance(tree.op, ast.Pow) :
+            return _scaleOrders(left, _constantValue(tree.right))
+        right = formulaOrders(tree.right, orders)
+        if isinstance(tree.op, ast.Mult) :
+            return _addOrders(left, right)
+        if isinstance(tree.op, ast.Div) :
+            return _addOrders(left, right, -1)
+        if isinstance(tree.op, (ast.Add, ast.Sub)) :
+            return _minOrders([left, right])
+        return {}
+    if isinstance(tree, ast.Call) :
+        func = tree.func
+        name = func.attr if isinstance(func, ast.Attribute) else \
+            getattr(func, 'id', None)
+        if name in g_orderFunctions and len(tree.args) == 1 :
+            return _scaleOrders(formulaOrders(tree.args[0], orders),
+                g_orderFunctions[name])
+        if name == 'complex' and tree.args :
+            return _minOrders(formulaOrders(x, orders) for x in tree.args)
+        return {}
+    if isinstance(tree, ast.IfExp) :
+        return _minOrders([formulaOrders(tree.body, orders),
+            formulaOrders(tree.orelse, orders)])
+    if isinstance(tree, (ast.Subscript, ast.Attribute)) :
+        return formulaOrders(tree.value, orders)
+    if isinstance(tree, ast.Dict) :
+        return _minOrders(formulaOrders(x, orders) for x in tree.values)
+    return {}
+
+class InteractionOrderIndex :
+    """
+    Index of parameter symbols by (interaction, order).
+    """
+    def __init__ (self) :
+        self.orders = OrderedDict()   # symbol -> {interaction: order}
+        self.declared = set()         # symbols with explicitly declared orders
+        self.entries = {}             # interaction -> list of (order, symbol)
+        self.unsorted = set()         # interactions whose list must be sorted
+
+    def register (self, symbol, interactionOrder) :
+        """
+        Parameters
+        ----------
+        symbol: str
+          The parameter symbol
+        interactionOrder: None, 2-tuple or list of 2-tuples
+          The interaction order(s) declared for the parameter
+        """
+        orders = normalizeOrders(interactionOrder)
+        if orders :
+            self.declared.add(symbol)
+        self._store(symbol, orders)
+
+    def _store (self, symbol, orders) :
+        previous = self.orders.get(symbol)
+        if previous :
+            for interaction, order in previous.items() :
+                self.entries[interaction].remove((order, symbol))
+        self.orders[symbol] = orders
+        for interaction, order in orders.items() :
+            self.entries.setdefault(interaction, []).append((order, symbol))
+            self.unsorted.add(interaction)
+
+    def discard (self, symbols) :
+        """
+        Removes parameters from the index (e.g. when a model is rolled back).
+        """
+        for symbol in symbols :
+            if symbol in self.orders :
+                self._store(symbol, {})
+                del self.orders[symbol]
+            self.declared.discard(symbol)
+
+    def propagate (self, evaluator) :
+        """
+        Gives to the internal parameters without declared orders the leading
+        orders of their formulas (see formulaOrders).
+
+        Parameters
+        ----------
+        evaluator: ParameterEvaluator
+          The evaluator of the model, giving the formulas of the internal
+          parameters in evaluation order
+        """
+        for symbol in evaluator.internNames :
+            if symbol in self.declared :
+                continue
+            tree = evaluator.formulas[symbol].tree(evaluator.namespace,
+                fold = False)
+            self._store(symbol, formulaOrders(tree, self.orders))
+
+    def _sorted (self, interaction) :
+        entries = self.entries.get(interaction, [])
+        if interaction in self.unsorted :
+            entries.sort()
+            self.unsorted.discard(interaction)
+        return entries
+
+    def query (self, interaction, minOrder = None, maxOrder = None) :
+        """
+        Parameters
+        ----------
+        interaction: str
+          The name of the interaction (e.g. 'QED')
+        minOrder, maxOrder: numbers
+          The (inclusive) bounds on the order, None for no bound
+
+        Returns
+        -------
+        The symbols of the parameters with an order in this interaction lying
+        within the bounds, by increasing order
+        """
+        entries = self._sorted(interaction)
+        start = 0 if minOrder is None else bisect_left(entries, (minOrder,))
+        stop = len(entries) if maxOrder is None else \
+            bisect_right(entries, (maxOrder, chr(0x10ffff)))
+        return [symbol for _, symbol in entries[start:stop]]
+
+    def exceeding (self, maxOrders) :
+        """
+        Parameters
+        ----------
+        maxOrders: dict
+          The largest allowed order of each interaction
+
+        Returns
+        -------
+        The set of the symbols whose order exceeds the limit of at least one
+        interaction, i.e. the parameters dropped when truncating the model
+        """
+        dropped = set()
+        for interaction, maxOrder in maxOrders.items() :
+            entries = self._sorted(interaction)
+            start = bisect_right(entries, (maxOrder, chr(0x10ffff)))
+            dropped.update(symbol for _, symbol in entries[start:])
+        return dropped
+
+def buildOrderIndex (parameters, evaluator = None) :
+    """
+    Parameters
+    ----------
+    parameters: dict
+      The parameters of the model, indexed by their symbol
+    evaluator: ParameterEvaluator
+      If given, the orders are propagated through the formulas of the model
+
+    Returns
+    -------
+    The InteractionOrderIndex of the model
+    """
+    index = InteractionOrderIndex()
+    for symbol, param in parameters.items() :
+        index.register(symbol, param.interactionOrder)
+    if evaluator is not None :
+        index.propagate(evaluator)
+    return index
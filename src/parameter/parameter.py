@@ -1,42 +1,469 @@
 from abc import ABC
+from array import array
+from collections import OrderedDict
+from numbers import Real
+import threading
 
-g_lesHouchesBlocks = {}
+from src.parameter.completion import CompletionIndex
+from src.parameter.orders import InteractionOrderIndex
+
+class ParameterRegistry :
+    """
+    Columnar storage of the external parameters. The values, block ids and
+    orderBlock codes of all parameters are held in typed arrays, the parameter
+    objects being thin views indexed by their position in the registry.
+    """
+
+    # Codes stored for parameters without orderBlock, and for parameters of
+    # multi-index blocks (whose tuple of indices is kept aside)
+    noOrderBlock = -1
+    multiIndexOrderBlock = -2
+
+    def __init__ (self) :
+        self.values = array('d')      # real values (nan if stored as object)
+        self.blockIds = array('l')    # index of the block in self.blocks
+        self.orderBlocks = array('l') # position within the block
+        self.objectValues = {}        # non-real values, by parameter index
+        self.multiIndexCodes = {}     # tuples of indices, by parameter index
+        self.blocks = []
+        self.params = []
+        self.lock = threading.RLock()
+        self.shared = False           # values referenced by a snapshot
+
+    def __len__ (self) :
+        return len(self.params)
+
+    def registerBlock (self, block) :
+        """
+        Parameters
+        ----------
+        block: LesHouchesBlock
+          The block to register
+
+        Returns
+        -------
+        The id of the block
+        """
+        with self.lock :
+            self.blocks.append(block)
+            return len(self.blocks) - 1
+
+    def register (self, param, block) :
+        """
+        Parameters
+        ----------
+        param: ExternParam
+          The parameter to store
+        block: LesHouchesBlock
+          The block the parameter belongs to
+
+        Returns
+        -------
+        The index of the parameter in the registry
+        """
+        with self.lock :
+            self.unshare()
+            self.params.append(param)
+            self.values.append(float('nan'))
+            self.blockIds.append(block.blockId)
+            self.orderBlocks.append(self.noOrderBlock)
+            return len(self.params) - 1
+
+    def truncate (self, size) :
+        """
+        Removes the parameters stored from the given index on, e.g. the rows of
+        parameters whose creation failed.
+
+        Parameters
+        ----------
+        size: int
+          The number of parameters kept
+        """
+        with self.lock :
+            self.unshare()
+            for column in (self.values, self.blockIds, self.orderBlocks,
+              self.params) :
+                del column[size:]
+            for codes in (self.objectValues, self.multiIndexCodes) :
+                for index in [x for x in codes if x >= size] :
+                    del codes[index]
+
+    def snapshotValues (self) :
+        """
+        Returns
+        -------
+        The (values, objectValues) pair of the current values. They are shared
+        with the caller until the next modification of the registry, which then
+        works on a copy (copy-on-write).
+        """
+        with self.lock :
+            self.shared = True
+            return self.values, self.objectValues
+
+    def unshare (self) :
+        """
+        Copies the value columns if they are referenced by a snapshot.
+        """
+        if self.shared :
+            self.values = array('d', self.values)
+            self.objectValues = dict(self.objectValues)
+            self.shared = False
+
+    def getValue (self, index) :
+        if index in self.objectValues :
+            return self.objectValues[index]
+        return self.values[index]
+
+    def setValue (self, index, value) :
+        with self.lock :
+            self.unshare()
+            if isinstance(value, Real) :
+                self.values[index] = value
+                self.objectValues.pop(index, None)
+            else :
+                self.values[index] = float('nan')
+                self.objectValues[index] = value
+
+    def getOrderBlock (self, index) :
+        code = self.orderBlocks[index]
+        if code == self.noOrderBlock :
+            return None
+        if code == self.multiIndexOrderBlock :
+            return self.multiIndexCodes[index]
+        return code
+
+    def setOrderBlock (self, index, code) :
+        with self.lock :
+            self.multiIndexCodes.pop(index, None)
+            if code is None :
+                self.orderBlocks[index] = self.noOrderBlock
+            elif isinstance(code, tuple) :
+                self.orderBlocks[index] = self.multiIndexOrderBlock
+                self.multiIndexCodes[index] = code
+            else :
+                self.orderBlocks[index] = code
+
+class Model :
+    """
+    A model owning its Les Houches blocks, the registry of its external
+    parameters and its parameters. Several models can live in the same
+    process; all modifications of a model are serialized by its lock. The
+    names of the blocks and parameters are indexed for the tab completion, and
+    the parameters by interaction order, as they are declared.
+    """
+    def __init__ (self, name = 'model') :
+        """
+        Parameters
+        ----------
+        name: str
+          A name for this model
+        """
+        self.name = name
+        self.registry = ParameterRegistry()
+        self.lock = self.registry.lock
+        self.blocks = {}
+        self.parameters = OrderedDict()
+        self.completion = CompletionIndex()
+        self.orders = InteractionOrderIndex()
+        self._evaluator = None
+        self._ordersPropagated = True
+
+    def block (self, name) :
+        """
+        Returns
+        -------
+        The Les Houches block of the model with the given name, created if needed
+        """
+        with self.lock :
+            block = self.blocks.get(name)
+            if block is None :
+                block = LesHouchesBlock(name, self)
+            return block
+
+    def addParameter (self, symbol, param) :
+        """
+        Parameters
+        ----------
+        symbol: str
+          The symbol of the parameter
+        param: PyRuleParam
+          The parameter, built for this model
+        """
+        with self.lock :
+            if symbol in self.parameters :
+                raise ValueError('The parameter %s is declared twice in the model %s' %
+                    (symbol, self.name))
+            self.parameters[symbol] = param
+            self.completion.add('internal parameters'
+                if isinstance(param, InternParam) else 'external parameters',
+                symbol)
+            self.orders.register(symbol, param.interactionOrder)
+            self._evaluator = None
+            self._ordersPropagated = False
+
+    def checkpoint (self) :
+        """
+        Returns
+        -------
+        A mark of the current content of the model, to which it can be rolled
+        back (see rollback)
+        """
+        with self.lock :
+            return (len(self.registry), len(self.registry.blocks),
+                len(self.parameters))
+
+    def rollback (self, mark) :
+        """
+        Removes the external parameters, the blocks and the parameters added
+        since a checkpoint, e.g. by an import that failed.
+
+        Parameters
+        ----------
+        mark: tuple
+          The value returned by checkpoint
+        """
+        size, blockCount, parameterCount = mark
+        with self.lock :
+            blocks = self.registry.blocks
+            for block in blocks[:blockCount] :
+                codes = [code for code, param in block.externParamsByOrderBlock.items()
+                    if param._index >= size]
+                for code in codes :
+                    del block.externParamsByOrderBlock[code]
+            self.completion.discard('blocks',
+                set(block.name for block in blocks[blockCount:]))
+            for block in blocks[blockCount:] :
+                del self.blocks[block.name]
+            del blocks[blockCount:]
+            self.registry.truncate(size)
+
+            removed = {}
+            while len(self.parameters) > parameterCount :
+                symbol, param = self.parameters.popitem()
+                removed.setdefault('internal parameters'
+                    if isinstance(param, InternParam) else 'external parameters',
+                    set()).add(symbol)
+            for category, symbols in removed.items() :
+                self.completion.discard(category, symbols)
+                self.orders.discard(symbols)
+            self._evaluator = None
+            self._ordersPropagated = False
+
+    @property
+    def evaluator (self) :
+        """
+        The ParameterEvaluator of the model, compiled once and shared by all its
+        snapshots (the compiled function has no state)
+        """
+        with self.lock :
+            if self._evaluator is None :
+                from src.parameter.evaluator import ParameterEvaluator
+                evaluator = ParameterEvaluator(self.parameters)
+                evaluator.function
+                self._evaluator = evaluator
+            return self._evaluator
+
+    @property
+    def orderIndex (self) :
+        """
+        The InteractionOrderIndex of the parameters of the model, the internal
+        parameters without declared orders getting the leading orders of their
+        formulas (propagated once per modification of the model)
+        """
+        with self.lock :
+            if not self._ordersPropagated :
+                self.orders.propagate(self.evaluator)
+                self._ordersPropagated = True
+            return self.orders
+
+    def snapshot (self) :
+        """
+        Returns
+        -------
+        A ModelSnapshot of the current values of the external parameters
+        """
+        return ModelSnapshot(self)
+
+class ModelSnapshot :
+    """
+    Frozen copy of the values of the external parameters of a model, sharing
+    its structure (blocks, parameters, compiled evaluator). Taking a snapshot
+    costs no copy: the value columns are copied by the first write, either to
+    the model or to the snapshot. Each thread can thus evaluate its own
+    parameter points against the same model.
+    """
+    def __init__ (self, model) :
+        """
+        Parameters
+        ----------
+        model: Model
+          The model to take a snapshot of
+        """
+        self.model = model
+        with model.lock :
+            self.parameters = model.parameters
+            self.values, self.objectValues = model.registry.snapshotValues()
+            self.tensorValues = dict((symbol, param.value)
+                for symbol, param in self.parameters.items()
+                if isinstance(param, ExternTensorParam))
+        self.owned = False
+
+    def __getitem__ (self, symbol) :
+        if symbol in self.tensorValues :
+            return self.tensorValues[symbol]
+        index = self.parameters[symbol]._index
+        if index in self.objectValues :
+            return self.objectValues[index]
+        return self.values[index]
+
+    def __setitem__ (self, symbol, value) :
+        param = self.parameters[symbol]
+        if isinstance(param, ExternTensorParam) :
+            self.tensorValues[symbol] = value
+            return
+        if not isinstance(param, ExternParam) :
+            raise KeyError('%s is not an external parameter' % symbol)
+        if not self.owned :
+            self.values = array('d', self.values)
+            self.objectValues = dict(self.objectValues)
+            self.owned = True
+        if isinstance(value, Real) :
+            self.values[param._index] = value
+            self.objectValues.pop(param._index, None)
+        else :
+            self.values[param._index] = float('nan')
+            self.objectValues[param._index] = value
+
+    def externValues (self) :
+        """
+        Returns
+        -------
+        An OrderedDict with the values of all external parameters, by symbol
+        """
+        return OrderedDict((symbol, self[symbol])
+            for symbol, param in self.parameters.items()
+            if isinstance(param, ExternParam))
+
+    def evaluate (self, **values) :
+        """
+        Evaluates the model at the values of the snapshot.
+
+        Parameters
+        ----------
+        values:
+          Values overriding the ones of the snapshot, indexed by symbol
+
+        Returns
+        -------
+        An OrderedDict with the values of all external and internal parameters
+        """
+        inputs = self.externValues()
+        inputs.update(values)
+        return self.model.evaluator.evaluate(**inputs)
+
+# Default model, holding the blocks and parameters created without explicit
+# model (the module-level dictionaries are kept for compatibility)
+g_defaultModel = Model('default')
+g_lesHouchesBlocks = g_defaultModel.blocks
+g_parameterRegistry = g_defaultModel.registry
 
 class LesHouchesBlock :
-    def __init__ (self, name) :
+    def __init__ (self, name, model = None) :
         """
         Parameters
         ----------
         name: str
           A name for this block
+        model: Model
+          The model owning the block, by default g_defaultModel
         """
         self.name = name
-        g_lesHouchesBlocks[name] = self
+        self.model = g_defaultModel if model is None else model
+        with self.model.lock :
+            self.model.blocks[name] = self
+            self.blockId = self.model.registry.registerBlock(self)
+            self.model.completion.add('blocks', name)
         self.externParamsByOrderBlock = {} # dictionary indexes are block nbrs
-        self.orderBlock = 1
+        self.orderBlock = 1 # lowest candidate for a free order block
+        self.nextFreeOrderBlock = {} # used code -> candidate next free code
+
+    def allocateOrderBlock (self) :
+        """
+        Returns
+        -------
+        The lowest unused order block above the previously allocated ones. Runs
+        of used codes are skipped with path compression, so that allocations
+        take amortized constant time.
+        """
+        code = self.orderBlock
+        skipped = []
+        while code in self.externParamsByOrderBlock :
+            skipped.append(code)
+            code = self.nextFreeOrderBlock.get(code, code + 1)
+        for used in skipped :
+            self.nextFreeOrderBlock[used] = code
+        self.orderBlock = code
+        return code
 
     def insertExternParam (self, param) :
         """
         Parameters
         ----------
-        param: InternParam based class instance
-          The internal parameter to insert into this block
+        param: ExternParam based class instance
+          The external parameter to insert into this block
         """
-        if param.orderBlock is not None :
-            if param.orderBlock in self.externParamsByOrderBlock :
-                raise ValueError('Cannot insert duplicate external param %s' % param)
+        with self.model.lock :
+            if param.orderBlock is not None :
+                if param.orderBlock in self.externParamsByOrderBlock :
+                    raise ValueError('Cannot insert duplicate external param %s' % param)
 
-            self.externParamsByOrderBlock[param.orderBlock] = param
-        else :
-            # Find unused order block
-            while self.orderBlock in self.externParamsByOrderBlock :
-                self.orderBlock += 1
-            self.externParamsByOrderBlock[self.orderBlock] = param
+                self.externParamsByOrderBlock[param.orderBlock] = param
+            else :
+                code = self.allocateOrderBlock()
+                self.externParamsByOrderBlock[code] = param
+                param.orderBlock = code
+
+    def bulkInsert (self, params) :
+        """
+        Inserts a batch of external parameters at once. The whole batch is
+        validated before any insertion: parameters with an explicit order block
+        are placed first, the other ones then receive free codes.
+
+        Parameters
+        ----------
+        params: list of ExternParam based class instances
+          The external parameters to insert into this block
+        """
+        with self.model.lock :
+            self._bulkInsert(list(params))
+
+    def _bulkInsert (self, params) :
+        codes = [param.orderBlock for param in params]
+        explicit = [code for code in codes if code is not None]
+
+        unique = set(explicit)
+        if len(unique) != len(explicit) or \
+          not unique.isdisjoint(self.externParamsByOrderBlock) :
+            seen = set()
+            duplicates = set(code for code in explicit
+                if code in seen or seen.add(code))
+            duplicates.update(unique.intersection(self.externParamsByOrderBlock))
+            raise ValueError('Cannot insert duplicate external params in block %s at %s' %
+                (self.name, ', '.join(str(code) for code in sorted(duplicates))))
+
+        self.externParamsByOrderBlock.update((code, param)
+            for code, param in zip(codes, params) if code is not None)
+        for code, param in zip(codes, params) :
+            if code is None :
+                code = self.allocateOrderBlock()
+                self.externParamsByOrderBlock[code] = param
+                param.orderBlock = code
 
 class PyRuleParam (ABC) :
     """
     Abstract base class for external and internal parameter instances.
     """
+    __slots__ = ('interactionOrder',)
 
     def __init__ (self,
         interactionOrder) :
@@ -52,13 +479,18 @@ class PyRuleParam (ABC) :
 
 class ExternParam (PyRuleParam) :
     """
-    External parameter
-l    """
+    External parameter, stored in the columns of the parameter registry of its
+    model.
+    """
+    __slots__ = ('_index', '_registry')
+
     def __init__ (self, 
       value = 1.0, # Real number
       blockName = 'PyRulesBlock',
       interactionOrder = None,
-      orderBlock = None) :
+      orderBlock = None,
+      insert = True,
+      model = None) :
 
       """
       Parameters
@@ -70,23 +502,51 @@ l    """
       interactionOrder: 2-tuple (str, number)
         Specifies the order of the parameter according to a specific interaction. 
         It refers to a pair with the interaction name, followed by the order, or a list of such pairs.
-      orderBlock: positive integer
+      orderBlock: positive integer (or tuple of integers for multi-index blocks)
         Provides information about the position of an external parameter within a given Les Houches block.
+      insert: bool
+        If False, the parameter is not inserted into its block yet, e.g. for a later LesHouchesBlock.bulkInsert.
+      model: Model
+        The model the parameter belongs to, by default g_defaultModel
       """
 
-      self.value = value
-      self.orderBlock = orderBlock
-
-      if blockName in g_lesHouchesBlocks :
-        self.block = g_lesHouchesBlocks[blockName]
-      else :
-        self.block = LesHouchesBlock(blockName)
-        g_lesHouchesBlocks[blockName] = self.block
+      block = (g_defaultModel if model is None else model).block(blockName)
 
-      self.block.insertExternParam(self)
+      self._registry = block.model.registry
+      with block.model.lock :
+        self._index = self._registry.register(self, block)
+        try :
+          self.value = value
+          self.orderBlock = orderBlock
+          if insert :
+            block.insertExternParam(self)
+        except Exception :
+          # A failed creation (e.g. a duplicate code) leaves no orphan row
+          self._registry.truncate(self._index)
+          raise
 
       super(ExternParam, self).__init__(interactionOrder)
 
+    @property
+    def value (self) :
+      return self._registry.getValue(self._index)
+
+    @value.setter
+    def value (self, value) :
+      self._registry.setValue(self._index, value)
+
+    @property
+    def orderBlock (self) :
+      return self._registry.getOrderBlock(self._index)
+
+    @orderBlock.setter
+    def orderBlock (self, code) :
+      self._registry.setOrderBlock(self._index, code)
+
+    @property
+    def block (self) :
+      return self._registry.blocks[self._registry.blockIds[self._index]]
+
     def __unicode__ (self) :
       return '{}[{}]: {}'.format(self.block.name,
         self.orderBlock,
@@ -96,6 +556,8 @@ class InternParam (PyRuleParam) :
     """
     Internal parameters can be either real or complex, and are connected to other parameters via an analytical formula.
     """
+    __slots__ = ('value', 'complexParameter', 'parameterName')
+
     def __init__ (self,
         value,
         complexParameter,
@@ -120,10 +582,23 @@ class InternParam (PyRuleParam) :
         self.parameterName = parameterName
         super(InternParam, self).__init__(interactionOrder)
 
+    @property
+    def formula (self) :
+      """
+      The interned formula of the parameter, sharing its parsed shape and its
+      compiled function with all formulas identical up to symbol renaming
+      """
+      from src.parameter.evaluator import internFormula
+      return internFormula(self.value)
+
 class ExternTensorParam (ExternParam) :
     """
-    Tensorial external parameter.
+    Tensorial external parameter. The tensor values are kept on the object
+    rather than in the registry columns.
     """
+    __slots__ = ('indices', 'complexParameter', 'unitary', 'hermitian',
+        'orthogonal', '_tensorValue')
+
     def __init__ (self,
         indices,
         value,
@@ -132,14 +607,16 @@ class ExternTensorParam (ExternParam) :
         interactionOrder = None, # A 2-tupe (ExternParam, order)
         unitary = False,
         hermitian = False,
-        orthogonal = False) :
+        orthogonal = False,
+        model = None,
+        insert = True) :
 
         """
         Parameters
         ----------
         indices: Array of strings
             An array of index types. E.g ['scalar', 'generation']
-        value: numpy.matrix
+        value: numpy.ndarray (or anything convertible, e.g. numpy.matrix or nested lists)
             The tensor values
         complexParameter: bool
           Defines whether the parameter is a real (False) or complex (True) quantity.
@@ -152,6 +629,10 @@ class ExternTensorParam (ExternParam) :
           True if parameter corresponds to Hermitian matrix
         orthogonal: bool
           True if parameter corresponds to orthogonal matrix
+        model: Model
+          The model the parameter belongs to, by default g_defaultModel
+        insert: bool
+          If False, the parameter is not inserted into its block yet, e.g. for a later LesHouchesBlock.bulkInsert.
         """
 
         self.indices = indices
@@ -162,12 +643,26 @@ class ExternTensorParam (ExternParam) :
 
         super(ExternTensorParam, self).__init__(value, 
           blockName,
-          interactionOrder)
+          interactionOrder,
+          insert = insert,
+          model = model)
+
+    @property
+    def value (self) :
+        return self._tensorValue
 
-class InternTensorParam (ExternParam) :
+    @value.setter
+    def value (self, value) :
+        # Plain ndarray (numpy.matrix forces copies and 2-D semantics)
+        import numpy
+        self._tensorValue = numpy.array(value, dtype = complex if self.complexParameter else float)
+
+class InternTensorParam (InternParam) :
     """
     Tensorial internal parameter.
     """
+    __slots__ = ('indices', 'unitary', 'hermitian', 'orthogonal')
+
     def __init__ (self,
         indices,
         value,
@@ -182,8 +677,8 @@ class InternTensorParam (ExternParam) :
         Parameters
         ----------
         indices: A list of index types. E.g ['scalar', 'generation']
-        value: numpy.matrix
-            The tensor values
+        value: dict
+            The analytical formulas of the tensor components, indexed by tuples of indices
         complexParameter: bool
           Defines whether a parameter is a real (False) or complex (True) quantity.
         interactionOrder: 2-tuple (str, number) or array of 2-tuples
@@ -0,0 +1,466 @@
+################################################################################
+# Parallel parameter scans
+################################################################################
+"""Scans of the model over grids of external parameter values. The points are
+   split into chunks evaluated by a pool of processes, each worker writing its
+   results directly into a shared-memory array, or into the memory-mapped
+   columns of an on-disk ScanStore. Chunks are sub-grids evaluated on open
+   meshes, so that each parameter is computed once per combination of the scan
+   axes it depends on, and only broadcast along the other ones."""
+
+# packages
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from multiprocessing.util import Finalize
+
+import numpy
+
+from src.parameter.tensor import DEFAULT_TOLERANCE, rejectedPoints, tensorShape
+from src.parameter.vectorized import VectorizedEvaluator
+
+# State of a worker process: the evaluator, the scan axes and the view on the
+# shared result buffer (or the store and the offset of the scan in it)
+g_worker = {}
+
+def poolContext () :
+    """
+    Returns
+    -------
+    The multiprocessing context of the worker pools. The workers are started
+    from a fresh process (forkserver, or spawn where it is not available)
+    rather than forked, the scans being run from threads of the server.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods
+        else 'spawn')
+
+def gridShape (axes) :
+    """
+    Parameters
+    ----------
+    axes: OrderedDict
+      The values (1-D arrays) taken by each scanned parameter
+
+    Returns
+    -------
+    The shape of the grid spanned by the axes
+    """
+    return tuple(len(values) for values in axes.values())
+
+def gridPoints (axes, start, stop) :
+    """
+    Parameters
+    ----------
+    axes: OrderedDict
+      The values (1-D arrays) taken by each scanned parameter
+    start, stop: int
+      The range of (flat) grid indices to generate
+
+    Returns
+    -------
+    An OrderedDict with the values of each scanned parameter at these points
+    """
+    indices = numpy.unravel_index(numpy.arange(start, stop), gridShape(axes))
+    return OrderedDict((symbol, values[index])
+        for (symbol, values), index in zip(axes.items(), indices))
+
+def _blockSizes (shape) :
+    """
+    Returns
+    -------
+    The number of grid points spanned by the axes k, k+1, ... for each k (the
+    last entry, for k = len(shape), being 1)
+    """
+    blocks = [1]
+    for n in reversed(shape) :
+        blocks.insert(0, blocks[0] * n)
+    return blocks
+
+def gridChunks (shape, chunkSize) :
+    """
+    Parameters
+    ----------
+    shape: tuple
+      The shape of the grid
+    chunkSize: int
+      The largest number of points of a chunk
+
+    Returns
+    -------
+    The list of the (start, stop) ranges of (flat) grid indices of the chunks.
+    Each chunk is a sub-grid: a range of values of one axis, all the values of
+    the following axes, and fixed values of the preceding ones.
+    """
+    blocks = _blockSizes(shape)
+    npoints = blocks[0]
+    if npoints <= chunkSize :
+        return [(0, npoints)] if npoints else []
+    k = min(k for k in range(1, len(blocks)) if blocks[k] <= chunkSize)
+    block, n = blocks[k], shape[k-1]
+    rows = max(1, chunkSize // block)
+    chunks = []
+    for prefix in range(npoints // (block * n)) :
+        for row in range(0, n, rows) :
+            start = (prefix * n + row) * block
+            chunks.append((start, start + min(rows, n - row) * block))
+    return chunks
+
+def meshPoints (axes, start, stop) :
+    """
+    Parameters
+    ----------
+    axes: OrderedDict
+      The values (1-D arrays) taken by each scanned parameter
+    start, stop: int
+      The range of (flat) grid indices of a chunk (see gridChunks)
+
+    Returns
+    -------
+    An OrderedDict with the values of each scanned parameter over the chunk, as
+    an open mesh: each array only extends along its own axis, the values at
+    the points being obtained by broadcasting. Ranges that are not sub-grids
+    fall back to the flat points of gridPoints.
+    """
+    shape = gridShape(axes)
+    blocks = _blockSizes(shape)
+    ndim = len(shape)
+    values = list(axes.values())
+    if start == 0 and stop == blocks[0] :
+        return OrderedDict((symbol, x.reshape((1,) * j + (-1,) + (1,) * (ndim - j - 1)))
+            for j, (symbol, x) in enumerate(axes.items()))
+
+    for k in range(1, ndim + 1) :
+        block = blocks[k]
+        span = block * shape[k-1]
+        if start % block or stop % block or start // span != (stop - 1) // span :
+            continue
+        prefix = numpy.unravel_index(start // span, shape[:k-1]) if k > 1 else ()
+        first, last = (start % span) // block, (stop - 1) % span // block + 1
+        mesh = [numpy.asarray(x[i]) for x, i in zip(values, prefix)]
+        mesh.append(values[k-1][first:last].reshape((-1,) + (1,) * (ndim - k)))
+        mesh.extend(x.reshape((1,) * (j - k + 1) + (-1,) + (1,) * (ndim - j - 1))
+            for j, x in enumerate(values[k:], k))
+        return OrderedDict(zip(axes, mesh))
+    return gridPoints(axes, start, stop)
+
+def axisDependencies (evaluator, axes) :
+    """
+    Parameters
+    ----------
+    evaluator: ParameterEvaluator
+      The evaluator of the model
+    axes: iterable of str
+      The scanned external parameters
+
+    Returns
+    -------
+    An OrderedDict mapping each internal parameter to the frozenset of the scan
+    axes it depends on (directly or not)
+    """
+    axes = set(axes)
+    result = OrderedDict()
+    for symbol in evaluator.internNames :
+        dependencies = set()
+        for dep in evaluator.dependencies[symbol] :
+            if dep in result :
+                dependencies |= result[dep]
+            elif dep in axes :
+                dependencies.add(dep)
+        result[symbol] = frozenset(dependencies)
+    return result
+
+def _realValues (symbol, values, dtype) :
+    """
+    Returns
+    -------
+    The values of a parameter, ready to be written with the given dtype. A real
+    parameter (stored as float64) that turned complex at some points raises a
+    ValueError instead of being silently truncated.
+    """
+    if dtype.kind == 'f' and numpy.iscomplexobj(values) :
+        if numpy.any(values.imag != 0) :
+            raise ValueError('The parameter %s leaves its real domain in the ' %
+                symbol + 'scanned region; declare it complex to scan it')
+        values = values.real
+    return values
+
+def _evaluateChunk (evaluator, layout, axes, buffer, start, stop) :
+    """
+    Evaluates the grid points in [start, stop) and stores the values of the
+    parameters in the corresponding rows of the buffer, each tensor parameter
+    being flattened over consecutive columns.
+    """
+    results = evaluator.evaluate(**meshPoints(axes, start, stop))
+    for symbol, column, size in layout :
+        values = _realValues(symbol, results[symbol], buffer.dtype)
+        if size is None :
+            buffer[start:stop, column] = values.reshape(stop - start)
+        else :
+            buffer[start:stop, column:column+size] = \
+                values.reshape(stop - start, size)
+    return stop - start
+
+def _initWorker (evaluator, layout, axes, name, shape, dtype) :
+    """
+    Attaches a worker process to the shared result buffer.
+    """
+    memory = shared_memory.SharedMemory(name = name)
+    g_worker['memory'] = memory
+    g_worker['evaluator'] = evaluator
+    g_worker['layout'] = layout
+    g_worker['axes'] = axes
+    g_worker['buffer'] = numpy.ndarray(shape, dtype = dtype, buffer = memory.buf)
+    Finalize(None, _closeWorker, exitpriority = 10)
+
+def _closeWorker () :
+    """
+    Detaches a worker process from the shared result buffer, when it exits.
+    """
+    g_worker.pop('buffer', None)
+    memory = g_worker.pop('memory', None)
+    if memory is not None :
+        memory.close()
+
+def _runWorker (start, stop) :
+    return _evaluateChunk(g_worker['evaluator'], g_worker['layout'],
+        g_worker['axes'], g_worker['buffer'], start, stop)
+
+def _storeChunk (evaluator, axes, store, offset, start, stop) :
+    """
+    Evaluates the grid points in [start, stop) and writes the values of the
+    parameters into the (reserved) points offset+start to offset+stop of the
+    store.
+    """
+    results = evaluator.evaluate(**meshPoints(axes, start, stop))
+    for symbol in store.parameters :
+        region = store.region(symbol, offset + start, offset + stop)
+        region[...] = _realValues(symbol, results[symbol],
+            region.dtype).reshape(region.shape)
+        region.flush()
+        del region
+    return stop - start
+
+def _initStoreWorker (evaluator, axes, store, offset) :
+    """
+    Prepares a worker process writing into a store.
+    """
+    g_worker['evaluator'] = evaluator
+    g_worker['axes'] = axes
+    g_worker['store'] = store
+    g_worker['offset'] = offset
+
+def _runStoreWorker (start, stop) :
+    return _storeChunk(g_worker['evaluator'], g_worker['axes'],
+        g_worker['store'], g_worker['offset'], start, stop)
+
+class ParallelScan :
+    """
+    Scan of a model over the grid spanned by lists of values of some of its
+    external parameters.
+    """
+    def __init__ (self, parameters, workers = None, chunkSize = 10000,
+        tolerance = DEFAULT_TOLERANCE) :
+        """
+        Parameters
+        ----------
+        parameters: dict
+          The parameters of the model, indexed by their symbol
+        workers: int
+          The number of worker processes (by default, the number of CPUs)
+        chunkSize: int
+          The number of points evaluated at once by a worker
+        tolerance: float
+          The tolerance on the declared properties of the tensor parameters
+        """
+        self.logger = logging.getLogger('PyRules')
+        self.evaluator = VectorizedEvaluator(parameters)
+        self.workers = workers
+        self.chunkSize = max(1, int(chunkSize))
+        self.tolerance = tolerance
+
+        # Position of each parameter in the results: (symbol, first column,
+        # number of columns or None for scalars)
+        self.layout = []
+        self.tensorShapes = OrderedDict()
+        column = 0
+        for symbol in self.evaluator.externNames + self.evaluator.internNames :
+            if symbol in self.evaluator.tensorNames :
+                shape = tensorShape(self.evaluator.parameters[symbol])
+                self.tensorShapes[symbol] = shape
+                size = int(numpy.prod(shape))
+                self.layout.append((symbol, column, size))
+                column += size
+            else :
+                self.layout.append((symbol, column, None))
+                column += 1
+
+        # Points violating the declared tensor properties in the last scan
+        self.rejected = OrderedDict()
+
+    @property
+    def dtype (self) :
+        """
+        The type of the results: float64 if all the columns hold real
+        parameters, complex128 otherwise
+        """
+        if self.evaluator.realNames.issuperset(symbol for symbol, _, _ in self.layout) :
+            return numpy.dtype(numpy.float64)
+        return numpy.dtype(numpy.complex128)
+
+    @property
+    def storeLayout (self) :
+        """
+        The (shape of a point, dtype) pair of each parameter, indexed by symbol,
+        as expected by a ScanStore. Real parameters are stored as float64, the
+        other ones as complex128.
+        """
+        layout = OrderedDict()
+        for symbol, column, size in self.layout :
+            dtype = numpy.float64 if symbol in self.evaluator.realNames else \
+                numpy.complex128
+            layout[symbol] = (self.tensorShapes.get(symbol, ()), numpy.dtype(dtype))
+        return layout
+
+    @property
+    def columns (self) :
+        """
+        The labels of the columns of the results: the symbol of each scalar
+        parameter, and symbol[i,j] for each tensor component
+        """
+        labels = []
+        for symbol, column, size in self.layout :
+            if size is None :
+                labels.append(symbol)
+            else :
+                labels.extend('%s[%s]' % (symbol, ','.join(str(i) for i in index))
+                    for index in numpy.ndindex(*self.tensorShapes[symbol]))
+        return labels
+
+    def tensorStack (self, results, symbol) :
+        """
+        Parameters
+        ----------
+        results: ndarray or dict
+          The results of a scan (a 2-D array, or the columns of a store)
+        symbol: str
+          A tensor parameter
+
+        Returns
+        -------
+        The (points x i x j) view on the values of the tensor in the results
+        """
+        if isinstance(results, dict) :
+            return results[symbol]
+        for name, column, size in self.layout :
+            if name == symbol :
+                return results[:, column:column+size].reshape(
+                    (results.shape[0],) + self.tensorShapes[symbol])
+        raise KeyError('Unknown tensor parameter %s' % symbol)
+
+    def validate (self, results) :
+        """
+        Checks the declared properties of the tensor parameters at all points,
+        the masks of the violating points being stored in self.rejected.
+
+        Returns
+        -------
+        The mask of the points violating at least one property
+        """
+        stacks = OrderedDict((symbol, self.tensorStack(results, symbol))
+            for symbol in self.tensorShapes)
+        self.rejected = rejectedPoints(self.evaluator.parameters, stacks,
+            self.tolerance)
+        if isinstance(results, dict) :
+            npoints = len(next(iter(results.values())))
+        else :
+            npoints = results.shape[0]
+        mask = numpy.zeros(npoints, dtype = bool)
+        for (symbol, name), rejected in self.rejected.items() :
+            self.logger.info('  --> %d points with a non-%s %s' %
+                (numpy.count_nonzero(rejected), name, symbol))
+            mask |= rejected
+        return mask
+
+    def _runPool (self, initializer, initargs, worker, chunks, npoints) :
+        """
+        Evaluates the chunks in a pool of worker processes, reporting the
+        progress every 10% of the points.
+        """
+        with ProcessPoolExecutor(max_workers = self.workers,
+            mp_context = poolContext(), initializer = initializer,
+            initargs = initargs) as pool :
+            futures = [pool.submit(worker, start, stop) for start, stop in chunks]
+            done = 0
+            reported = 0
+            for future in as_completed(futures) :
+                done += future.result()
+                if 10 * done >= (reported + 1) * npoints :
+                    reported = 10 * done // npoints
+                    self.logger.info('  --> %3d%% (%d/%d points)' %
+                        (100 * done // npoints, done, npoints))
+
+    def run (self, axes, store = None) :
+        """
+        Parameters
+        ----------
+        axes: dict
+          The values taken by each scanned external parameter, indexed by symbol
+        store: ScanStore
+          If given, the results are appended to this store (opened for writing,
+          with the parameters of self.storeLayout) instead of being kept in
+          memory
+
+        Returns
+        -------
+        A (points x parameters) array (of type self.dtype) with the values of the
+        parameters (ordered as in the columns attribute) at each grid point. With
+        a store, an OrderedDict of the read-only memory maps on the values of
+        each parameter at the points of this scan.
+        """
+        axes = OrderedDict((symbol, numpy.atleast_1d(numpy.asarray(values)).ravel())
+            for symbol, values in axes.items())
+        self.evaluator.externValues(axes)
+        npoints = int(numpy.prod(gridShape(axes)))
+        dtype = self.dtype
+        shape = (npoints, len(self.columns))
+        chunks = gridChunks(gridShape(axes), self.chunkSize)
+        self.logger.info('Scanning %d points in %d chunks' % (npoints, len(chunks)))
+        partition = OrderedDict()
+        for symbol, dependencies in axisDependencies(self.evaluator, axes).items() :
+            partition.setdefault(dependencies, []).append(symbol)
+        for dependencies, symbols in partition.items() :
+            self.logger.debug('  --> %d parameters depending on %s' % (len(symbols),
+                ', '.join(x for x in axes if x in dependencies) or 'no scan axis'))
+
+        if store is not None :
+            offset = store.reserve(npoints)
+            if self.workers == 1 or len(chunks) <= 1 :
+                for start, stop in chunks :
+                    _storeChunk(self.evaluator, axes, store, offset, start, stop)
+            else :
+                self._runPool(_initStoreWorker, (self.evaluator, axes, store,
+                    offset), _runStoreWorker, chunks, npoints)
+            store.commit(npoints)
+            return store.load(offset, offset + npoints)
+
+        if self.workers == 1 or len(chunks) <= 1 :
+            results = numpy.empty(shape, dtype = dtype)
+            for start, stop in chunks :
+                _evaluateChunk(self.evaluator, self.layout, axes, results,
+                    start, stop)
+            return results
+
+        memory = shared_memory.SharedMemory(create = True,
+            size = max(1, npoints * shape[1] * dtype.itemsize))
+        try :
+            self._runPool(_initWorker, (self.evaluator, self.layout, axes,
+                memory.name, shape, dtype), _runWorker, chunks, npoints)
+            results = numpy.array(numpy.ndarray(shape, dtype = dtype,
+                buffer = memory.buf))
+        finally :
+            memory.close()
+            memory.unlink()
+        return results
@@ -0,0 +1,348 @@
+################################################################################
+# Les Houches (SLHA) parameter card input/output
+################################################################################
+"""Reading and writing of SLHA parameter cards. A card is represented as an
+   OrderedDict mapping each block name to an OrderedDict of values indexed by
+   their position (orderBlock) in the block. Files made of several concatenated
+   cards are streamed one card at a time, each card being enclosed in <slha>
+   tags when written.
+
+   Tensor parameters are written in the SLHA matrix layout, one line per
+   component indexed by its (1-based) indices, and the imaginary parts of
+   complex values go to the corresponding IM<block> blocks. Entries that are
+   not numbers (e.g. the program name of SPINFO) are kept as strings."""
+
+# packages
+from collections import OrderedDict
+from itertools import product
+
+from src.parameter.parameter import g_defaultModel
+
+def _openStream (stream, mode) :
+    """
+    Returns
+    -------
+    A (file object, owned) pair, owned being True if the file has been opened
+    here from a path and must be closed by the caller.
+    """
+    if isinstance(stream, str) :
+        return open(stream, mode), True
+    return stream, False
+
+def _parseEntry (tokens) :
+    """
+    Returns
+    -------
+    A (code, value) pair for a line of a block, or None if the line does not
+    start with an index. The code is the position of the entry in the block:
+    an integer, or a tuple of integers for multi-index (matrix) blocks. The
+    value is a float, or the rest of the line if it is not a number.
+    """
+    codes = []
+    for token in tokens[:-1] :
+        try :
+            codes.append(int(token))
+        except ValueError :
+            break
+    if not codes :
+        return None
+    code = codes[0] if len(codes) == 1 else tuple(codes)
+    rest = tokens[len(codes):]
+    if len(rest) == 1 :
+        try :
+            return code, float(rest[0])
+        except ValueError :
+            pass
+    return code, ' '.join(rest)
+
+def iterParamCards (stream) :
+    """
+    Reads a stream of concatenated parameter cards, line by line. Cards are
+    separated by <slha> tags; in files without tags, a new card starts when a
+    block (or a decay width) already defined in the current card appears again.
+
+    Parameters
+    ----------
+    stream: str or file object
+      The path to the file, or an open text stream
+
+    Returns
+    -------
+    A generator yielding each card in turn
+    """
+    stream, owned = _openStream(stream, 'r')
+    try :
+        card = OrderedDict()
+        block = None
+        tagged = False
+        for line in stream :
+            tokens = line.split('#', 1)[0].split()
+            if not tokens :
+                continue
+            keyword = tokens[0].upper()
+
+            if keyword == 'BLOCK' :
+                if len(tokens) < 2 :
+                    raise ValueError('Block without a name: %s' % line.strip())
+                if tokens[1] in card and not tagged :
+                    yield card
+                    card = OrderedDict()
+                block = OrderedDict()
+                card[tokens[1]] = block
+            elif keyword == 'DECAY' :
+                if len(tokens) < 3 :
+                    raise ValueError('Invalid decay line: %s' % line.strip())
+                code = int(tokens[1])
+                if code in card.get('DECAY', ()) and not tagged :
+                    yield card
+                    card = OrderedDict()
+                card.setdefault('DECAY', OrderedDict())[code] = float(tokens[2])
+                # The branching ratios that follow are skipped
+                block = None
+            elif keyword.startswith('<') :
+                if keyword.startswith('<SLHA') or keyword.startswith('</SLHA') :
+                    tagged = True
+                    if card :
+                        yield card
+                    card = OrderedDict()
+                block = None
+            elif block is not None :
+                entry = _parseEntry(tokens)
+                if entry is not None :
+                    block[entry[0]] = entry[1]
+        if card :
+            yield card
+    finally :
+        if owned :
+            stream.close()
+
+def readParamCard (stream) :
+    """
+    Parameters
+    ----------
+    stream: str or file object
+      The path to the file, or an open text stream
+
+    Returns
+    -------
+    The first parameter card of the stream (empty if there is none)
+    """
+    for card in iterParamCards(stream) :
+        return card
+    return OrderedDict()
+
+def cardFromBlocks (blocks = None, model = None) :
+    """
+    Parameters
+    ----------
+    blocks: dict of LesHouchesBlock
+      The blocks to export, by default all the blocks of the model
+    model: Model
+      The model whose blocks are exported, by default g_defaultModel
+
+    Returns
+    -------
+    The parameter card holding the current values of the external parameters
+    """
+    if blocks is None :
+        blocks = (g_defaultModel if model is None else model).blocks
+    card = OrderedDict()
+    for name, block in blocks.items() :
+        card[name] = OrderedDict((code, block.externParamsByOrderBlock[code].value)
+            for code in sorted(block.externParamsByOrderBlock))
+    return card
+
+def applyParamCard (card, blocks = None, model = None) :
+    """
+    Assigns the values of a parameter card to the external parameters, the
+    IM<block> blocks giving the imaginary parts of the entries of <block>.
+    Block names are compared case-insensitively.
+
+    Parameters
+    ----------
+    card: dict
+      The parameter card
+    blocks: dict of LesHouchesBlock
+      The blocks to update, by default all the blocks of the model
+    model: Model
+      The model whose blocks are updated, by default g_defaultModel
+
+    Returns
+    -------
+    The list of the (block name, code) pairs of the card that do not match any
+    external parameter
+    """
+    if blocks is None :
+        blocks = (g_defaultModel if model is None else model).blocks
+    blocksByName = dict((name.upper(), block) for name, block in blocks.items())
+    unmatched = []
+    imaginaryParts = []
+    for name, entries in card.items() :
+        key = name.upper()
+        if key not in blocksByName and key.startswith('IM') and \
+          key[2:] in blocksByName :
+            imaginaryParts.append((name, blocksByName[key[2:]], entries))
+            continue
+        block = blocksByName.get(key)
+        for code, value in entries.items() :
+            if not _applyEntry(block, code, value) :
+                unmatched.append((name, code))
+    # The imaginary parts complete the real parts, once they are all set
+    for name, block, entries in imaginaryParts :
+        for code, value in entries.items() :
+            if not _applyEntry(block, code, value, True) :
+                unmatched.append((name, code))
+    return unmatched
+
+def _componentIndex (block, code) :
+    """
+    Returns
+    -------
+    A (tensor parameter, index) pair for the component of the tensor of a block
+    at the given (1-based) indices, or None if there is no such component
+    """
+    codes = code if isinstance(code, tuple) else (code,)
+    index = tuple(x - 1 for x in codes)
+    for param in block.externParamsByOrderBlock.values() :
+        shape = getattr(param.value, 'shape', ())
+        if len(shape) == len(index) and \
+          all(0 <= x < n for x, n in zip(index, shape)) :
+            return param, index
+    return None
+
+def _applyEntry (block, code, value, imaginary = False) :
+    """
+    Assigns a value (or an imaginary part) to the scalar parameter of a block
+    at the given code, or else to the tensor component at these indices.
+
+    Returns
+    -------
+    False if there is no such parameter or component, or if the value is not a
+    number
+    """
+    if block is None or isinstance(value, str) :
+        return False
+    param = block.externParamsByOrderBlock.get(code)
+    if param is not None and not getattr(param.value, 'shape', ()) :
+        if imaginary :
+            value = complex(param.value.real, value) if value else \
+                param.value.real
+        param.value = value
+        return True
+
+    component = _componentIndex(block, code)
+    if component is None :
+        return False
+    param, index = component
+    tensor = param.value
+    if imaginary :
+        if tensor.dtype.kind != 'c' :
+            return not value
+        tensor[index] = complex(tensor[index].real, value)
+    else :
+        tensor[index] = value
+    return True
+
+def _expandBlock (name, entries) :
+    """
+    Returns
+    -------
+    The lists of the (code, value) pairs of the real and imaginary parts of the
+    entries of a block, tensors being expanded into their components
+    """
+    real, imaginary = [], []
+    codes = set()
+    for code, value in entries.items() :
+        shape = getattr(value, 'shape', ())
+        if shape :
+            components = [(index[0] + 1 if len(index) == 1 else
+                tuple(x + 1 for x in index), value[index])
+                for index in product(*[range(n) for n in shape])]
+        else :
+            components = [(code, value)]
+        for code, value in components :
+            if code in codes :
+                raise ValueError('Several entries of the block %s at %s: a tensor must be alone in its block' %
+                    (name, code))
+            codes.add(code)
+            if isinstance(value, str) :
+                real.append((code, value))
+                continue
+            real.append((code, value.real))
+            if value.imag :
+                imaginary.append((code, value.imag))
+    return real, imaginary
+
+def _formatCode (code) :
+    if isinstance(code, tuple) :
+        return ' '.join('%3d' % x for x in code)
+    return '%5d' % code
+
+def _formatEntries (name, entries) :
+    lines = ['BLOCK %s\n' % name]
+    lines.extend('  %s %s\n' % (_formatCode(code), value)
+        if isinstance(value, str) else
+        '  %s %.8e\n' % (_formatCode(code), value) for code, value in entries)
+    return lines
+
+def _formatCard (card) :
+    """
+    Returns
+    -------
+    The list of lines representing a parameter card
+    """
+    lines = []
+    for name, entries in card.items() :
+        if name.upper() == 'DECAY' :
+            lines.extend('DECAY %9d %.8e\n' % (code, value.real)
+                for code, value in entries.items())
+            continue
+        real, imaginary = _expandBlock(name, entries)
+        lines.extend(_formatEntries(name, real))
+        if imaginary :
+            lines.extend(_formatEntries('IM' + name, imaginary))
+    return lines
+
+def writeParamCard (stream, card = None, model = None) :
+    """
+    Parameters
+    ----------
+    stream: str or file object
+      The path to the output file, or an open text stream
+    card: dict
+      The parameter card to write, by default the one built from the current
+      values of the external parameters of the model
+    model: Model
+      The model whose card is written when none is given, by default
+      g_defaultModel
+    """
+    if card is None :
+        card = cardFromBlocks(model = model)
+    stream, owned = _openStream(stream, 'w')
+    try :
+        stream.writelines(_formatCard(card))
+    finally :
+        if owned :
+            stream.close()
+
+def writeParamCards (stream, cards) :
+    """
+    Writes several concatenated parameter cards, each of them being formatted
+    and written as soon as it is produced, enclosed in <slha> tags.
+
+    Parameters
+    ----------
+    stream: str or file object
+      The path to the output file, or an open text stream
+    cards: iterable of dict
+      The parameter cards to write (e.g. a generator)
+    """
+    stream, owned = _openStream(stream, 'w')
+    try :
+        for card in cards :
+            stream.write('<slha>\n')
+            stream.writelines(_formatCard(card))
+            stream.write('</slha>\n')
+    finally :
+        if owned :
+            stream.close()
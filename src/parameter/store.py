@@ -0,0 +1,262 @@
+################################################################################
+# Columnar on-disk storage of scan results
+################################################################################
+"""Scan results are stored in a directory holding one .npy file per parameter
+   (points x tensor indices) and a JSON manifest. The .npy headers have a fixed
+   size, so that the files can grow by appending points without moving the
+   data, and the columns are read back as memory maps without any copy."""
+
+# packages
+import json
+import os
+import shutil
+import struct
+import tempfile
+from collections import OrderedDict
+
+import numpy
+from numpy.lib.format import descr_to_dtype, dtype_to_descr
+
+# Version of the layout of the store directory
+STORE_VERSION = 1
+
+# Name of the manifest describing the columns of a store
+MANIFEST_NAME = 'manifest.json'
+
+# Size of the header of the .npy files (format 1.0), the data being aligned on
+# 64 bytes after it
+HEADER_SIZE = 128
+
+def _header (dtype, shape) :
+    """
+    Returns
+    -------
+    The .npy header (format 1.0) of an array, padded to HEADER_SIZE bytes
+    """
+    description = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % \
+        (dtype_to_descr(dtype), tuple(shape))
+    padding = HEADER_SIZE - 10 - len(description) - 1
+    if padding < 0 :
+        raise ValueError('The shape %s is too long for a .npy header' % (shape,))
+    header = (description + ' ' * padding + '\n').encode('latin1')
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header
+
+class ScanStore :
+    """
+    Directory of columnar scan results, one .npy file per parameter.
+    """
+    def __init__ (self, directory, mode = 'r', parameters = None) :
+        """
+        Parameters
+        ----------
+        directory: str
+          The directory of the store
+        mode: str
+          'r' to read an existing store, 'a' to append points to it (creating
+          it if needed) or 'w' to create it, replacing a previous store in the
+          same directory
+        parameters: OrderedDict
+          For the modes 'a' and 'w', the (shape of a point, dtype) pair of each
+          parameter, indexed by symbol. In the mode 'a', it must match the
+          parameters of an existing store.
+        """
+        if mode not in ('r', 'a', 'w') :
+            raise ValueError('Unknown store mode \'%s\'' % mode)
+        self.directory = os.path.abspath(directory)
+        self.writable = mode != 'r'
+        manifest = os.path.join(self.directory, MANIFEST_NAME)
+
+        if mode == 'w' or (mode == 'a' and not os.path.exists(manifest)) :
+            if parameters is None :
+                raise ValueError('The parameters of a new store must be given')
+            self.parameters = OrderedDict((symbol, (tuple(shape), numpy.dtype(dtype)))
+                for symbol, (shape, dtype) in parameters.items())
+            self.points = 0
+            if os.path.isdir(self.directory) and os.listdir(self.directory) :
+                if not os.path.exists(manifest) :
+                    raise ValueError('The directory %s is not a store and cannot be overwritten' %
+                        self.directory)
+                self.replaceStore()
+                return
+            if not os.path.isdir(self.directory) :
+                os.makedirs(self.directory)
+            self.createColumns()
+            return
+
+        self.readManifest()
+        if parameters is not None and mode == 'a' :
+            expected = OrderedDict((symbol, (tuple(shape), numpy.dtype(dtype)))
+                for symbol, (shape, dtype) in parameters.items())
+            if expected != self.parameters :
+                raise ValueError('The parameters do not match the ones of the store %s' %
+                    self.directory)
+
+    def __len__ (self) :
+        return self.points
+
+    def __contains__ (self, symbol) :
+        return symbol in self.parameters
+
+    def __getitem__ (self, symbol) :
+        return self.column(symbol)
+
+    def path (self, symbol) :
+        """
+        Returns
+        -------
+        The path to the .npy file of a parameter
+        """
+        return os.path.join(self.directory, symbol + '.npy')
+
+    def _columnHeader (self, symbol, points) :
+        shape, dtype = self.parameters[symbol]
+        return _header(dtype, (points,) + shape)
+
+    def createColumns (self) :
+        """
+        Writes the empty columns of all parameters and the manifest.
+        """
+        for symbol in self.parameters :
+            with open(self.path(symbol), 'wb') as stream :
+                stream.write(self._columnHeader(symbol, 0))
+        self.writeManifest()
+
+    def replaceStore (self) :
+        """
+        Creates the store aside, then swaps it with the previous store of the
+        directory, so that none of its column files are left behind.
+        """
+        target = self.directory
+        parent, name = os.path.split(target)
+        temporary = tempfile.mkdtemp(prefix = '.%s-new-' % name, dir = parent)
+        try :
+            shutil.copymode(target, temporary)
+            self.directory = temporary
+            self.createColumns()
+        except Exception :
+            shutil.rmtree(temporary, ignore_errors = True)
+            raise
+        finally :
+            self.directory = target
+        previous = tempfile.mkdtemp(prefix = '.%s-old-' % name, dir = parent)
+        os.rename(target, os.path.join(previous, name))
+        os.rename(temporary, target)
+        shutil.rmtree(previous, ignore_errors = True)
+
+    def readManifest (self) :
+        with open(os.path.join(self.directory, MANIFEST_NAME), 'r') as stream :
+            manifest = json.load(stream)
+        if manifest.get('version') != STORE_VERSION :
+            raise ValueError('Unsupported version of the store %s' % self.directory)
+        self.points = manifest['points']
+        self.parameters = OrderedDict((column['symbol'],
+            (tuple(column['shape']), descr_to_dtype(column['dtype'])))
+            for column in manifest['columns'])
+
+    def writeManifest (self) :
+        manifest = OrderedDict([('version', STORE_VERSION),
+            ('points', self.points),
+            ('columns', [OrderedDict([('symbol', symbol),
+                ('file', os.path.basename(self.path(symbol))),
+                ('shape', list(shape)), ('dtype', dtype_to_descr(dtype))])
+                for symbol, (shape, dtype) in self.parameters.items()])])
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        temporary = path + '.%d' % os.getpid()
+        with open(temporary, 'w') as stream :
+            json.dump(manifest, stream, indent = 2)
+        os.replace(temporary, path)
+
+    def reserve (self, points) :
+        """
+        Extends the files of all parameters by a number of (uninitialized)
+        points, to be filled (possibly by other processes, see region) and then
+        committed. Until then, the new points are not part of the store.
+
+        Returns
+        -------
+        The index of the first reserved point
+        """
+        if not self.writable :
+            raise ValueError('The store %s is read-only' % self.directory)
+        for symbol, (shape, dtype) in self.parameters.items() :
+            size = HEADER_SIZE + (self.points + points) * \
+                int(numpy.prod(shape, dtype = int)) * dtype.itemsize
+            with open(self.path(symbol), 'r+b') as stream :
+                stream.truncate(size)
+        return self.points
+
+    def region (self, symbol, start, stop) :
+        """
+        Parameters
+        ----------
+        symbol: str
+          A parameter
+        start, stop: int
+          The range of (reserved or committed) points
+
+        Returns
+        -------
+        A writable memory map on the values of the parameter at these points
+        """
+        shape, dtype = self.parameters[symbol]
+        offset = HEADER_SIZE + start * int(numpy.prod(shape, dtype = int)) * \
+            dtype.itemsize
+        return numpy.memmap(self.path(symbol), dtype = dtype, mode = 'r+',
+            offset = offset, shape = (stop - start,) + shape)
+
+    def commit (self, points) :
+        """
+        Adds the reserved points to the store, by updating the headers of the
+        .npy files and the manifest.
+        """
+        self.points += points
+        for symbol in self.parameters :
+            with open(self.path(symbol), 'r+b') as stream :
+                stream.write(self._columnHeader(symbol, self.points))
+        self.writeManifest()
+
+    def append (self, values) :
+        """
+        Parameters
+        ----------
+        values: dict
+          The values of all parameters at a set of points, as arrays of shape
+          (points,) + the shape of the parameter, indexed by symbol
+        """
+        values = OrderedDict((symbol, numpy.asarray(values[symbol]))
+            for symbol in self.parameters)
+        points = len(next(iter(values.values()))) if values else 0
+        start = self.reserve(points)
+        for symbol, value in values.items() :
+            shape, dtype = self.parameters[symbol]
+            with open(self.path(symbol), 'r+b') as stream :
+                stream.seek(HEADER_SIZE + start * int(numpy.prod(shape, dtype = int)) *
+                    dtype.itemsize)
+                numpy.ascontiguousarray(numpy.broadcast_to(value, (points,) + shape),
+                    dtype = dtype).tofile(stream)
+        self.commit(points)
+
+    def column (self, symbol, start = 0, stop = None) :
+        """
+        Returns
+        -------
+        A read-only memory map on the values of a parameter at the points of the
+        range [start, stop)
+        """
+        if symbol not in self.parameters :
+            raise KeyError('Unknown parameter %s in the store %s' % (symbol,
+                self.directory))
+        if self.points == 0 :
+            shape, dtype = self.parameters[symbol]
+            return numpy.empty((0,) + shape, dtype = dtype)
+        return numpy.load(self.path(symbol), mmap_mode = 'r')[start:stop]
+
+    def load (self, start = 0, stop = None) :
+        """
+        Returns
+        -------
+        An OrderedDict with the read-only memory maps of all parameters at the
+        points of the range [start, stop), indexed by symbol
+        """
+        return OrderedDict((symbol, self.column(symbol, start, stop))
+            for symbol in self.parameters)
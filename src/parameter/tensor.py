@@ -0,0 +1,132 @@
+################################################################################
+# Batched tensor parameters
+################################################################################
+"""Tensor parameters evaluated over many points are stored as stacked arrays
+   (points x i x j). Their declared properties (unitary, hermitian, orthogonal)
+   are checked for all points at once."""
+
+# packages
+from collections import OrderedDict
+
+import numpy
+
+from src.parameter.parameter import ExternTensorParam, InternTensorParam
+
+# Default tolerance on the deviation from the declared properties
+DEFAULT_TOLERANCE = 1e-8
+
+def tensorShape (param) :
+    """
+    Parameters
+    ----------
+    param: ExternTensorParam or InternTensorParam
+      A tensor parameter
+
+    Returns
+    -------
+    The shape of the tensor, deduced from its value (external parameters) or
+    from the indices of its component formulas (internal parameters)
+    """
+    if isinstance(param.value, dict) :
+        keys = [key if isinstance(key, tuple) else (key,) for key in param.value]
+        return tuple(max(key[i] for key in keys) + 1 for i in range(len(keys[0])))
+    return numpy.shape(param.value)
+
+def stackTensor (components, shape, pointShape = ()) :
+    """
+    Parameters
+    ----------
+    components: dict
+      The values of the tensor components, indexed by their indices. Each value
+      is a scalar or an array broadcastable to pointShape; missing components
+      are zero.
+    shape: tuple
+      The shape of the tensor
+    pointShape: tuple
+      The shape of the set of points
+
+    Returns
+    -------
+    The array of shape pointShape + shape holding the tensor at each point
+    """
+    values = [numpy.asarray(x) for x in components.values()]
+    dtype = numpy.result_type(*values) if values else numpy.float64
+    stack = numpy.zeros(tuple(pointShape) + tuple(shape), dtype = dtype)
+    for key, value in zip(components, values) :
+        key = key if isinstance(key, tuple) else (key,)
+        stack[(Ellipsis,) + key] = value
+    return stack
+
+def _deviation (stack, reference) :
+    """
+    Returns
+    -------
+    The largest absolute deviation of each matrix of the stack from the
+    reference (over the two last axes)
+    """
+    return numpy.abs(stack - reference).max(axis = (-2, -1))
+
+def checkTensorProperties (stack, unitary = False, hermitian = False,
+    orthogonal = False, tolerance = DEFAULT_TOLERANCE) :
+    """
+    Checks the properties of a stack of square matrices in one batched pass.
+
+    Parameters
+    ----------
+    stack: ndarray
+      The matrices, of shape (points..., n, n)
+    unitary, hermitian, orthogonal: bool
+      The properties to check
+    tolerance: float
+      The largest accepted absolute deviation
+
+    Returns
+    -------
+    An OrderedDict mapping each checked property to the boolean mask of the
+    points where it is violated
+    """
+    stack = numpy.asarray(stack)
+    masks = OrderedDict()
+    if not (unitary or hermitian or orthogonal) :
+        return masks
+    if stack.ndim < 2 or stack.shape[-1] != stack.shape[-2] :
+        raise ValueError('Tensor properties require square matrices, got shape %s' %
+            (stack.shape,))
+    identity = numpy.eye(stack.shape[-1])
+    if unitary :
+        product = numpy.einsum('...ij,...kj->...ik', stack, stack.conj())
+        masks['unitary'] = _deviation(product, identity) > tolerance
+    if hermitian :
+        masks['hermitian'] = _deviation(stack,
+            numpy.swapaxes(stack, -1, -2).conj()) > tolerance
+    if orthogonal :
+        product = numpy.einsum('...ij,...kj->...ik', stack, stack)
+        masks['orthogonal'] = _deviation(product, identity) > tolerance
+    return masks
+
+def rejectedPoints (parameters, values, tolerance = DEFAULT_TOLERANCE) :
+    """
+    Parameters
+    ----------
+    parameters: dict
+      The parameters of the model, indexed by their symbol
+    values: dict
+      The stacked values of the tensor parameters, indexed by their symbol
+    tolerance: float
+      The largest accepted absolute deviation
+
+    Returns
+    -------
+    An OrderedDict mapping each (symbol, property) pair to the mask of the
+    points where the declared property of the tensor is violated
+    """
+    rejected = OrderedDict()
+    for symbol, param in parameters.items() :
+        if not isinstance(param, (ExternTensorParam, InternTensorParam)) or \
+          symbol not in values :
+            continue
+        masks = checkTensorProperties(values[symbol], param.unitary,
+            param.hermitian, param.orthogonal, tolerance)
+        for name, mask in masks.items() :
+            rejected[(symbol, name)] = mask
+    return rejected
@@ -0,0 +1,217 @@
+################################################################################
+# Vectorized evaluation of the model parameters
+################################################################################
+"""Evaluation of the whole model over arrays of external parameter values. The
+   formulas are compiled once more with the math and cmath modules replaced by
+   their numpy counterparts, so that a full scan is a single call."""
+
+# packages
+import cmath
+import math
+from collections import OrderedDict
+
+import numpy
+
+from src.parameter.evaluator import ParameterEvaluator
+from src.parameter.tensor import stackTensor, tensorShape
+
+class NumpyMath :
+    """
+    Namespace standing for the math or cmath module in vectorized formulas.
+    """
+    def __init__ (self, module, functions) :
+        """
+        Parameters
+        ----------
+        module: module
+          The module (math or cmath) being replaced; its constants are kept
+        functions: dict
+          The numpy functions replacing the ones of the module, by name
+        """
+        self.__name__ = module.__name__
+        for name in ['pi', 'e', 'tau', 'inf', 'nan'] :
+            if hasattr(module, name) :
+                setattr(self, name, getattr(module, name))
+        for name, function in functions.items() :
+            setattr(self, name, function)
+
+    def __getattr__ (self, name) :
+        raise AttributeError('The function %s.%s has no vectorized counterpart' %
+            (self.__name__, name))
+
+# Functions common to both modules
+g_numpyFunctions = {
+    'exp': numpy.exp, 'sin': numpy.sin, 'cos': numpy.cos, 'tan': numpy.tan,
+    'atan': numpy.arctan, 'sinh': numpy.sinh, 'cosh': numpy.cosh,
+    'tanh': numpy.tanh, 'asinh': numpy.arcsinh, 'isnan': numpy.isnan,
+    'isinf': numpy.isinf, 'isfinite': numpy.isfinite }
+
+# Real functions: the result is nan outside of the real domain (see
+# VectorizedEvaluator.callModel)
+g_numpyMath = dict(g_numpyFunctions, **{
+    'sqrt': numpy.sqrt, 'log': numpy.log, 'log10': numpy.log10,
+    'asin': numpy.arcsin, 'acos': numpy.arccos, 'acosh': numpy.arccosh,
+    'atanh': numpy.arctanh, 'atan2': numpy.arctan2, 'fabs': numpy.fabs,
+    'pow': numpy.power, 'hypot': numpy.hypot, 'floor': numpy.floor,
+    'ceil': numpy.ceil, 'copysign': numpy.copysign, 'degrees': numpy.degrees,
+    'radians': numpy.radians })
+
+def _arccosh (x) :
+    """
+    Counterpart of numpy.emath functions for arccosh: the result is complex
+    (instead of nan) if some values are below 1
+    """
+    x = numpy.asarray(x)
+    if x.dtype.kind != 'c' and (x < 1).any() :
+        x = x.astype(complex)
+    return numpy.arccosh(x)
+
+# Complex functions: the result turns complex outside of the real domain
+g_numpyCmath = dict(g_numpyFunctions, **{
+    'sqrt': numpy.emath.sqrt, 'log': numpy.emath.log,
+    'log10': numpy.emath.log10, 'asin': numpy.emath.arcsin,
+    'acos': numpy.emath.arccos, 'acosh': _arccosh,
+    'atanh': numpy.emath.arctanh, 'phase': numpy.angle })
+
+def broadcastShape (shapes) :
+    """
+    Parameters
+    ----------
+    shapes: list of tuples
+      The shapes of arrays to combine
+
+    Returns
+    -------
+    The shape resulting from the broadcasting of all the shapes
+    """
+    ndim = max([len(shape) for shape in shapes] + [0])
+    result = [1] * ndim
+    for shape in shapes :
+        for i, n in enumerate(shape, ndim - len(shape)) :
+            if n == 1 :
+                continue
+            if result[i] not in (1, n) :
+                raise ValueError('Incompatible array shapes %s' %
+                    ', '.join(str(x) for x in shapes))
+            result[i] = n
+    return tuple(result)
+
+class VectorizedEvaluator (ParameterEvaluator) :
+    """
+    Evaluator of all the internal parameters of a model over arrays of values of
+    the external parameters.
+    """
+
+    namespace = {'cmath': NumpyMath(cmath, g_numpyCmath),
+                 'math': NumpyMath(math, g_numpyMath)}
+
+    def evaluate (self, **values) :
+        """
+        Evaluates the whole model in one vectorized pass.
+
+        Parameters
+        ----------
+        values:
+          Arrays (or scalars) overriding the values of the external parameters,
+          indexed by symbol. They must have broadcastable shapes.
+
+        Returns
+        -------
+        An OrderedDict with the values of all external and internal parameters,
+        as read-only arrays of the broadcast shape of the inputs. Tensor
+        parameters are stacked, their indices being the last axes.
+        """
+        inputs = [numpy.asarray(x) for x in self.externValues(values)]
+        shape = broadcastShape([x.shape for symbol, x in zip(self.externNames, inputs)
+            if symbol not in self.tensorNames])
+        outputs = self.callModel(inputs)
+
+        results = OrderedDict()
+        for symbol, value in zip(self.externNames, inputs) :
+            if symbol in self.tensorNames :
+                results[symbol] = numpy.broadcast_to(value, shape + value.shape)
+            else :
+                results[symbol] = numpy.broadcast_to(value, shape)
+        for symbol, value in zip(self.internNames, outputs) :
+            if isinstance(value, dict) :
+                results[symbol] = stackTensor(value,
+                    tensorShape(self.parameters[symbol]), shape)
+            else :
+                results[symbol] = numpy.broadcast_to(value, shape)
+        return results
+
+    def callModel (self, inputs) :
+        """
+        Parameters
+        ----------
+        inputs: list
+          The values (arrays) of all external parameters
+
+        Returns
+        -------
+        The tuple of the values of all internal parameters. Outside of their
+        real domain, the numpy functions of real parameters give nan instead of
+        raising an error: the points where a real parameter is nan (while the
+        external parameters are not) are then evaluated again with complex
+        arithmetic, as for a single point.
+        """
+        try :
+            with numpy.errstate(invalid = 'ignore') :
+                outputs = self.function(*inputs)
+        except (ValueError, TypeError) :
+            return self.complexFunction(*inputs)
+
+        scalars = [x for symbol, x in zip(self.externNames, inputs)
+            if symbol not in self.tensorNames]
+        shape = broadcastShape([numpy.shape(getattr(x, 'value', x))
+            for x in scalars])
+        failed = numpy.zeros(shape, dtype = bool)
+        for symbol, output in zip(self.internNames, outputs) :
+            if symbol in self.realNames :
+                failed |= numpy.isnan(getattr(output, 'value', output))
+        if not failed.any() :
+            return outputs
+        for x in scalars :
+            failed &= ~numpy.isnan(getattr(x, 'value', x))
+        if not failed.any() :
+            return outputs
+
+        points = self.complexFunction(*[x if symbol in self.tensorNames else
+            self.takePoints(x, shape, failed)
+            for symbol, x in zip(self.externNames, inputs)])
+        results = []
+        for output, point in zip(outputs, points) :
+            if isinstance(output, dict) :
+                results.append(OrderedDict((key, self.putPoints(value,
+                    point[key], shape, failed)) for key, value in output.items()))
+            else :
+                results.append(self.putPoints(output, point, shape, failed))
+        return tuple(results)
+
+    def takePoints (self, value, shape, mask) :
+        """
+        Returns
+        -------
+        The values at the points selected by a mask, as a flat array
+        """
+        return numpy.broadcast_to(value, shape)[mask]
+
+    def putPoints (self, value, points, shape, mask) :
+        """
+        Returns
+        -------
+        A copy of the values at all points (broadcast to their shape), with the
+        values at the points selected by a mask replaced by the given ones
+        """
+        result = numpy.array(numpy.broadcast_to(value, shape),
+            dtype = numpy.result_type(value, points))
+        result[mask] = points
+        return result
+
+    def hasChanged (self, old, new) :
+        """
+        Returns
+        -------
+        True if the values of a parameter have been modified at any point
+        """
+        return not numpy.array_equal(old, new)
@@ -0,0 +1,11 @@
+################################################################################
+# Test configuration
+################################################################################
+"""The tests import the sources as the src package, from the root of the
+   repository (as bin/pyrules does)."""
+
+# packages
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
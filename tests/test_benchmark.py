@@ -0,0 +1,37 @@
+################################################################################
+# Tests of the benchmarks of the model pipeline
+################################################################################
+
+# packages
+from src.benchmark import runner
+from src.parameter import evaluator
+from src.parameter.evaluator import ParameterEvaluator
+
+def testSetupRunsBeforeEachMeasurement () :
+    events = []
+    timings = runner.timeCall(lambda : events.append('call'), repeat = 3,
+        number = 2, setup = lambda : events.append('setup'))
+    assert events == ['setup', 'call', 'call'] * 3
+    assert timings['best'] <= timings['median']
+    assert (timings['repeat'], timings['number']) == (3, 2)
+
+def testCompileStageStartsFromEmptyCaches (monkeypatch, tmpdir) :
+    compiled = []
+
+    class RecordingEvaluator (ParameterEvaluator) :
+        def __init__ (self, parameters) :
+            self.cachedFormulas = len(evaluator.g_internedFormulas) + \
+                len(evaluator.g_formulaShapes) + len(evaluator.g_compiledModels)
+            ParameterEvaluator.__init__(self, parameters)
+
+        @property
+        def function (self) :
+            if self._function is None :
+                compiled.append(self.cachedFormulas)
+            return ParameterEvaluator.function.fget(self)
+
+    monkeypatch.setattr(runner, 'ParameterEvaluator', RecordingEvaluator)
+    result = runner.benchmarkModel(40, repeat = 2, directory = str(tmpdir))
+    assert compiled == [0, 0]
+    assert result['size'] == result['extern'] + result['intern']
+    assert all(timing['best'] > 0 for timing in result['timings'].values())
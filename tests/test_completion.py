@@ -0,0 +1,59 @@
+################################################################################
+# Tests of the completion index of the model symbols
+################################################################################
+
+# packages
+from src.parameter.completion import CompletionIndex
+from src.parameter.parameter import ExternParam, InternParam, Model
+
+def makeIndex () :
+    index = CompletionIndex()
+    for name in ('MT', 'MZ', 'aS', 'MW', 'MT', 'Mh', 'M') :
+        index.add('external parameters', name)
+    index.add('blocks', 'MASS')
+    return index
+
+def testCompletionsAreSortedAndUnique () :
+    index = makeIndex()
+    assert index.complete('M', 'external parameters') == ['M', 'MT', 'MW',
+        'MZ', 'Mh']
+    assert index.complete('MT', 'external parameters') == ['MT']
+    assert index.complete('m', 'external parameters') == []
+    assert index.complete('', 'external parameters') == ['M', 'MT', 'MW',
+        'MZ', 'Mh', 'aS']
+    assert index.complete('M', 'unknown') == []
+
+def testNamesAreSortedOnlyWhenCompleted () :
+    index = makeIndex()
+    names = index.sortedNames('external parameters')
+    assert index.sortedNames('external parameters') is names
+    index.add('external parameters', 'MA')
+    assert index.pending['external parameters'] == ['MA']
+    assert index.complete('MA', 'external parameters') == ['MA']
+    assert 'external parameters' not in index.pending
+
+def testDiscardedNames () :
+    index = makeIndex()
+    index.sortedNames('external parameters')
+    index.add('external parameters', 'MA')
+    index.discard('external parameters', set(['MA', 'MT']))
+    assert index.complete('M', 'external parameters') == ['M', 'MW', 'MZ', 'Mh']
+
+def testCategories () :
+    index = makeIndex()
+    assert list(index.categories('MA').items()) == [('blocks', ['MASS'])]
+    assert list(index.categories('M')) == ['external parameters', 'blocks']
+    assert index.categories('x') == {}
+
+def testModelsIndexTheirSymbols () :
+    model = Model()
+    model.addParameter('MT', ExternParam(172., 'MASS', model = model))
+    mark = model.checkpoint()
+    model.addParameter('MX', ExternParam(500., 'MASSX', model = model))
+    model.addParameter('MTX', InternParam('MT*MX', False))
+    assert model.completion.categories('M') == {
+        'blocks': ['MASS', 'MASSX'], 'external parameters': ['MT', 'MX'],
+        'internal parameters': ['MTX']}
+    model.rollback(mark)
+    assert model.completion.categories('M') == {'blocks': ['MASS'],
+        'external parameters': ['MT']}
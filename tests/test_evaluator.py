@@ -0,0 +1,101 @@
+################################################################################
+# Tests of the compiled evaluation of the models
+################################################################################
+
+# packages
+import pickle
+
+import numpy
+import pytest
+
+from src.parameter import evaluator
+from src.parameter.evaluator import DependencyError, ParameterEvaluator, \
+    isRealFormula, parseFormula
+from src.parameter.parameter import ExternParam, InternParam, Model
+from src.parameter.vectorized import VectorizedEvaluator
+
+def makeParameters () :
+    model = Model()
+    return {'a': ExternParam(4., model = model),
+        'b': ExternParam(2., model = model),
+        'c': ExternParam(1., model = model),
+        'sa': InternParam('cmath.sqrt(a)', False),
+        'ab': InternParam('sa*b + 1', False),
+        'z': InternParam('complex(0, 1)*ab', True),
+        'cc': InternParam('c**2', False)}
+
+def testRealFormulas () :
+    assert isRealFormula(parseFormula('cmath.sqrt(a)*b + cmath.pi'))
+    for formula in ('2j*a', 'complex(a, b)', 'complexconjugate(a)', 'a.imag',
+        'cmath.phase(a)', {(0,): 'a'}) :
+        assert not isRealFormula(parseFormula(formula))
+
+def testEvaluationOrderAndRealParameters () :
+    model = ParameterEvaluator(makeParameters())
+    assert model.internNames.index('sa') < model.internNames.index('ab') < \
+        model.internNames.index('z')
+    assert model.realNames == set(['a', 'b', 'c', 'sa', 'ab', 'cc'])
+    values = model.evaluate()
+    assert (values['ab'], values['z'], values['cc']) == (5., 5j, 1.)
+    assert model.evaluate(a = -4.)['ab'] == 1. + 4j
+
+def testUnknownSymbolsAndCycles () :
+    model = Model()
+    with pytest.raises(DependencyError) :
+        ParameterEvaluator({'x': ExternParam(1., model = model),
+            'y': InternParam('x + w', False)})
+    with pytest.raises(DependencyError) :
+        ParameterEvaluator({'u': InternParam('v + 1', False),
+            'v': InternParam('2*u', False)})
+
+def testUpdatesRecomputeTheDownstreamParameters () :
+    model = ParameterEvaluator(makeParameters())
+    model.refresh()
+    assert model.downstream(['b']) == ['ab', 'z']
+    assert sorted(model.update(b = 3.)) == ['ab', 'b', 'z']
+    assert model.values['ab'] == 7. and model.values['cc'] == 1.
+    assert model.update(b = 3.) == []
+    assert sorted(model.update(a = -1.)) == ['a', 'ab', 'sa', 'z']
+    assert model.values == model.evaluate(a = -1., b = 3.)
+
+def testUpdateFunctionsAreBounded (monkeypatch) :
+    monkeypatch.setattr(evaluator, 'UPDATE_FUNCTIONS_CACHE_SIZE', 2)
+    model = ParameterEvaluator(makeParameters())
+    model.refresh()
+    for values in ({'a': 9.}, {'b': 1.}, {'c': 3.}, {'a': 1., 'c': 2.}) :
+        model.update(**values)
+        assert len(model._updateFunctions) <= 2
+    function = model.updateFunction(frozenset(['a', 'c']))
+    assert model.updateFunction(frozenset(['a', 'c'])) is function
+    assert model.values == model.evaluate(a = 1., b = 1., c = 2.)
+
+def testPickledEvaluatorsAreDetached () :
+    parameters = makeParameters()
+    model = ParameterEvaluator(parameters)
+    model.refresh()
+    copy = pickle.loads(pickle.dumps(model))
+    parameters['b'].value = 10.
+    assert copy.values is None and copy.evaluate()['ab'] == 5.
+    copy.refresh()
+    assert sorted(copy.update(c = 2.)) == ['c', 'cc']
+    assert model.evaluate()['ab'] == 21.
+
+def testUpdateFunctionsTakeOnlyTheirInputs () :
+    model = ParameterEvaluator(makeParameters())
+    function, arguments, results = model.updateFunction(frozenset(['b']))
+    assert (arguments, results) == (['b', 'sa'], ['ab', 'z'])
+    assert function(3., 2.) == (7., 7j)
+
+def testUnchangedValuesAreNotReported () :
+    model = ParameterEvaluator(makeParameters())
+    model.update(c = -1.)
+    assert model.values['cc'] == 1.
+    assert model.update(c = 1.) == ['c']
+
+def testVectorizedUpdates () :
+    model = VectorizedEvaluator(makeParameters())
+    model.refresh(b = numpy.array([1., 2.]))
+    assert model.values['ab'].tolist() == [3., 5.]
+    assert sorted(model.update(b = numpy.array([1., 3.]))) == ['ab', 'b', 'z']
+    assert model.values['ab'].tolist() == [3., 7.]
+    assert model.update(b = numpy.array([1., 3.])) == []
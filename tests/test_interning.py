@@ -0,0 +1,64 @@
+################################################################################
+# Tests of the process-wide interning of the formulas
+################################################################################
+
+# packages
+import ast
+import cmath
+import math
+import pickle
+
+from src.parameter.evaluator import ParameterEvaluator, internFormula
+from src.parameter.parameter import ExternParam, InternParam, Model
+
+g_namespace = {'cmath': cmath, 'math': math}
+
+def testRenamedFormulasShareTheirShape () :
+    first = internFormula('a*cmath.sqrt(b) + 2*a')
+    second = internFormula('x * cmath.sqrt(y)+2*x')
+    assert first.shape is second.shape
+    assert first.symbols == ('a', 'b')
+    assert second.symbols == ('x', 'y')
+    assert internFormula('a*cmath.sqrt(b) + 2*a') is first
+    assert internFormula('a*cmath.sqrt(b) + 2*b').shape is not first.shape
+
+def testTreesAreIndependentCopies () :
+    formula = internFormula('p*q - cmath.pi')
+    tree = formula.tree(g_namespace)
+    assert ast.dump(tree) == ast.dump(formula.tree(g_namespace))
+    assert sorted(node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name)) == ['p', 'q']
+    tree.left.left.id = 'changed'
+    assert 'changed' not in ast.dump(formula.tree(g_namespace))
+    other = internFormula('r*s - cmath.pi').tree(g_namespace)
+    assert sorted(node.id for node in ast.walk(other)
+        if isinstance(node, ast.Name)) == ['r', 's']
+
+def testSharedFunctionEvaluatesEachFormula () :
+    first = internFormula('a/b + 1')
+    second = internFormula('c/d + 1')
+    assert first.evaluate({'a': 1., 'b': 4.}) == 1.25
+    assert second.evaluate({'c': 3., 'd': 2.}) == 2.5
+    assert internFormula('abs(a)').evaluate({'a': -2.}) == 2.
+
+def testRealRewritingAndFolding () :
+    formula = internFormula('cmath.sqrt(4) * x')
+    assert not any(isinstance(node, ast.Call)
+        for node in ast.walk(formula.tree(g_namespace)))
+    real = formula.tree(g_namespace, real = True, fold = False)
+    assert any(isinstance(node, ast.Name) and node.id == 'math'
+        for node in ast.walk(real))
+    assert internFormula('complexconjugate(x)').real is False
+
+def testShapesSurvivePickling () :
+    formula = internFormula('u**2 + v')
+    assert pickle.loads(pickle.dumps(formula.shape)) is formula.shape
+
+def testModelsSharingFormulasEvaluateIndependently () :
+    results = []
+    for value in (2., 3.) :
+        model = Model()
+        parameters = {'m': ExternParam(value, model = model),
+            'm2': InternParam('m**2 + 1', False)}
+        results.append(ParameterEvaluator(parameters).evaluate()['m2'])
+    assert results == [5., 10.]
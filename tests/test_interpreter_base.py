@@ -0,0 +1,146 @@
+################################################################################
+# Tests of the command line lexer and dispatch
+################################################################################
+
+# packages
+import json
+import os
+import pstats
+import time
+
+import pytest
+
+from src.interpreter import interpreter_base
+from src.interpreter.interpreter_base import InterpreterBase, lex_line, \
+    tokenize
+
+class RecordingInterpreter (InterpreterBase) :
+    def __init__ (self) :
+        InterpreterBase.__init__(self)
+        self.calls = []
+
+    def do_record (self, line) :
+        self.calls.append(self.split_arg(line))
+
+    def do_raw (self, line) :
+        self.calls.append(str(line))
+
+@pytest.fixture
+def interpreter () :
+    return RecordingInterpreter()
+
+def testTokenize () :
+    assert tokenize('set MH=100 # comment') == (('set', 'MH', '=', '100'),)
+    assert tokenize('a ; ;b c;') == (('a',), ('b', 'c'))
+    assert tokenize("say 'a # b' x\\ y") == (('say', "'a # b'", 'x y'),)
+    assert tokenize('f(x,y)') == (('f', '(', 'x', ',', 'y', ')'),)
+    assert tokenize('# only a comment') == ()
+
+def testTokenizeManyCommands () :
+    commands = tokenize('; '.join('c%d x=%d' % (i, i) for i in range(50000)))
+    assert len(commands) == 50000
+    assert commands[-1] == ('c49999', 'x', '=', '49999')
+
+def testHandlersReceiveTheirTokens (interpreter) :
+    interpreter.exec_cmd("record MH=100 'a b' c\\ d # comment")
+    assert interpreter.calls == [['MH', '=', '100', "'a b'", 'c d']]
+
+def testTokensDoNotDependOnTheCache (interpreter, monkeypatch) :
+    monkeypatch.setattr(interpreter_base.g_lexed_lines, 'size', 2)
+    interpreter.exec_cmd('; '.join(['record MH=%d' % i for i in range(10)]))
+    assert interpreter.calls == [['MH', '=', str(i)] for i in range(10)]
+    interpreter_base.g_lexed_lines.clear()
+    interpreter.calls = []
+    interpreter.onecmd(lex_line('record MH=1')[0])
+    interpreter_base.g_lexed_lines.clear()
+    interpreter.onecmd(lex_line('record MH=2')[0])
+    assert interpreter.calls == [['MH', '=', '1'], ['MH', '=', '2']]
+
+def testLinesFromOtherSourcesAreSplitOnBlanks (interpreter) :
+    interpreter.onecmd('record a\\ b c')
+    assert interpreter.calls == [['a b', 'c']]
+
+def testUnknownCommand (interpreter, caplog) :
+    interpreter.exec_cmd('nothing here')
+    assert 'nothing' in caplog.text
+
+def testPercentiles () :
+    durations = [float(x) for x in range(1, 101)]
+    assert InterpreterBase.percentile(durations, 0.5) == 50.
+    assert InterpreterBase.percentile(durations, 0.99) == 99.
+    assert InterpreterBase.percentile([3.], 0.99) == 3.
+
+def testCommandsAreTimedWhenProfiling (interpreter) :
+    interpreter.exec_cmd('record a ; raw b')
+    assert interpreter.command_times == {}
+    interpreter.exec_cmd('profile on')
+    interpreter.exec_cmd('record a ; raw b ; record c')
+    interpreter.exec_cmd('profile off')
+    interpreter.exec_cmd('record d')
+    assert sorted(interpreter.command_times) == ['profile', 'raw', 'record']
+    assert len(interpreter.command_times['record']) == 2
+    stats = interpreter.command_stats()
+    assert [x['count'] for x in stats if x['command'] == 'record'] == [2]
+    assert stats == sorted(stats, key = lambda x : x['total'], reverse = True)
+    assert all(x['p50'] <= x['p99'] <= x['total'] for x in stats)
+
+def testTimingsAreExported (interpreter, tmpdir) :
+    interpreter.exec_cmd('profile on cprofile')
+    interpreter.exec_cmd('record a ; record b')
+    path = str(tmpdir.join('timings.json'))
+    interpreter.exec_cmd('stats ' + path)
+    assert [x['command'] for x in json.load(open(path))
+        if x['command'] == 'record'] == ['record']
+    interpreter.exec_cmd('stats ' + str(tmpdir.join('profile.out')))
+    assert pstats.Stats(str(tmpdir.join('profile.out'))).total_calls > 0
+    interpreter.exec_cmd('stats clean')
+    assert list(interpreter.command_times) == ['stats']
+
+def testExistingFilesAreNotOverwritten (interpreter, tmpdir, caplog) :
+    existing = tmpdir.join('timings.json')
+    existing.write('keep')
+    interpreter.exec_cmd('profile on')
+    interpreter.exec_cmd('record a')
+    interpreter.exec_cmd('stats ' + str(existing))
+    assert existing.read() == 'keep' and 'already exists' in caplog.text
+
+@pytest.fixture
+def completionDirectory (tmpdir) :
+    interpreter_base.g_directory_listings.clear()
+    for name in ('model.py', 'models.txt', '.hidden', 'other') :
+        tmpdir.join(name).write('')
+    for name in ('models', 'params', '.cache') :
+        tmpdir.join(name).mkdir()
+    tmpdir.join('models', 'sm.py').write('')
+    past = time.time() - 2 * interpreter_base.PATH_CACHE_DELAY - 10
+    os.utime(str(tmpdir), (past, past))
+    return str(tmpdir)
+
+def testPathCompletion (completionDirectory) :
+    complete = InterpreterBase.path_completion
+    assert complete('mod', completionDirectory) == ['model.py', 'models.txt',
+        'models' + os.path.sep]
+    assert complete('mod', completionDirectory, only_dirs = True) == ['models']
+    assert complete('', completionDirectory, relative = False) == ['model.py',
+        'models.txt', 'other', 'models' + os.path.sep, 'params' + os.path.sep]
+    assert complete('.', completionDirectory) == ['.hidden',
+        '.cache' + os.path.sep, '.' + os.path.sep, '..' + os.path.sep]
+    assert complete(os.path.join('models', 's'), completionDirectory) == \
+        [os.path.join('models', 'sm.py')]
+
+def testDirectoryListingsAreCached (completionDirectory) :
+    listings = interpreter_base.g_directory_listings
+    listing = InterpreterBase.list_directory(completionDirectory)
+    mtime = os.stat(completionDirectory).st_mtime_ns
+    assert len(listings) == 1
+    assert listings.get((completionDirectory, mtime)) == listing
+    cached = InterpreterBase.list_directory(completionDirectory)
+    assert InterpreterBase.list_directory(completionDirectory) is cached
+    # A modified directory gets a new mtime, hence a new listing
+    os.mkdir(os.path.join(completionDirectory, 'new'))
+    assert 'new' in InterpreterBase.list_directory(completionDirectory)[1]
+    # Recently modified directories are not cached
+    assert len(listings) == 1
+    subdirectory = os.path.join(completionDirectory, 'models')
+    assert InterpreterBase.list_directory(subdirectory) == (['sm.py'], [])
+    assert len(listings) == 1
@@ -0,0 +1,61 @@
+################################################################################
+# Tests of the forward-mode derivatives of the model parameters
+################################################################################
+
+# packages
+import numpy
+import pytest
+
+from src.parameter.jacobian import JacobianEvaluator
+from src.parameter.parameter import ExternParam, ExternTensorParam, \
+    InternParam, InternTensorParam, Model
+from src.parameter.vectorized import VectorizedEvaluator
+
+def makeParameters () :
+    model = Model()
+    return {'x': ExternParam(1.5, model = model),
+        'y': ExternParam(0.7, model = model),
+        'm': ExternTensorParam(['g', 'g'], numpy.eye(2), 'MIX', model = model),
+        'f': InternParam('cmath.exp(x)*cmath.sqrt(y) + x**3/y', False),
+        'g': InternParam('math.atan2(y, x) + abs(x - 2*y) + cmath.log(f)', False),
+        'h': InternParam('cmath.cos(g)**2*y**x - math.hypot(x, y)', False),
+        'p': InternParam('cmath.phase((x + 1j*y)*f)', False),
+        't': InternTensorParam(['g', 'g'], {(0, 0): 'x*y*m[0, 0]',
+            (1, 0): 'cmath.sinh(f)', (1, 1): 'y'})}
+
+def finiteDifferences (parameters, symbol, inputs, point, step = 1e-6) :
+    evaluator = VectorizedEvaluator(parameters)
+    columns = []
+    for name in inputs :
+        up, down = dict(point), dict(point)
+        up[name] = point[name] + step
+        down[name] = point[name] - step
+        columns.append((evaluator.evaluate(**up)[symbol] -
+            evaluator.evaluate(**down)[symbol]) / (2 * step))
+    return numpy.stack(columns, -1)
+
+def testJacobianMatchesFiniteDifferences () :
+    parameters = makeParameters()
+    point = {'x': numpy.array([0.5, 1.5, 2.5]), 'y': numpy.array([0.3, 0.7, 0.2])}
+    values, jacobian = JacobianEvaluator(parameters).jacobian(**point)
+    expected = VectorizedEvaluator(parameters).evaluate(**point)
+    for symbol in ('f', 'g', 'h', 'p', 't') :
+        assert numpy.allclose(values[symbol], expected[symbol])
+        assert numpy.allclose(jacobian[symbol], finiteDifferences(parameters,
+            symbol, ['x', 'y'], point), rtol = 1e-5, atol = 1e-6)
+    assert jacobian['t'].shape == (3, 2, 2, 2)
+    assert not jacobian['t'][:, 0, 1].any()
+
+def testJacobianWithRespectToSomeInputs () :
+    parameters = makeParameters()
+    values, jacobian = JacobianEvaluator(parameters).jacobian(['y'],
+        x = numpy.linspace(1., 2., 4).reshape(4, 1), y = numpy.array([0.2, 0.4]))
+    assert jacobian['f'].shape == (4, 2, 1)
+    assert values['t'].shape == (4, 2, 2, 2)
+    assert numpy.allclose(jacobian['t'][..., 1, 1, 0], 1.)
+
+def testInvalidInputs () :
+    evaluator = JacobianEvaluator(makeParameters())
+    for inputs in (['m'], ['f'], ['unknown']) :
+        with pytest.raises(KeyError) :
+            evaluator.jacobian(inputs)
@@ -0,0 +1,58 @@
+################################################################################
+# Tests of the command line launcher
+################################################################################
+
+# packages
+import os
+import subprocess
+import sys
+
+from src.core.launcher import RunBatch
+from src.interpreter.interpreter import Interpreter
+
+g_pyrulesDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class RecordingInterpreter :
+    def __init__ (self) :
+        self.lines = []
+
+    def exec_cmd (self, line) :
+        self.lines.append(line)
+        return line == 'quit'
+
+def testBatchStopsAtQuit (tmpdir) :
+    script = tmpdir.join('script.txt')
+    script.write('help\r\n\nquit\nhelp\n')
+    interpreter = RecordingInterpreter()
+    RunBatch(interpreter, str(script))
+    assert interpreter.lines == ['help', '', 'quit']
+
+def testBatchModeKeepsNoHistory (tmpdir) :
+    interpreter = Interpreter(str(tmpdir), batch = True)
+    assert interpreter.exec_cmd('quit')
+    interpreter.__del__()
+    assert not tmpdir.join('.PyRulesHistory').exists()
+
+def runPyRules (arguments, script = '') :
+    return subprocess.run([sys.executable, os.path.join(g_pyrulesDir, 'bin',
+        'pyrules')] + arguments, input = script, capture_output = True,
+        universal_newlines = True, timeout = 60)
+
+def testBatchModeFromTheCommandLine (tmpdir) :
+    result = runPyRules(['-f', '-'], 'help\nquit\nfoo\n')
+    assert result.returncode == 0
+    output = result.stdout + result.stderr
+    assert 'W E L C O M E' not in output and 'foo' not in output
+    assert runPyRules(['-f', str(tmpdir.join('missing'))]).returncode == 1
+
+def testBatchModeDoesNotImportReadline (tmpdir) :
+    script = tmpdir.join('script.txt')
+    script.write('help\nquit\n')
+    code = '; '.join(['import sys', 'sys.path.insert(0, %r)' % g_pyrulesDir,
+        'sys.argv = ["pyrules", "-f", %r]' % str(script),
+        'from src.core.launcher import LaunchPyRules',
+        'LaunchPyRules("0", "0", %r)' % g_pyrulesDir,
+        'print("readline" in sys.modules)'])
+    result = subprocess.run([sys.executable, '-c', code], capture_output = True,
+        universal_newlines = True, timeout = 60)
+    assert result.stdout.split()[-1] == 'False'
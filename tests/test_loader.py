@@ -0,0 +1,111 @@
+################################################################################
+# Tests of the cached loader of the model files
+################################################################################
+
+# packages
+import os
+from collections import OrderedDict
+
+import pytest
+
+from src.parameter import loader
+from src.parameter.loader import ModelFileError, buildModel, \
+    loadModelSpecs, parseModelSource
+from src.parameter.parameter import ExternParam, Model
+
+g_modelSource = '''
+from object_library import all_parameters, Parameter
+open('/nonexistent/executed', 'w')
+
+aEWM1 = Parameter(name = 'aEWM1', nature = 'external', type = 'real',
+                  value = 127.9, texname = '\\\\text{aEWM1}',
+                  lhablock = 'SMINPUTS', lhacode = [ 1 ])
+yuk = Parameter(name = 'yuk', nature = 'external', type = 'complex',
+                value = {(0,0): 1.5, (1,1): 2.5j}, indices = [Index('generation'), Index('generation')],
+                lhablock = 'YUKAWA', lhacode = [ 1, 1 ])
+aEW = Parameter(name = 'aEW', nature = 'internal', type = 'real',
+                value = '1/aEWM1', interactionOrder = ('QED', 2))
+'''
+
+@pytest.fixture
+def modelDirectory (tmpdir) :
+    tmpdir.join('parameters.py').write(g_modelSource)
+    loader.g_modelSpecs.clear()
+    return str(tmpdir)
+
+def testModelFilesAreParsedNotExecuted (modelDirectory) :
+    specs = loadModelSpecs(modelDirectory)
+    assert [spec['name'] for spec in specs] == ['aEWM1', 'yuk', 'aEW']
+    assert specs[0]['lhacode'] == [1]
+    assert specs[1]['value'] == OrderedDict([((0, 0), 1.5), ((1, 1), 2.5j)])
+    assert specs[1]['indices'] == ['generation', 'generation']
+
+def testCacheRoundTrip (modelDirectory) :
+    specs = loadModelSpecs(modelDirectory)
+    cachePath = os.path.join(modelDirectory, loader.CACHE_DIRECTORY,
+        'parameters.py.specs')
+    assert os.path.exists(cachePath)
+    loader.g_modelSpecs.clear()
+    cached = loadModelSpecs(modelDirectory)
+    assert cached == specs
+    assert all(type(spec) is OrderedDict for spec in cached)
+    assert type(cached[1]['value']) is OrderedDict
+
+def testCacheIsNeverExecuted (modelDirectory) :
+    loadModelSpecs(modelDirectory)
+    cachePath = os.path.join(modelDirectory, loader.CACHE_DIRECTORY,
+        'parameters.py.specs')
+    marker = os.path.join(modelDirectory, 'executed')
+    with open(cachePath, 'w') as stream :
+        stream.write('__import__("os").mkdir(%r)' % marker)
+    loader.g_modelSpecs.clear()
+    assert [spec['name'] for spec in loadModelSpecs(modelDirectory)] == \
+        ['aEWM1', 'yuk', 'aEW']
+    assert not os.path.exists(marker)
+
+def testInvalidModelFile () :
+    with pytest.raises(ModelFileError) :
+        parseModelSource('Parameter(name = "x", nature = "external")')
+    with pytest.raises(ModelFileError) :
+        parseModelSource('Parameter(name = ')
+
+def testBuildModel (modelDirectory) :
+    model = Model()
+    parameters = buildModel(loadModelSpecs(modelDirectory), model = model)
+    assert list(parameters) == list(model.parameters) == ['aEWM1', 'yuk', 'aEW']
+    assert model.blocks['SMINPUTS'].externParamsByOrderBlock[1].value == 127.9
+    assert model.evaluator.evaluate()['aEW'] == 1 / 127.9
+    assert parameters['yuk'].value.tolist() == [[1.5, 0], [0, 2.5j]]
+
+def contents (model) :
+    return (len(model.registry), len(model.registry.values),
+        sorted(model.blocks), list(model.parameters),
+        dict((name, dict(block.externParamsByOrderBlock))
+            for name, block in model.blocks.items()),
+        model.completion.complete('', 'blocks'),
+        model.completion.complete('', 'external parameters'))
+
+@pytest.mark.parametrize('spec', [
+    OrderedDict(name = 'x', nature = 'external', value = 1., lhablock = 'A',
+        lhacode = [1]),
+    OrderedDict(name = 'z', nature = 'unknown', value = 1.),
+    OrderedDict(name = 'z', nature = 'external', value = 1., lhablock = 'A',
+        lhacode = [5]),
+    OrderedDict(name = 'z', nature = 'external', value = [[1.], [2., 3.]],
+        indices = ['g', 'g'], lhablock = 'NEW', type = 'real'),
+    OrderedDict(name = 'z', nature = 'external', value = {(0,): 1., (1, 1): 2.},
+        indices = ['g', 'g'], lhablock = 'NEW'),
+])
+def testFailedBuildLeavesTheModelUntouched (spec) :
+    model = Model()
+    ExternParam(1., 'A', orderBlock = 5, model = model)
+    model.addParameter('x', model.blocks['A'].externParamsByOrderBlock[5])
+    before = contents(model)
+    specs = [OrderedDict(name = 'y', nature = 'external', value = 2.,
+            lhablock = 'B'),
+        OrderedDict(name = 'w', nature = 'external', value = 3.,
+            lhablock = 'A'),
+        OrderedDict(name = 'v', nature = 'internal', value = 'x + y'), spec]
+    with pytest.raises((ModelFileError, ValueError, TypeError)) :
+        buildModel(specs, model = model)
+    assert contents(model) == before
@@ -0,0 +1,97 @@
+################################################################################
+# Tests of the merging of model specifications
+################################################################################
+
+# packages
+import pytest
+
+from src.parameter import loader
+from src.parameter.loader import loadModels, parseModelSource
+from src.parameter.merge import ModelMergeError, describeConflict, \
+    formulaFingerprint, mergeModelSpecs, specSlot
+from src.parameter.parameter import Model
+
+g_baseSource = '''
+aS = Parameter(name = 'aS', nature = 'external', type = 'real', value = 0.118,
+               lhablock = 'SMINPUTS', lhacode = [ 3 ])
+MT = Parameter(name = 'MT', nature = 'external', type = 'real', value = 172.,
+               lhablock = 'MASS', lhacode = [ 6 ])
+G = Parameter(name = 'G', nature = 'internal', type = 'real',
+              value = '2*cmath.sqrt(aS)*cmath.sqrt(cmath.pi)')
+'''
+
+g_extensionSource = '''
+aS = Parameter(name = 'aS', nature = 'external', type = 'real', value = 0.118,
+               lhablock = 'SMINPUTS', lhacode = [ 3 ])
+MT = Parameter(name = 'MT', nature = 'external', type = 'real', value = 173.,
+               lhablock = 'MASS', lhacode = [ 6 ])
+MX = Parameter(name = 'MX', nature = 'external', type = 'real', value = 500.,
+               lhablock = 'mass', lhacode = [ 6 ])
+GX = Parameter(name = 'GX', nature = 'internal', type = 'real',
+               value = '2 * cmath.sqrt( aS ) * cmath.sqrt(cmath.pi)')
+'''
+
+def makeModels () :
+    return [('base', parseModelSource(g_baseSource)),
+        ('extension', parseModelSource(g_extensionSource))]
+
+def conflictKinds (conflicts) :
+    return sorted((x.kind, x.key) for x in conflicts)
+
+def testFingerprintsIgnoreTheFormatting () :
+    assert formulaFingerprint('a*b + 1') == formulaFingerprint('a * b+1')
+    assert formulaFingerprint('a*b + 1') != formulaFingerprint('a*c + 1')
+    assert formulaFingerprint(1.) != formulaFingerprint('1.')
+    specs = parseModelSource(g_extensionSource)
+    assert [specSlot(spec) for spec in specs] == [('SMINPUTS', 3), ('MASS', 6),
+        ('MASS', 6), None]
+
+def testFirstDefinitionsAreKept () :
+    specs, conflicts = mergeModelSpecs(makeModels(), 'first')
+    assert [spec['name'] for spec in specs] == ['aS', 'MT', 'G', 'MX', 'GX']
+    assert specs[1]['value'] == 172.
+    assert specs[1]['lhacode'] == [6] and 'lhacode' not in specs[3]
+    assert conflictKinds(conflicts) == [('duplicate', 'aS'),
+        ('equivalent', formulaFingerprint(specs[2]['value'])), ('name', 'MT'),
+        ('slot', ('MASS', 6))]
+    slot = [x for x in conflicts if x.kind == 'slot'][0]
+    assert (slot.kept, slot.dropped) == (('base', 'MT'), ('extension', 'MX'))
+
+def testLastModelsOverride () :
+    specs, conflicts = mergeModelSpecs(makeModels(), 'last')
+    assert [spec['name'] for spec in specs] == ['aS', 'MT', 'G', 'MX', 'GX']
+    assert specs[1]['value'] == 173.
+    assert specs[3]['lhacode'] == [6] and 'lhacode' not in specs[1]
+    name = [x for x in conflicts if x.kind == 'name'][0]
+    assert (name.key, name.kept, name.dropped) == ('MT', ('extension', 'MT'),
+        ('base', 'MT'))
+    slot = [x for x in conflicts if x.kind == 'slot'][0]
+    assert (slot.kept, slot.dropped) == (('extension', 'MX'), ('extension', 'MT'))
+
+def testErrorPolicyListsAllTheConflicts () :
+    with pytest.raises(ModelMergeError) as error :
+        mergeModelSpecs(makeModels())
+    assert conflictKinds(error.value.conflicts) == [('name', 'MT'),
+        ('slot', ('MASS', 6))]
+    message = str(error.value)
+    for conflict in error.value.conflicts :
+        assert describeConflict(conflict) in message
+    assert 'block MASS, code 6' in message
+    specs, conflicts = mergeModelSpecs(makeModels()[:1] * 2)
+    assert len(specs) == 3 and {x.kind for x in conflicts} == {'duplicate'}
+    with pytest.raises(ValueError) :
+        mergeModelSpecs(makeModels(), 'merge')
+
+def testMergedModelsAreLoaded (tmpdir) :
+    paths = []
+    for name, source in (('base', g_baseSource), ('extension', g_extensionSource)) :
+        tmpdir.join(name, 'parameters.py').write(source, ensure = True)
+        paths.append(str(tmpdir.join(name)))
+    loader.g_modelSpecs.clear()
+    with pytest.raises(ModelMergeError) :
+        loadModels(paths, model = Model())
+    parameters, conflicts = loadModels(paths, 'first', model = Model())
+    assert list(parameters) == ['aS', 'MT', 'G', 'MX', 'GX']
+    assert parameters['MT'].value == 172.
+    assert (parameters['MT'].orderBlock, parameters['MX'].orderBlock) == (6, 1)
+    assert len(conflicts) == 4
@@ -0,0 +1,77 @@
+################################################################################
+# Tests of the optimization of the compiled formulas
+################################################################################
+
+# packages
+import ast
+import cmath
+import math
+from collections import OrderedDict
+
+import pytest
+
+from src.parameter.evaluator import ParameterEvaluator
+from src.parameter.optimizer import TEMPORARY_PREFIX, optimizeAssignments
+from src.parameter.parameter import ExternParam, InternParam, Model
+
+g_namespace = {'cmath': cmath, 'math': math}
+
+def makeParameters (externs, interns) :
+    model = Model()
+    parameters = OrderedDict((name, ExternParam(value, model = model))
+        for name, value in externs.items())
+    parameters.update((name, InternParam(formula, False))
+        for name, formula in interns.items())
+    return parameters
+
+def evaluateBoth (externs, interns) :
+    results = []
+    for optimize in (False, True) :
+        evaluator = ParameterEvaluator(makeParameters(externs, interns))
+        evaluator.optimize = optimize
+        results.append(evaluator.evaluate())
+    return results
+
+def optimize (formulas, **options) :
+    return optimizeAssignments([(name, ast.parse(formula, mode = 'eval').body)
+        for name, formula in formulas], g_namespace, **options)
+
+def temporaries (assignments) :
+    return [target for target, _ in assignments
+        if target.startswith(TEMPORARY_PREFIX)]
+
+def testSharedSubexpressionIsHoisted () :
+    assignments = optimize([('p', '(a + b) * 2'), ('q', '(a + b) * 3')])
+    assert len(temporaries(assignments)) == 1
+    plain, optimized = evaluateBoth({'a': 1., 'b': 2.},
+        OrderedDict([('p', '(a + b) * 2'), ('q', '(a + b) * 3')]))
+    assert plain == optimized
+
+@pytest.mark.parametrize('formulas', [
+    ['y/x if x != 0 else 0', 'y/x if x != 0 else 1'],
+    ['x != 0 and y/x > 1', 'x != 0 and y/x > 2'],
+    ['0 < x < y/x', '1 < x < y/x'],
+])
+def testGuardedSubexpressionsAreNotHoisted (formulas) :
+    interns = OrderedDict(('p%d' % i, formula)
+        for i, formula in enumerate(formulas))
+    for target, tree in optimize(list(interns.items())) :
+        if target.startswith(TEMPORARY_PREFIX) :
+            assert not any(isinstance(node, ast.Div) for node in ast.walk(tree))
+    plain, optimized = evaluateBoth({'x': 0., 'y': 1.}, interns)
+    assert plain == optimized
+
+def testChainedComparisonHoistsItsFirstOperands () :
+    assignments = optimize([('p', '0 < x*y < z'), ('q', '1 < x*y < z')])
+    assert len(temporaries(assignments)) == 1
+
+def testReassociationOnlyOnRequest () :
+    formulas = [('p', 'x*3/7'), ('q', 'y*3/7')]
+    assert not temporaries(optimize(formulas))
+    assert len(temporaries(optimize(formulas, reassociate = True))) == 1
+
+def testOptimizedModelKeepsResultsBitForBit () :
+    interns = OrderedDict([('p', 'x*3/7 + cmath.sqrt(2)*y'),
+        ('q', 'y*3/7 - cmath.sqrt(2)*y'), ('r', '(p + q)**2 / (p - q)')])
+    plain, optimized = evaluateBoth({'x': 0.1, 'y': 0.3}, interns)
+    assert plain == optimized
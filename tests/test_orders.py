@@ -0,0 +1,56 @@
+################################################################################
+# Tests of the index of the parameters by interaction order
+################################################################################
+
+# packages
+from src.parameter.evaluator import parseFormula
+from src.parameter.orders import formulaOrders
+from src.parameter.parameter import ExternParam, InternParam, Model
+
+g_orders = {'ee': {'QED': 1}, 'gs': {'QCD': 1}, 'aEW': {'QED': 2}}
+
+def orders (formula) :
+    return formulaOrders(parseFormula(formula), g_orders)
+
+def testProductsAddTheirOrders () :
+    assert orders('ee*gs') == {'QED': 1, 'QCD': 1}
+    assert orders('2*ee*ee*gs/cmath.pi') == {'QED': 2, 'QCD': 1}
+    assert orders('ee**2/(4*cmath.pi)') == {'QED': 2}
+    assert orders('cmath.sqrt(4*cmath.pi*aEW)') == {'QED': 1}
+    assert orders('aEW/ee') == {'QED': 1}
+    assert orders('-complexconjugate(ee)**3') == {'QED': 3}
+
+def testSumsKeepTheirLeadingOrder () :
+    assert orders('ee*(ee + aEW*ee)') == {'QED': 2}
+    assert orders('ee + gs') == {}
+    assert orders('ee + 1') == {}
+    assert orders('ee if gs > 0 else aEW') == {'QED': 1}
+    assert orders('cmath.exp(ee)') == {}
+    assert orders('ee**x') == {} and orders('ee**-1') == {}
+
+def makeModel () :
+    model = Model()
+    model.addParameter('aEW', ExternParam(1/128., interactionOrder = ('QED', 2),
+        model = model))
+    model.addParameter('gs', ExternParam(1.2, interactionOrder = ('QCD', 1),
+        model = model))
+    model.addParameter('ee', InternParam('cmath.sqrt(4*cmath.pi*aEW)', False))
+    model.addParameter('g', InternParam('ee**2*gs', False))
+    return model
+
+def testModelIndexFollowsItsParameters () :
+    model = makeModel()
+    index = model.orderIndex
+    assert index.orders['ee'] == {'QED': 1.}
+    assert index.orders['g'] == {'QED': 2., 'QCD': 1}
+    assert index.query('QED', maxOrder = 1) == ['ee']
+    assert index.exceeding({'QED': 1}) == set(['aEW', 'g'])
+
+    mark = model.checkpoint()
+    model.addParameter('h', InternParam('g*ee', False))
+    model.addParameter('k', InternParam('gs', False, interactionOrder = ('QCD', 3)))
+    assert model.orderIndex.orders['h'] == {'QED': 3., 'QCD': 1}
+    assert model.orderIndex.query('QCD', minOrder = 2) == ['k']
+    model.rollback(mark)
+    assert 'h' not in model.orderIndex.orders
+    assert model.orderIndex.query('QCD') == ['g', 'gs']
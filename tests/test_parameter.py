@@ -0,0 +1,172 @@
+################################################################################
+# Tests of the parameter objects and of their columnar storage
+################################################################################
+
+# packages
+import threading
+
+import pytest
+
+from src.parameter.parameter import ExternParam, ExternTensorParam, \
+    InternParam, Model, g_defaultModel
+
+def testValuesAreStoredInTheRegistryColumns () :
+    model = Model()
+    mass = ExternParam(91.1876, 'MASS', orderBlock = 23, model = model)
+    phase = ExternParam(complex(0., 1.), 'PHASE', model = model)
+    registry = model.registry
+    assert registry.values[mass._index] == 91.1876
+    assert phase.value == 1j and phase._index in registry.objectValues
+    phase.value = 0.5
+    assert phase._index not in registry.objectValues
+    assert phase.value == 0.5
+    assert mass.block is model.blocks['MASS'] and mass.orderBlock == 23
+    assert phase.orderBlock == 1
+
+def testParametersHaveNoDictionary () :
+    model = Model()
+    for param in (ExternParam(1., model = model), InternParam('2*x', False),
+        ExternTensorParam(['g'], [1., 2.], 'T', model = model)) :
+        assert not hasattr(param, '__dict__')
+
+def testMultiIndexCodes () :
+    model = Model()
+    param = ExternParam(0.3, 'MIX', orderBlock = (1, 2), model = model)
+    assert param.orderBlock == (1, 2)
+    assert model.blocks['MIX'].externParamsByOrderBlock[(1, 2)] is param
+
+def testFailedCreationLeavesNoOrphanRow () :
+    model = Model()
+    ExternParam(1., 'MASS', orderBlock = 6, model = model)
+    ExternParam(complex(1., 2.), 'MASS', orderBlock = (1, 1), model = model)
+    size = len(model.registry)
+    with pytest.raises(ValueError) :
+        ExternParam(2., 'MASS', orderBlock = 6, model = model)
+    with pytest.raises(ValueError) :
+        ExternParam(2j, 'MASS', orderBlock = (1, 1), model = model)
+    with pytest.raises((TypeError, ValueError)) :
+        ExternTensorParam(['g'], [[1.], [2., 3.]], 'MASS',
+            complexParameter = False, model = model)
+    registry = model.registry
+    assert len(registry) == size
+    assert len(registry.values) == len(registry.blockIds) == \
+        len(registry.orderBlocks) == size
+    assert all(index < size for index in registry.objectValues)
+    assert all(index < size for index in registry.multiIndexCodes)
+    assert ExternParam(3., 'MASS', model = model)._index == size
+
+def testSnapshotsAreIsolated () :
+    model = Model()
+    param = ExternParam(1., model = model)
+    model.addParameter('x', param)
+    snapshot = model.snapshot()
+    param.value = 2.
+    assert snapshot['x'] == 1.
+    snapshot['x'] = 3.
+    assert param.value == 2.
+
+def makeModel (name = 'model') :
+    model = Model(name)
+    model.addParameter('x', ExternParam(2., 'INPUTS', orderBlock = 1,
+        model = model))
+    model.addParameter('y', ExternParam(3., 'INPUTS', orderBlock = 2,
+        model = model))
+    model.addParameter('z', InternParam('x*y + 1', False))
+    return model
+
+def testModelsAreIndependent () :
+    first, second = makeModel('first'), makeModel('second')
+    first.parameters['x'].value = 5.
+    assert second.parameters['x'].value == 2.
+    assert first.blocks['INPUTS'] is not second.blocks['INPUTS']
+    assert 'INPUTS' not in g_defaultModel.blocks
+    with pytest.raises(ValueError) :
+        first.addParameter('x', InternParam('y', False))
+    assert first.evaluator.evaluate()['z'] == 16.
+    assert second.evaluator.evaluate()['z'] == 7.
+    param = ExternParam(1., 'DEFAULTS')
+    assert param.block is g_defaultModel.blocks['DEFAULTS']
+
+def testRollbackRemovesTheLaterDeclarations () :
+    model = makeModel()
+    evaluator = model.evaluator
+    mark = model.checkpoint()
+    model.addParameter('w', ExternParam(4., 'OTHER', model = model))
+    model.addParameter('v', InternParam('w*z', False))
+    assert model.evaluator.evaluate()['v'] == 28.
+    model.rollback(mark)
+    assert list(model.parameters) == ['x', 'y', 'z']
+    assert 'OTHER' not in model.blocks and len(model.registry) == 2
+    assert model.evaluator is not evaluator
+    assert list(model.evaluator.evaluate()) == ['x', 'y', 'z']
+
+def testSnapshotsShareTheValuesUntilWritten () :
+    model = makeModel()
+    snapshot = model.snapshot()
+    assert snapshot.values is model.registry.values
+    assert snapshot.evaluate()['z'] == 7. and snapshot.evaluate(y = 1.)['z'] == 3.
+    model.parameters['y'].value = 10.
+    assert snapshot.values is not model.registry.values
+    assert snapshot['y'] == 3. and snapshot.evaluate()['z'] == 7.
+    other = model.snapshot()
+    other['x'] = 0.5
+    assert model.parameters['x'].value == 2. and other.evaluate()['z'] == 6.
+    with pytest.raises(KeyError) :
+        other['z'] = 1.
+
+def testSnapshotsEvaluatedInThreads () :
+    model = makeModel()
+    results = {}
+    def evaluate (x) :
+        snapshot = model.snapshot()
+        snapshot['x'] = x
+        results[x] = [snapshot.evaluate()['z'] for _ in range(50)]
+    threads = [threading.Thread(target = evaluate, args = (float(x),))
+        for x in range(8)]
+    for thread in threads :
+        thread.start()
+    for thread in threads :
+        thread.join()
+    assert results == dict((float(x), [3. * x + 1.] * 50) for x in range(8))
+    assert model.parameters['x'].value == 2.
+
+def testAutomaticCodesSkipTheUsedOnes () :
+    model = Model()
+    for code in (1, 2, 4) :
+        ExternParam(float(code), 'MASS', orderBlock = code, model = model)
+    automatic = [ExternParam(0., 'MASS', model = model) for _ in range(3)]
+    assert [param.orderBlock for param in automatic] == [3, 5, 6]
+    ExternParam(7., 'MASS', orderBlock = 7, model = model)
+    assert ExternParam(0., 'MASS', model = model).orderBlock == 8
+    assert sorted(model.blocks['MASS'].externParamsByOrderBlock) == list(range(1, 9))
+
+def testBulkInsertPlacesTheExplicitCodesFirst () :
+    model = Model()
+    block = model.block('MIX')
+    params = [ExternParam(0., 'MIX', orderBlock = code, insert = False,
+        model = model) for code in (None, 1, None, 3)]
+    block.bulkInsert(params)
+    assert [param.orderBlock for param in params] == [2, 1, 4, 3]
+    assert all(block.externParamsByOrderBlock[param.orderBlock] is param
+        for param in params)
+
+def testBulkInsertRejectsDuplicatesBeforeInserting () :
+    model = Model()
+    block = model.block('MIX')
+    ExternParam(0., 'MIX', orderBlock = 2, model = model)
+    params = [ExternParam(0., 'MIX', orderBlock = code, insert = False,
+        model = model) for code in (1, None, 2)]
+    with pytest.raises(ValueError) as error :
+        block.bulkInsert(params)
+    assert 'at 2' in str(error.value)
+    assert list(block.externParamsByOrderBlock) == [2]
+    assert params[1].orderBlock is None
+
+def testAllocationsAfterLongRuns () :
+    model = Model()
+    block = model.block('BIG')
+    block.bulkInsert([ExternParam(0., 'BIG', orderBlock = code, insert = False,
+        model = model) for code in range(1, 20001)])
+    codes = [block.allocateOrderBlock() for _ in range(3)]
+    assert codes == [20001] * 3
+    assert block.nextFreeOrderBlock[1] == 20001
@@ -0,0 +1,96 @@
+################################################################################
+# Tests of the parallel parameter scans
+################################################################################
+
+# packages
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy
+
+from src.parameter import scan
+from src.parameter.parameter import ExternParam, InternParam, Model
+from src.parameter.scan import ParallelScan, axisDependencies, gridChunks, \
+    gridPoints, meshPoints
+from src.parameter.vectorized import VectorizedEvaluator
+from src.parameter.store import ScanStore
+
+def makeParameters () :
+    model = Model()
+    return {'a': ExternParam(1., model = model),
+        'b': ExternParam(2., model = model),
+        'c': ExternParam(3., model = model),
+        'ab': InternParam('a*b', False),
+        'bc': InternParam('cmath.sqrt(b) + c', False),
+        'z': InternParam('a + complex(0, 1)*c', True)}
+
+def testChunksAreSubGrids () :
+    axes = {'a': numpy.arange(3.), 'b': numpy.arange(4.), 'c': numpy.arange(5.)}
+    chunks = gridChunks((3, 4, 5), 7)
+    assert chunks[0] == (0, 5) and chunks[-1][1] == 60
+    assert all(start == stop for (_, stop), (start, _) in zip(chunks, chunks[1:]))
+    mesh = meshPoints(axes, 25, 30)
+    assert [x.shape for x in mesh.values()] == [(), (1, 1), (1, 5)]
+    assert float(mesh['a']) == 1. and float(mesh['b'][0, 0]) == 1.
+
+def testAxisDependencies () :
+    parameters = makeParameters()
+    parameters['abc'] = InternParam('ab*bc', False)
+    parameters['k'] = InternParam('2*cmath.pi', False)
+    dependencies = axisDependencies(VectorizedEvaluator(parameters), ['a', 'c'])
+    assert dependencies['ab'] == frozenset(['a'])
+    assert dependencies['bc'] == frozenset(['c'])
+    assert dependencies['abc'] == dependencies['z'] == frozenset(['a', 'c'])
+    assert dependencies['k'] == frozenset()
+
+def testInvariantParametersAreHoisted () :
+    axes = OrderedDict([('a', numpy.arange(1., 4.)), ('b', numpy.arange(1., 5.)),
+        ('c', numpy.arange(1., 6.))])
+    evaluator = VectorizedEvaluator(makeParameters())
+    for start, stop in ((0, 60), (20, 40), (25, 30), (27, 28)) :
+        values = evaluator.evaluate(**meshPoints(axes, start, stop))
+        flat = evaluator.evaluate(**gridPoints(axes, start, stop))
+        for symbol in ('ab', 'bc', 'z') :
+            assert numpy.array_equal(values[symbol].reshape(stop - start),
+                flat[symbol])
+    values = evaluator.evaluate(**meshPoints(axes, 0, 60))
+    assert values['ab'].strides[2] == 0 and values['bc'].strides[0] == 0
+    assert values['z'].strides[1] == 0
+    mesh = meshPoints(axes, 3, 9)
+    assert all(x.shape == (6,) for x in mesh.values())
+
+def testParallelScanMatchesTheSerialOne () :
+    axes = {'a': [1., 2., 3.], 'b': [4., 9.], 'c': [0.5, 1.5]}
+    serial = ParallelScan(makeParameters(), workers = 1, chunkSize = 3)
+    parallel = ParallelScan(makeParameters(), workers = 2, chunkSize = 3)
+    expected = serial.run(axes)
+    assert expected.shape == (12, len(serial.columns))
+    assert numpy.array_equal(parallel.run(axes), expected)
+    assert expected[1, serial.columns.index('bc')] == 3.5
+    assert expected[11, serial.columns.index('z')] == 3. + 1.5j
+    assert expected.dtype.kind == 'c'
+
+def testParallelScanIntoAStore (tmpdir) :
+    scanner = ParallelScan(makeParameters(), workers = 2, chunkSize = 2)
+    store = ScanStore(str(tmpdir), 'w', scanner.storeLayout)
+    columns = scanner.run({'a': [1., 2.], 'b': [1., 4.]}, store)
+    assert columns['ab'].tolist() == [1., 4., 2., 8.]
+    assert columns['bc'].dtype == numpy.float64
+    assert len(ScanStore(str(tmpdir))) == 4
+
+def testWorkersAreNotForked () :
+    assert scan.poolContext().get_start_method() in ('forkserver', 'spawn')
+
+def testWorkersDetachFromTheSharedBuffer () :
+    memory = shared_memory.SharedMemory(create = True, size = 64)
+    try :
+        scan._initWorker(None, [], {}, memory.name, (8,), numpy.dtype(numpy.float64))
+        attached = scan.g_worker['memory']
+        scan.g_worker['buffer'][:] = 1.
+        scan._closeWorker()
+        assert 'memory' not in scan.g_worker and 'buffer' not in scan.g_worker
+        assert attached.buf is None
+        assert numpy.ndarray((8,), buffer = memory.buf).tolist() == [1.] * 8
+    finally :
+        memory.close()
+        memory.unlink()
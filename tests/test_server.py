@@ -0,0 +1,87 @@
+################################################################################
+# Tests of the daemon mode
+################################################################################
+
+# packages
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from src.core.server import PyRulesServer
+
+g_pyrulesDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def server (tmpdir) :
+    server = PyRulesServer(str(tmpdir.join('pyrules.sock')), g_pyrulesDir,
+        max_sessions = 2)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def request (server, command, session = None) :
+    """
+    Returns
+    -------
+    The (messages, done record) pair of the reply to a command
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(server.server_address)
+    message = {'command': command}
+    if session is not None :
+        message['session'] = session
+    connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+    messages = []
+    with connection, connection.makefile('rb') as replies :
+        for raw in replies :
+            record = json.loads(raw.decode('utf-8'))
+            if record.get('done') :
+                return messages, record
+            messages.append(record['message'])
+
+def testShellOutputReachesTheClient (server, capfd) :
+    messages, done = request(server, 'shell echo hello; echo world >&2', 'main')
+    assert 'hello' in messages and 'world' in messages
+    assert not done['stop']
+    assert 'hello' not in capfd.readouterr().out
+
+def testQuitDropsTheSession (server) :
+    request(server, 'help', 'main')
+    assert 'main' in server.sessions
+    messages, done = request(server, 'quit', 'main')
+    assert done['stop'] and 'main' not in server.sessions
+
+def testLeastRecentlyUsedSessionsAreDropped (server) :
+    first = server.named_session('a')
+    server.named_session('b')
+    server.named_session('a')
+    server.named_session('c')
+    assert sorted(server.sessions) == ['a', 'c']
+    assert server.named_session('a') is first
+
+def testIdleSessionsTimeOut (server) :
+    server.session_timeout = 0.
+    server.named_session('a')
+    time.sleep(0.01)
+    server.named_session('b')
+    assert list(server.sessions) == ['b']
+
+def testBusySessionsAreKept (server) :
+    for name in ('a', 'b') :
+        server.named_session(name).lock.acquire()
+    try :
+        with pytest.raises(IOError) :
+            server.named_session('c')
+        messages, done = request(server, 'help', 'c')
+        assert done['stop'] and 'Too many sessions' in messages[0]
+    finally :
+        for name in ('a', 'b') :
+            server.sessions[name].lock.release()
@@ -0,0 +1,94 @@
+################################################################################
+# Tests of the SLHA parameter card input/output
+################################################################################
+
+# packages
+import io
+from collections import OrderedDict
+
+import numpy
+import pytest
+
+from src.parameter.parameter import ExternParam, ExternTensorParam, Model
+from src.parameter.slha import applyParamCard, cardFromBlocks, \
+    iterParamCards, readParamCard, writeParamCard, writeParamCards
+
+def makeModel () :
+    model = Model()
+    ExternParam(91.1876, 'MASS', orderBlock = 23, model = model)
+    ExternParam(complex(0.1, -0.2), 'MIXING', orderBlock = 1, model = model)
+    ExternTensorParam(['generation', 'generation'],
+        [[1., 0.5j], [-0.5j, 2.]], 'YUKAWA', model = model)
+    return model
+
+def writeCard (model) :
+    stream = io.StringIO()
+    writeParamCard(stream, model = model)
+    return stream.getvalue()
+
+def writeCardText (card) :
+    stream = io.StringIO()
+    writeParamCard(stream, card)
+    return stream.getvalue()
+
+def testTensorsUseTheMatrixLayout () :
+    card = readParamCard(io.StringIO(writeCard(makeModel())))
+    assert list(card['YUKAWA']) == [(1, 1), (1, 2), (2, 1), (2, 2)]
+    assert card['IMYUKAWA'] == OrderedDict([((1, 2), 0.5), ((2, 1), -0.5)])
+    assert card['MASS'] == OrderedDict([(23, 91.1876)])
+
+def testRoundTripKeepsComplexValues () :
+    model = makeModel()
+    text = writeCard(model)
+    target = makeModel()
+    for block in target.blocks.values() :
+        for param in block.externParamsByOrderBlock.values() :
+            param.value = numpy.zeros_like(param.value) \
+                if numpy.shape(param.value) else 0.
+    assert applyParamCard(readParamCard(io.StringIO(text)), model = target) == []
+    for name, block in model.blocks.items() :
+        for code, param in block.externParamsByOrderBlock.items() :
+            value = target.blocks[name].externParamsByOrderBlock[code].value
+            assert numpy.array_equal(value, param.value)
+
+def testStringEntriesAreKept () :
+    text = """
+BLOCK SPINFO
+  1 SOFTSUSY   # program
+  2 4.0.1
+  3 Some warning message
+BLOCK MASS
+  23 9.11876e+01
+"""
+    card = readParamCard(io.StringIO(text))
+    assert card['SPINFO'] == OrderedDict([(1, 'SOFTSUSY'), (2, '4.0.1'),
+        (3, 'Some warning message')])
+    model = makeModel()
+    unmatched = applyParamCard(card, model = model)
+    assert ('SPINFO', 1) in unmatched
+    assert model.blocks['MASS'].externParamsByOrderBlock[23].value == 91.1876
+    assert 'SOFTSUSY' in ''.join(writeCardText(card))
+
+def testConcatenatedCardsAreSeparated () :
+    cards = [OrderedDict([('MASS', OrderedDict([(23, 91.)]))]),
+        OrderedDict([('MASS', OrderedDict([(23, 92.)])),
+            ('EXTRA', OrderedDict([(1, 1.)]))]),
+        OrderedDict([('EXTRA', OrderedDict([(1, 2.)]))])]
+    stream = io.StringIO()
+    writeParamCards(stream, iter(cards))
+    assert list(iterParamCards(io.StringIO(stream.getvalue()))) == cards
+
+def testUntaggedCardsSplitOnRepeatedBlocks () :
+    text = 'BLOCK A\n 1 1.\nBLOCK B\n 1 2.\nBLOCK A\n 1 3.\n'
+    cards = list(iterParamCards(io.StringIO(text)))
+    assert [list(card) for card in cards] == [['A', 'B'], ['A']]
+
+def testTensorSharingItsBlockCannotBeWritten () :
+    model = Model()
+    ExternTensorParam(['generation', 'generation'], [[1., 0.], [0., 1.]],
+        'MIX', complexParameter = False, model = model)
+    ExternTensorParam(['generation', 'generation'], [[2., 0.], [0., 2.]],
+        'MIX', complexParameter = False, model = model)
+    with pytest.raises(ValueError) :
+        writeCard(model)
+    assert cardFromBlocks(model = model)['MIX']
@@ -0,0 +1,64 @@
+################################################################################
+# Tests of the columnar on-disk storage of scan results
+################################################################################
+
+# packages
+from collections import OrderedDict
+
+import numpy
+import pytest
+
+from src.parameter.store import MANIFEST_NAME, ScanStore
+
+g_layout = OrderedDict([('MT', ((), numpy.float64)),
+    ('yuk', ((2, 2), numpy.complex128))])
+
+def testAppendAndReadBack (tmpdir) :
+    directory = str(tmpdir.join('store'))
+    store = ScanStore(directory, 'w', g_layout)
+    store.append({'MT': [170., 172.], 'yuk': numpy.eye(2) * 1j})
+    store = ScanStore(directory, 'a', g_layout)
+    store.append({'MT': [174.], 'yuk': numpy.ones((1, 2, 2))})
+    store = ScanStore(directory)
+    assert len(store) == 3 and 'yuk' in store
+    assert store['MT'].tolist() == [170., 172., 174.]
+    assert store['yuk'].shape == (3, 2, 2) and store['yuk'][1, 1, 1] == 1j
+    assert numpy.load(store.path('MT')).tolist() == [170., 172., 174.]
+    with pytest.raises(ValueError) :
+        store.append({'MT': [1.], 'yuk': numpy.eye(2)})
+
+def testReservedPointsAreHiddenUntilCommitted (tmpdir) :
+    store = ScanStore(str(tmpdir), 'w', g_layout)
+    start = store.reserve(2)
+    region = store.region('MT', start, start + 2)
+    region[:] = [1., 2.]
+    region.flush()
+    del region
+    assert len(ScanStore(str(tmpdir))) == 0
+    store.commit(2)
+    assert ScanStore(str(tmpdir)).column('MT').tolist() == [1., 2.]
+
+def testOverwritingRemovesTheStaleColumns (tmpdir) :
+    directory = tmpdir.join('store')
+    store = ScanStore(str(directory), 'w', g_layout)
+    store.append({'MT': [170.], 'yuk': numpy.eye(2)})
+    store = ScanStore(str(directory), 'w', OrderedDict([('MH', ((), 'f8'))]))
+    assert sorted(x.basename for x in directory.listdir()) == \
+        ['MH.npy', MANIFEST_NAME]
+    assert [x.basename for x in tmpdir.listdir()] == ['store']
+    store.append({'MH': [125.]})
+    reread = ScanStore(str(directory))
+    assert list(reread.parameters) == ['MH'] and len(reread) == 1
+
+def testOtherDirectoriesAreNotOverwritten (tmpdir) :
+    tmpdir.join('notes.txt').write('keep me')
+    with pytest.raises(ValueError) :
+        ScanStore(str(tmpdir), 'w', g_layout)
+    assert tmpdir.join('notes.txt').read() == 'keep me'
+
+def testAppendingChecksTheParameters (tmpdir) :
+    ScanStore(str(tmpdir), 'w', g_layout)
+    with pytest.raises(ValueError) :
+        ScanStore(str(tmpdir), 'a', OrderedDict([('MT', ((), numpy.float64))]))
+    with pytest.raises(ValueError) :
+        ScanStore(str(tmpdir), 'x')
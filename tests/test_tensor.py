@@ -0,0 +1,69 @@
+################################################################################
+# Tests of the batched tensor parameters
+################################################################################
+
+# packages
+import numpy
+import pytest
+
+from src.parameter.parameter import ExternParam, ExternTensorParam, \
+    InternTensorParam, Model
+from src.parameter.scan import ParallelScan
+from src.parameter.tensor import checkTensorProperties, rejectedPoints, \
+    stackTensor, tensorShape
+
+def rotations (angles) :
+    cos, sin = numpy.cos(angles), numpy.sin(angles)
+    return numpy.stack([numpy.stack([cos, -sin], -1),
+        numpy.stack([sin, cos], -1)], -2)
+
+def testShapesAndStacks () :
+    model = Model()
+    assert tensorShape(ExternTensorParam(['g'], [1., 2., 3.], 'V',
+        model = model)) == (3,)
+    assert tensorShape(InternTensorParam(['g', 'g'],
+        {(0, 0): 'x', (2, 1): 'y'})) == (3, 2)
+    stack = stackTensor({(0, 0): numpy.array([1., 2.]), (1, 1): 1j}, (2, 2), (2,))
+    assert stack.shape == (2, 2, 2) and stack.dtype.kind == 'c'
+    assert stack[:, 0, 0].tolist() == [1., 2.] and stack[:, 1, 1].tolist() == [1j, 1j]
+    assert not stack[:, 0, 1].any()
+
+def testPropertiesAreCheckedAtAllPoints () :
+    stack = rotations(numpy.linspace(0., 3., 4))
+    stack[2, 0, 0] = 2.
+    masks = checkTensorProperties(stack, unitary = True, orthogonal = True,
+        hermitian = True)
+    assert masks['unitary'].tolist() == [False, False, True, False]
+    assert masks['orthogonal'].tolist() == [False, False, True, False]
+    assert masks['hermitian'].tolist() == [False, True, True, True]
+    phases = numpy.exp(1j * numpy.array([0.3, 1.2]))[:, None, None] * numpy.eye(2)
+    masks = checkTensorProperties(phases, unitary = True, orthogonal = True)
+    assert not masks['unitary'].any() and masks['orthogonal'].all()
+    assert checkTensorProperties(stack) == {}
+    with pytest.raises(ValueError) :
+        checkTensorProperties(numpy.zeros((3, 2, 3)), unitary = True)
+
+def testRejectedPointsOfTheDeclaredProperties () :
+    model = Model()
+    parameters = {'R': ExternTensorParam(['g', 'g'], numpy.eye(2), 'MIX',
+        orthogonal = True, model = model),
+        'H': ExternTensorParam(['g', 'g'], numpy.eye(2), 'HMIX', model = model)}
+    stack = rotations(numpy.array([0., 1.]))
+    stack[1] *= 1.1
+    rejected = rejectedPoints(parameters, {'R': stack, 'H': stack})
+    assert list(rejected) == [('R', 'orthogonal')]
+    assert rejected[('R', 'orthogonal')].tolist() == [False, True]
+
+def testScansValidateTheTensors () :
+    model = Model()
+    parameters = {'theta': ExternParam(0., model = model),
+        'scale': ExternParam(1., model = model),
+        'R': InternTensorParam(['g', 'g'], {(0, 0): 'scale*cmath.cos(theta)',
+            (0, 1): '-cmath.sin(theta)', (1, 0): 'cmath.sin(theta)',
+            (1, 1): 'cmath.cos(theta)'}, unitary = True)}
+    scan = ParallelScan(parameters, workers = 1)
+    results = scan.run({'theta': [0., 0.5], 'scale': [1., 2.]})
+    assert scan.columns[-4:] == ['R[0,0]', 'R[0,1]', 'R[1,0]', 'R[1,1]']
+    assert scan.tensorStack(results, 'R').shape == (4, 2, 2)
+    assert scan.validate(results).tolist() == [False, True, False, True]
+    assert list(scan.rejected) == [('R', 'unitary')]
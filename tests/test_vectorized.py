@@ -0,0 +1,111 @@
+################################################################################
+# Tests of the vectorized evaluation of the models
+################################################################################
+
+# packages
+import cmath
+
+import numpy
+import pytest
+
+from src.parameter.evaluator import ParameterEvaluator
+from src.parameter.jacobian import JacobianEvaluator
+from src.parameter.parameter import ExternParam, ExternTensorParam, \
+    InternParam, InternTensorParam, Model
+from src.parameter.vectorized import VectorizedEvaluator, broadcastShape
+
+def makeParameters () :
+    model = Model()
+    return {'x': ExternParam(4., model = model),
+        'y': ExternParam(1., model = model),
+        'r': InternParam('cmath.sqrt(x) + y', False),
+        'c': InternParam('2*r', True)}
+
+def recordComplexCalls (evaluator) :
+    calls = []
+    function = evaluator.complexFunction
+    def complexFunction (*inputs) :
+        calls.append(inputs)
+        return function(*inputs)
+    evaluator._complexFunction = complexFunction
+    return calls
+
+def testBroadcastShapes () :
+    assert broadcastShape([(3, 1), (2,), ()]) == (3, 2)
+    assert broadcastShape([]) == ()
+    with pytest.raises(ValueError) :
+        broadcastShape([(3,), (2,)])
+
+def testArraysMatchThePointwiseEvaluation () :
+    parameters = makeParameters()
+    pointwise = ParameterEvaluator(parameters)
+    x = numpy.array([[1.], [2.], [3.]])
+    y = numpy.array([0.5, 1.5])
+    values = VectorizedEvaluator(parameters).evaluate(x = x, y = y)
+    assert values['x'].shape == values['y'].shape == values['c'].shape == (3, 2)
+    assert not values['r'].flags.writeable
+    for i in range(3) :
+        for j in range(2) :
+            point = pointwise.evaluate(x = x[i, 0], y = y[j])
+            assert all(values[symbol][i, j] == value
+                for symbol, value in point.items())
+
+def testTensorParametersAreStacked () :
+    model = Model()
+    parameters = {'x': ExternParam(2., model = model),
+        'm': ExternTensorParam(['g', 'g'], [[1., 2.], [3., 4.]], 'MIX',
+            complexParameter = False, model = model),
+        't': InternTensorParam(['g', 'g'], {(0, 0): 'x*m[0, 0]',
+            (1, 1): 'm[1, 1] + x'})}
+    values = VectorizedEvaluator(parameters).evaluate(x = numpy.array([1., 2., 3.]))
+    assert values['m'].shape == values['t'].shape == (3, 2, 2)
+    assert values['m'][2].tolist() == [[1., 2.], [3., 4.]]
+    assert values['t'][:, 0, 0].tolist() == [1., 2., 3.]
+    assert values['t'][:, 1, 1].tolist() == [5., 6., 7.]
+    assert not values['t'][:, 0, 1].any()
+
+def testRealScanStaysReal () :
+    evaluator = VectorizedEvaluator(makeParameters())
+    calls = recordComplexCalls(evaluator)
+    values = evaluator.evaluate(x = numpy.array([1., 4., 9.]))
+    assert values['r'].tolist() == [2., 3., 4.]
+    assert values['r'].dtype.kind == 'f' and not calls
+
+def testNanInputsDoNotTriggerTheComplexFallback () :
+    evaluator = VectorizedEvaluator(makeParameters())
+    calls = recordComplexCalls(evaluator)
+    values = evaluator.evaluate(x = numpy.array([4., numpy.nan, 9.]))
+    assert not calls
+    assert values['r'].dtype.kind == 'f'
+    assert numpy.isnan(values['r'][1])
+    assert values['r'][[0, 2]].tolist() == [3., 4.]
+
+def testComplexFallbackOnlyAtTheFailedPoints () :
+    evaluator = VectorizedEvaluator(makeParameters())
+    calls = recordComplexCalls(evaluator)
+    x = numpy.array([[4., -1.], [numpy.nan, -4.]])
+    values = evaluator.evaluate(x = x, y = numpy.array([1., 2.]))
+    assert len(calls) == 1
+    assert calls[0][0].tolist() == [-1., -4.]
+    assert calls[0][1].tolist() == [2., 2.]
+    assert values['r'].shape == (2, 2)
+    assert values['r'][0].tolist() == [3., 2. + 1j]
+    assert values['r'][1, 1] == 2. + 2j
+    assert cmath.isnan(values['r'][1, 0])
+    assert values['c'][0].tolist() == [6., 4. + 2j]
+
+def testComplexAcosh () :
+    model = Model()
+    evaluator = VectorizedEvaluator({'x': ExternParam(2., model = model),
+        'a': InternParam('cmath.acosh(x)', True)})
+    values = evaluator.evaluate(x = numpy.array([0.5, 2., -3.]))
+    expected = [cmath.acosh(x) for x in (0.5, 2., -3.)]
+    assert numpy.allclose(values['a'], expected)
+    assert evaluator.evaluate(x = numpy.array([2., 3.]))['a'].dtype.kind == 'f'
+
+def testJacobianAtTheFailedPoints () :
+    evaluator = JacobianEvaluator(makeParameters())
+    values, jacobian = evaluator.jacobian(['x'], x = numpy.array([4., -1.]))
+    assert values['r'].tolist() == [3., 1. + 1j]
+    assert numpy.allclose(jacobian['r'][:, 0], [0.25, -0.5j])
+    assert numpy.allclose(jacobian['c'][:, 0], [0.5, -1j])